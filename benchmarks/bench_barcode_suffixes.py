@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Times expanding query rows to barcodes with appended info
+
+get_surveys maps every result row for a base barcode to the requested
+barcodes made from it, e.g. 000001234.a and 000001234.b for reruns. This
+compares the old linear scan over all barcodes with appended info against
+the index from index_barcode_suffixes as the number of them grows. The index
+should scale close to linearly, the scan quadratically. Needs no database.
+
+Usage: python benchmarks/bench_barcode_suffixes.py
+"""
+from __future__ import division
+from time import time
+
+import click
+
+from knimin.lib.util import index_barcode_suffixes
+
+# roughly the number of answer rows per barcode in a pulldown
+ROWS_PER_BARCODE = 10
+
+
+def _make_barcodes(num_bases):
+    bases = ['%09d' % i for i in range(num_bases)]
+    special = ['%s.%s' % (b, s) for b in bases for s in 'ab']
+    rows = [b for b in bases for _ in range(ROWS_PER_BARCODE)]
+    return special, rows
+
+
+def scan(special, rows):
+    """Number of barcodes the rows resolve to, scanning the list"""
+    special_bc = sorted(special)
+    total = 0
+    for barcode in rows:
+        match = [x for x in special_bc if barcode in x]
+        if not match:
+            match = [barcode]
+        total += len(match)
+    return total
+
+
+def index(special, rows):
+    """Number of barcodes the rows resolve to, using the index"""
+    special_bc = index_barcode_suffixes(special)
+    total = 0
+    for barcode in rows:
+        match = special_bc.get(barcode, [barcode])
+        total += len(match)
+    return total
+
+
+@click.command()
+@click.option('-s', '--sizes', default='250,500,1000,2000',
+              help='Comma separated numbers of base barcodes, each with two '
+                   'barcodes with appended info')
+@click.option('--skip-scan', is_flag=True,
+              help='Only time the index, the scan is slow on large sizes')
+def bench(sizes, skip_scan):
+    click.echo('%8s %8s %10s %10s' % ('barcodes', 'rows', 'scan (s)',
+                                      'index (s)'))
+    for size in [int(s) for s in sizes.split(',')]:
+        special, rows = _make_barcodes(size)
+        times = []
+        totals = set()
+        for func in (scan, index):
+            if func is scan and skip_scan:
+                times.append(float('nan'))
+                continue
+            start = time()
+            totals.add(func(special, rows))
+            times.append(time() - start)
+        # both must resolve the rows to the same barcodes
+        assert len(totals) == 1, totals
+        click.echo('%8d %8d %10.3f %10.4f' % (len(special), len(rows),
+                                              times[0], times[1]))
+
+
+if __name__ == '__main__':
+    bench()
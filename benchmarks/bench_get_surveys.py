@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""Times fetching survey answers for a pulldown
+
+Compares get_surveys as it used to be, three separate SINGLE, MULTIPLE and
+STRING/TEXT queries each assembled on their own, against get_surveys now,
+one UNION ALL query. Both are timed end to end, from the queries to the
+returned answers, and must return the same answers. Needs a database
+configured through KNIMIN_CONFIG_FP.
+
+Usage: python benchmarks/bench_get_surveys.py -n 30000
+"""
+from __future__ import division
+from collections import defaultdict
+from re import sub
+from time import time
+
+import click
+
+from knimin import db
+
+_joins = """JOIN ag.survey_question USING (survey_question_id)
+            JOIN ag.survey_question_response_type USING (survey_question_id)
+            JOIN ag.group_questions USING (survey_question_id)
+            JOIN ag.surveys S USING (survey_group)"""
+
+single_sql = """SELECT S.survey_id, barcode, question_shortname, response
+                FROM ag.ag_kit_barcodes
+                JOIN ag.survey_answers USING (survey_id)
+                %s
+                WHERE survey_response_type='SINGLE'
+                    AND (withdrawn IS NULL OR withdrawn != 'Y')
+                    AND barcode in %%s""" % _joins
+
+multiple_sql = """SELECT S.survey_id, barcode, question_shortname,
+                         array_agg(response) as responses
+                  FROM ag.ag_kit_barcodes
+                  JOIN ag.survey_answers USING (survey_id)
+                  %s
+                  WHERE survey_response_type='MULTIPLE'
+                      AND (withdrawn IS NULL OR withdrawn != 'Y')
+                      AND barcode in %%s
+                  GROUP BY S.survey_id, barcode, question_shortname""" % _joins
+
+others_sql = """SELECT S.survey_id, barcode, question_shortname, response
+                FROM ag.ag_kit_barcodes
+                JOIN ag.survey_answers_other USING (survey_id)
+                %s
+                WHERE survey_response_type IN ('STRING', 'TEXT')
+                    AND (withdrawn IS NULL OR withdrawn != 'Y')
+                    AND barcode IN %%s""" % _joins
+
+multiple_responses_sql = """
+    SELECT question_shortname, response
+    FROM survey_question
+    JOIN survey_question_response_type USING (survey_question_id)
+    JOIN survey_question_response USING (survey_question_id)
+    WHERE survey_response_type = 'MULTIPLE'"""
+
+
+def _format_responses(sql, bc, special_bc, multiples_headers,
+                      json=False, multiple=False):
+    """Answers of one old query by survey and barcode"""
+    ret_dict = defaultdict(lambda: defaultdict(dict))
+    for survey, barcode, q, a in db._con.execute_fetchall(sql, [bc]):
+        match = [x for x in special_bc if barcode in x] or [barcode]
+        if json:
+            a = a.decode('utf-8').strip('"\'[]_,\t\r\n\\/ ')
+        if multiple:
+            answers = {header: 'Yes' if response in a else 'No'
+                       for response, header in multiples_headers[q].items()}
+        else:
+            answers = {q: a}
+        for bcs in match:
+            ret_dict[survey][bcs].update(answers)
+    return ret_dict
+
+
+def old_get_surveys(barcodes):
+    """get_surveys before it ran one query, kept to time it against"""
+    multiples_headers = defaultdict(dict)
+    for question, response in db._con.execute_fetchall(
+            multiple_responses_sql):
+        header = '_'.join([question, sub(r'\W', '',
+                                         response.replace(" ", "_"))])
+        multiples_headers[question][response] = header.upper()
+
+    special_bc = sorted(b for b in barcodes if len(b) > 9)
+    bc = tuple(set(b[:9] for b in barcodes))
+    args = (bc, special_bc, multiples_headers)
+    single_results = _format_responses(single_sql, *args)
+    others_results = _format_responses(others_sql, *args, json=True)
+    multiple_results = _format_responses(multiple_sql, *args, multiple=True)
+    for survey, survey_barcodes in single_results.items():
+        for barcode in survey_barcodes:
+            single_results[survey][barcode].update(
+                others_results[survey][barcode])
+            single_results[survey][barcode].update(
+                multiple_results[survey][barcode])
+    return single_results
+
+
+def _plain(surveys):
+    """Answers as plain dicts, to compare them"""
+    return {survey: {barcode: dict(answers)
+                     for barcode, answers in survey_barcodes.items()}
+            for survey, survey_barcodes in surveys.items()}
+
+
+def _timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time()
+        func()
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@click.command()
+@click.option('-n', '--num-barcodes', type=int, default=30000,
+              help='Number of consented barcodes to pull down')
+@click.option('-r', '--repeat', type=int, default=3,
+              help='Runs per measurement, the best one is reported')
+def bench(num_barcodes, repeat):
+    sql = """SELECT DISTINCT barcode
+             FROM ag.ag_kit_barcodes
+             WHERE survey_id IS NOT NULL
+             ORDER BY barcode LIMIT %s"""
+    barcodes = [x[0] for x in db._con.execute_fetchall(sql, [num_barcodes])]
+    click.echo('%d barcodes' % len(barcodes))
+
+    # the answers must agree before timing them
+    old_answers = _plain(old_get_surveys(barcodes))
+    new_answers = _plain(db.get_surveys(barcodes))
+    assert old_answers == new_answers
+
+    old = _timed(lambda: old_get_surveys(barcodes), repeat)
+    new = _timed(lambda: db.get_surveys(barcodes), repeat)
+    click.echo('get_surveys, three queries: %.2fs' % old)
+    click.echo('get_surveys, one query:     %.2fs' % new)
+    click.echo('speedup: %.2fx' % (old / new))
+
+
+if __name__ == '__main__':
+    bench()
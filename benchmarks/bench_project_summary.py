@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Times the barcode counts of the projects summary page
+
+Compares fetching every barcode of every project to count them, as the
+projects summary page used to, against the single GROUP BY query behind
+project_summary, and against project_summary served from memory. Needs a
+database configured through KNIMIN_CONFIG_FP.
+
+Usage: python benchmarks/bench_project_summary.py -r 5
+"""
+from __future__ import division
+from time import time
+
+import click
+
+from knimin import db
+
+
+def _timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time()
+        func()
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@click.command()
+@click.option('-r', '--repeat', type=int, default=3,
+              help='Runs per measurement, the best one is reported')
+def bench(repeat):
+    projects = db.getProjectNames()
+    click.echo('%d projects' % len(projects))
+
+    def barcode_lists():
+        return [(p, len(db.get_barcodes_for_projects([p])))
+                for p in projects]
+
+    def group_by():
+        return db._load_project_summary()
+
+    def cached():
+        return db.project_summary()
+
+    # the counts must agree before timing them
+    old_counts = dict(barcode_lists())
+    new_counts = {p['project']: p['barcodes'] for p in group_by()}
+    assert old_counts == new_counts, (old_counts, new_counts)
+    db.project_summary()
+
+    old = _timed(barcode_lists, repeat)
+    new = _timed(group_by, repeat)
+    mem = _timed(cached, repeat)
+    click.echo('barcode lists, one query a project: %.4fs' % old)
+    click.echo('project_summary, one query:        %.4fs' % new)
+    click.echo('project_summary, from memory:      %.6fs' % mem)
+    click.echo('speedup of the query: %.2fx' % (old / new))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Times the AG search with and without its trigram indexes
+
+Runs the searches AGSearchHandler runs for a term, on connections with
+index scans turned off, as the searches ran before the indexes, and on
+connections allowed to use them. Needs a database configured through
+KNIMIN_CONFIG_FP, with the indexes from
+knimin/db/patches/0002_search_indexes.sql.
+
+Usage: python benchmarks/bench_search.py -r 5 tst_ example@
+"""
+from __future__ import division
+from time import time
+
+import click
+
+from knimin import config, db
+from knimin.lib.data_access import KniminAccess, SQLHandler
+
+
+def _timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time()
+        func()
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _searches(access, term):
+    """The searches AGSearchHandler runs for a term"""
+    return (sorted((r['type'], r['id'], r['ag_login_id'])
+                   for r in access.search(term, limit=None)),
+            sorted(r['kit_id'] for r in access.search_handout_kits(term)))
+
+
+@click.command()
+@click.option('-r', '--repeat', type=int, default=3,
+              help='Runs per measurement, the best one is reported')
+@click.argument('terms', nargs=-1, required=True)
+def bench(repeat, terms):
+    # connections not allowed to use the indexes, searching as before them
+    scan = KniminAccess(config)
+    scan._con = SQLHandler(config, setup_sql=[
+        'set search_path to ag, barcodes, public',
+        'set enable_indexscan to off', 'set enable_bitmapscan to off'])
+
+    for term in terms:
+        # the matches must agree before timing them
+        assert _searches(scan, term) == _searches(db, term), term
+        old = _timed(lambda: _searches(scan, term), repeat)
+        new = _timed(lambda: _searches(db, term), repeat)
+        click.echo('%-20s full scans: %.4fs  indexes: %.4fs  (%.2fx)'
+                   % (term, old, new, old / new))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""Times formatting human survey answers for the metadata pulldown
+
+Compares formatting every barcode with format_human_barcode, as
+format_survey_data used to, against format_human_frame followed by
+format_human_barcode for the barcodes it leaves, as format_survey_data does
+now. Both are run on the same synthetic answers, a share of them failing
+formatting, and must give the same metadata and errors. Needs no database.
+
+Usage: python benchmarks/bench_survey_format.py -n 50000
+"""
+from __future__ import division
+from datetime import datetime, date, time
+from random import choice, random, seed
+from time import time as now
+
+import click
+
+from knimin.lib.constants import md_lookup
+from knimin.lib.survey_format import format_human_barcode, format_human_frame
+
+ZIP_LOOKUP = {'92037': {'USA': (32.8, -117.2, 100.1, 'CA')},
+              '80301': {'USA': (40.0, -105.2, 1600.0, 'CO')},
+              '10001': {'USA': (40.8, -74.0, 10.0, 'NY')},
+              'SW1A': {'United Kingdom': (51.5, -0.1, 5.0, 'Unspecified')}}
+COUNTRY_LOOKUP = {'USA': 'USA', 'United Kingdom': 'United Kingdom'}
+# answers a pulldown has per barcode besides the ones formatting uses
+OTHER_ANSWERS = 150
+
+
+def _make_answers(num_barcodes, fail_rate):
+    rows = {}
+    info = {}
+    dates = [date(2015, 1, 1 + d) for d in range(28)]
+    for i in range(num_barcodes):
+        barcode = '%09d' % i
+        zipcode, country = choice([('92037', 'USA'), ('80301', 'USA'),
+                                   ('10001', 'USA'),
+                                   ('sw1a', 'United Kingdom')])
+        row = {'HEIGHT_CM': choice(['160', '175', '5.9', '', '180 cm']),
+               'WEIGHT_KG': choice(['60', '82', '150', 'Unspecified']),
+               'HEIGHT_UNITS': choice(['centimeters', 'inches']),
+               'WEIGHT_UNITS': choice(['kilograms', 'pounds']),
+               'BIRTH_MONTH': choice(['January', 'June', 'Unspecified']),
+               'BIRTH_YEAR': str(1940 + i % 70), 'GENDER': 'Female',
+               'ZIP_CODE': zipcode, 'ALCOHOL_FREQUENCY': 'Never',
+               'DIABETES': 'I do not have this condition',
+               'IBD': 'I do not have this condition',
+               'ANTIBIOTIC_HISTORY': 'Month',
+               'IBD_DIAGNOSIS_REFINED': 'Unspecified'}
+        for q in range(OTHER_ANSWERS):
+            row[str('QUESTION_%d' % q)] = 'answer'
+        if random() < fail_rate:
+            row['BIRTH_MONTH'] = 'Smarch'
+        rows[barcode] = row
+        info[barcode] = {
+            'site_sampled': choice(list(md_lookup)), 'country': country,
+            'survey_id': 'survey%d' % i, 'sample_date': choice(dates),
+            'sample_time': choice([time(9, 30), time(14, 0), None]),
+            'participant_name': 'name', 'ag_login_id': 'login%d' % i}
+    return rows, info
+
+
+def _geocode(row, zipcode, country):
+    row['LATITUDE'] = ZIP_LOOKUP[zipcode][country][0]
+    row['LONGITUDE'] = ZIP_LOOKUP[zipcode][country][1]
+    row['ELEVATION'] = ZIP_LOOKUP[zipcode][country][2]
+    row['STATE'] = ZIP_LOOKUP[zipcode][country][3]
+    row['COUNTRY'] = COUNTRY_LOOKUP[country]
+    row['GEO_LOC_NAME'] = ':'.join([row['COUNTRY'], row['STATE']])
+    return row
+
+
+def by_barcode(rows, info, barcodes, when):
+    errors = {}
+    for barcode in barcodes:
+        try:
+            format_human_barcode(barcode, rows[barcode], info[barcode[:9]],
+                                 {}, _geocode, when)
+        except Exception as e:
+            errors[barcode] = str(e)
+            del rows[barcode]
+    return errors
+
+
+def by_frame(rows, info, when):
+    remaining = format_human_frame(rows, info, ZIP_LOOKUP, COUNTRY_LOOKUP,
+                                   {}, when)
+    return by_barcode(rows, info, remaining, when)
+
+
+@click.command()
+@click.option('-n', '--num-barcodes', default=50000,
+              help='Number of human barcodes to format')
+@click.option('--fail-rate', default=0.01,
+              help='Share of barcodes failing formatting')
+@click.option('-r', '--repeats', default=3,
+              help='Times to run each, the fastest is reported')
+def bench(num_barcodes, fail_rate, repeats):
+    seed(0)
+    rows, info = _make_answers(num_barcodes, fail_rate)
+    when = datetime.now()
+    best = {}
+    results = {}
+    for _ in range(repeats):
+        for name in ('barcode', 'frame'):
+            md = {b: dict(r) for b, r in rows.items()}
+            details = {b: dict(i) for b, i in info.items()}
+            start = now()
+            if name == 'barcode':
+                errors = by_barcode(md, details, list(md), when)
+            else:
+                errors = by_frame(md, details, when)
+            best[name] = min(best.get(name, float('inf')), now() - start)
+            results[name] = (md, errors)
+    if results['barcode'] != results['frame']:
+        raise click.ClickException('Frame and barcode results differ')
+
+    click.echo('%d barcodes, %d errors' % (
+        num_barcodes, len(results['frame'][1])))
+    click.echo('by barcode: %.3f s' % best['barcode'])
+    click.echo('by frame:   %.3f s (%.2fx)' % (
+        best['frame'], best['barcode'] / best['frame']))
+
+
+if __name__ == '__main__':
+    bench()
@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 from knimin.lib.configuration import config
 from knimin.lib.data_access import KniminAccess
+from knimin.lib.async_access import AsyncKniminAccess
+from knimin.lib.jobs import JobTracker
 
 db = KniminAccess(config)
+# one worker per pooled connection, so workers never wait on the pool
+async_db = AsyncKniminAccess(db, config.db_pool_max)
+# long tasks run in the background, e.g. creating thousands of kits
+jobs = JobTracker()
 
-__all__ = ['db']
+__all__ = ['db', 'async_db', 'jobs']
@@ -0,0 +1,20 @@
+-- Kit IDs of handout kits are reserved with INSERT ... ON CONFLICT (kit_id),
+-- which needs a unique index on kit_id. Created only if no unique index on
+-- kit_id alone exists yet; fails if handout kits share a kit ID.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+            SELECT 1
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_attribute a ON a.attrelid = c.oid
+                AND a.attnum = i.indkey[0]
+            WHERE n.nspname = 'ag' AND c.relname = 'ag_handout_kits'
+                AND i.indisunique AND i.indnatts = 1
+                AND a.attname = 'kit_id') THEN
+        CREATE UNIQUE INDEX ag_handout_kits_kit_id_key
+            ON ag.ag_handout_kits (kit_id);
+    END IF;
+END
+$$;
@@ -0,0 +1,31 @@
+-- Indexes for the AG search. The logins, kits, barcodes and handout kits
+-- are searched with LIKE '%term%', which without trigram indexes scans the
+-- whole tables. Needs a user allowed to create the pg_trgm extension.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- the verification code is only matched exactly
+CREATE INDEX IF NOT EXISTS ag_kit_kit_verification_code_lower
+    ON ag.ag_kit (lower(kit_verification_code));
+
+CREATE INDEX IF NOT EXISTS ag_login_email_trgm
+    ON ag.ag_login USING gin ((lower(email)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_login_name_trgm
+    ON ag.ag_login USING gin ((lower(name)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_login_address_trgm
+    ON ag.ag_login USING gin ((lower(address)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_kit_supplied_kit_id_trgm
+    ON ag.ag_kit USING gin ((lower(supplied_kit_id)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_kit_kit_password_trgm
+    ON ag.ag_kit USING gin ((lower(kit_password)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_kit_ag_kit_id_trgm
+    ON ag.ag_kit USING gin ((cast(ag_kit_id as varchar(100))) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_kit_barcodes_barcode_trgm
+    ON ag.ag_kit_barcodes USING gin ((barcode) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_kit_barcodes_notes_trgm
+    ON ag.ag_kit_barcodes USING gin ((lower(notes)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_login_surveys_participant_name_trgm
+    ON ag.ag_login_surveys USING gin ((lower(participant_name)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_handout_kits_kit_id_trgm
+    ON ag.ag_handout_kits USING gin ((kit_id) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ag_handout_barcodes_barcode_trgm
+    ON ag.ag_handout_barcodes USING gin ((barcode) gin_trgm_ops);
@@ -1,6 +1,8 @@
+from tornado.gen import coroutine
+
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
-from knimin import db
+from knimin import async_db
 
 
 @set_access(['Base'])
@@ -8,9 +10,10 @@ class AGConsentCheckHandler(BaseHandler):
     def get(self):
         self.render('consent_check.html', consents=[], failures={})
 
+    @coroutine
     def post(self):
         barcodes = [b.strip() for b in
                     self.get_argument('barcodes').split('\n')]
-        consents, failures = db.check_consent(barcodes)
+        consents, failures = yield async_db.check_consent(barcodes)
         self.render('consent_check.html', consents=sorted(consents),
                     failures=failures)
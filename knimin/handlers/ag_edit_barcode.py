@@ -1,23 +1,28 @@
 #!/usr/bin/env python
 from tornado.web import authenticated
+from tornado.gen import coroutine
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 
-from knimin import db
+from knimin import async_db
 
 
 @set_access(['Search'])
 class AGEditBarcodeHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
         barcode = self.get_argument('barcode', None)
         if barcode is not None:
-            details = db.getAGBarcodeDetails(barcode)
-            ag_login_id = db.search_kits(details['ag_kit_id'])[0]
-            site_sampled = db.human_sites
-            environment_sampled = db.general_sites
-            participants = db.getHumanParticipants(ag_login_id) + \
-                db.getAnimalParticipants(ag_login_id)
+            details = yield async_db.getAGBarcodeDetails(barcode)
+            logins = yield async_db.search_kits(details['ag_kit_id'])
+            ag_login_id = logins[0]
+            site_sampled = async_db.human_sites
+            environment_sampled = async_db.general_sites
+            humans, animals = yield [
+                async_db.getHumanParticipants(ag_login_id),
+                async_db.getAnimalParticipants(ag_login_id)]
+            participants = humans + animals
             self.render("ag_edit_barcode.html", response=None, barcode=barcode,
                         sites_sampled=site_sampled, details=details,
                         environments_sampled=environment_sampled,
@@ -27,6 +32,7 @@ class AGEditBarcodeHandler(BaseHandler):
             self.set_status(400)
 
     @authenticated
+    @coroutine
     def post(self):
         barcode = self.get_argument('barcode')
         ag_kit_id = self.get_argument('ag_kit_id')
@@ -40,10 +46,10 @@ class AGEditBarcodeHandler(BaseHandler):
         withdrawn = self.get_argument('withdrawn')
 
         try:
-            db.updateAGBarcode(barcode, ag_kit_id, site_sampled,
-                               environment_sampled, sample_date,
-                               sample_time, participant_name,
-                               notes, refunded, withdrawn)
+            yield async_db.updateAGBarcode(
+                barcode, ag_kit_id, site_sampled, environment_sampled,
+                sample_date, sample_time, participant_name, notes, refunded,
+                withdrawn)
             self.render("ag_edit_barcode.html", response='Good', barcode=None,
                         sites_sampled=None, details=None,
                         environments_sampled=None,
@@ -1,24 +1,27 @@
 #!/usr/bin/env python
 from tornado.web import authenticated
+from tornado.gen import coroutine
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 from urllib import unquote
 
-from knimin import db
+from knimin import async_db
 
 
 @set_access(['Search'])
 class AGEditParticipantHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
         email = self.get_argument('email', None)
         if email is not None:
             email = unquote(email)
-            login = db.get_login_by_email(email)
+            login = yield async_db.get_login_by_email(email)
             self.render("ag_edit_participant.html", response=None,
                         login=login, currentuser=self.current_user)
 
     @authenticated
+    @coroutine
     def post(self):
         email = self.get_argument('email')
         name = self.get_argument('name')
@@ -29,8 +32,8 @@ class AGEditParticipantHandler(BaseHandler):
         country = self.get_argument('country')
         ag_login_id = self.get_argument('ag_login_id')
         try:
-            db.updateAGLogin(ag_login_id, email, name, address,
-                             city, state, zipcode, country)
+            yield async_db.updateAGLogin(ag_login_id, email, name, address,
+                                         city, state, zipcode, country)
             self.render("ag_edit_participant.html", response='Good',
                         login=None,
                         currentuser=self.current_user)
@@ -1,8 +1,9 @@
 from tornado.web import authenticated
+from tornado.gen import coroutine
 
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
-from knimin import db
+from knimin import async_db
 from knimin.lib.mem_zip import InMemoryZip
 
 
@@ -19,8 +20,9 @@ class AGNamesHandler(BaseHandler):
 
 class AGNamesDLHandler(BaseHandler):
     @authenticated
+    @coroutine
     def post(self):
-        participants = db.participant_names()
+        participants = yield async_db.participant_names()
         participants = '\n'.join(['\t'.join(r) for r in participants])
 
         meta_zip = InMemoryZip()
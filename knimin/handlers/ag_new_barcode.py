@@ -1,18 +1,20 @@
 #!/usr/bin/env python
 from tornado.web import authenticated, HTTPError
+from tornado.gen import coroutine
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 
 from knimin.lib.squash_barcodes import build_barcodes_pdf
-from knimin import db
+from knimin import async_db
 
 
 @set_access(['Barcodes'])
 class AGBarcodePrintoutHandler(BaseHandler):
     @authenticated
+    @coroutine
     def post(self):
         barcodes = self.get_argument('barcodes').split(",")
-        pdf = build_barcodes_pdf(barcodes)
+        pdf = yield async_db.run(build_barcodes_pdf, barcodes)
         self.add_header('Content-type',  'application/pdf')
         self.add_header('Content-Transfer-Encoding', 'binary')
         self.add_header('Accept-Ranges', 'bytes')
@@ -44,14 +46,17 @@ class AGBarcodeAssignedHandler(BaseHandler):
 @set_access(['Barcodes'])
 class AGNewBarcodeHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
-        project_names = db.getProjectNames()
-        remaining = len(db.get_unassigned_barcodes())
+        project_names, unassigned = yield [
+            async_db.getProjectNames(), async_db.get_unassigned_barcodes()]
+        remaining = len(unassigned)
         self.render("ag_new_barcode.html", currentuser=self.current_user,
                     projects=project_names, barcodes=[], remaining=remaining,
                     msg="", newbc=[],  assignedbc=[], assign_projects="")
 
     @authenticated
+    @coroutine
     def post(self):
         # create barcodes
         msg = ""
@@ -62,7 +67,7 @@ class AGNewBarcodeHandler(BaseHandler):
         num_barcodes = int(self.get_argument('numbarcodes'))
 
         if action == "create":
-            newbc = db.create_barcodes(num_barcodes)
+            newbc = yield async_db.create_barcodes(num_barcodes)
             msg = ("%d Barcodes created! Please wait for barcode download"
                    % num_barcodes)
 
@@ -71,9 +76,10 @@ class AGNewBarcodeHandler(BaseHandler):
             new_project = self.get_argument('newproject').strip()
             try:
                 if new_project:
-                    db.create_project(new_project)
+                    yield async_db.create_project(new_project)
                     projects.append(new_project)
-                assignedbc = db.assign_barcodes(num_barcodes, projects)
+                assignedbc = yield async_db.assign_barcodes(num_barcodes,
+                                                            projects)
             except ValueError as e:
                 msg = "ERROR! %s" % str(e)
             else:
@@ -84,8 +90,9 @@ class AGNewBarcodeHandler(BaseHandler):
         else:
             raise HTTPError(400, 'Unknown action: %s' % action)
 
-        project_names = db.getProjectNames()
-        remaining = len(db.get_unassigned_barcodes())
+        project_names, unassigned = yield [
+            async_db.getProjectNames(), async_db.get_unassigned_barcodes()]
+        remaining = len(unassigned)
         self.render("ag_new_barcode.html", currentuser=self.current_user,
                     projects=project_names, remaining=remaining, msg=msg,
                     newbc=newbc, assignedbc=assignedbc,
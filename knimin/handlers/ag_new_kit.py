@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 from json import loads
 from tornado.web import authenticated, HTTPError
+from tornado.gen import coroutine
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
-from knimin import db
+from knimin import async_db, db, jobs
 from knimin.lib.mem_zip import InMemoryZip
 from knimin.lib.util import get_printout_data
 
@@ -34,9 +35,11 @@ class AGNewKitDLHandler(BaseHandler):
 @set_access(['AG kits'])
 class AGNewKitHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
-        project_names = db.getProjectNames()
-        remaining = len(db.get_unassigned_barcodes())
+        project_names, unassigned = yield [
+            async_db.getProjectNames(), async_db.get_unassigned_barcodes()]
+        remaining = len(unassigned)
         self.render("ag_new_kit.html", projects=project_names,
                     currentuser=self.current_user, msg="", kitinfo=[],
                     fields="", remaining=remaining)
@@ -49,12 +52,29 @@ class AGNewKitHandler(BaseHandler):
         projects = self.get_arguments("projects")
         num_swabs = map(int, self.get_arguments("swabs"))
         num_kits = map(int, self.get_arguments("kits"))
-        kits = []
-        fields = ""
-        try:
-            kits = db.create_ag_kits(zip(num_swabs, num_kits), tag, projects)
-            fields = ','.join(kits[0]._fields)
-        except Exception as e:
-            raise HTTPError(500, "ERROR: %s" % str(e))
+        # hashing thousands of passwords takes minutes, so the kits are made
+        # in the background and AGNewKitStatusHandler reports on them
+        job_id = jobs.submit(self.current_user, db.create_ag_kits,
+                             zip(num_swabs, num_kits), tag, projects)
+        self.write({'job': job_id})
 
-        self.write({'kitinfo': kits, 'fields': fields})
+
+@set_access(['AG kits'])
+class AGNewKitStatusHandler(BaseHandler):
+    @authenticated
+    def get(self):
+        # the kit information has the plaintext passwords, so it is only
+        # handed out once
+        job = jobs.status(self.get_argument('job'), self.current_user,
+                          collect=True)
+        if job is None:
+            raise HTTPError(404, "No such job")
+        if job['status'] == 'failed':
+            raise HTTPError(500, "ERROR: %s" % job['error'])
+        status = {'status': job['status'], 'done': job['done'],
+                  'total': job['total']}
+        if job['status'] == 'done':
+            kits = job['result']
+            status['kitinfo'] = kits
+            status['fields'] = ','.join(kits[0]._fields) if kits else ""
+        self.write(status)
@@ -1,25 +1,28 @@
 from tornado.web import authenticated
+from tornado.gen import coroutine, Task
 from future.utils import viewitems
 
 from knimin.handlers.base import BaseHandler
-from knimin import db
-from knimin.lib.mem_zip import InMemoryZip
+from knimin import async_db
+from knimin.lib.mem_zip import StreamingZip
 from knimin.handlers.access_decorators import set_access
 
 
 @set_access(['Metadata Pulldown'])
 class AGPulldownHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
-        surveys = db.list_external_surveys()
+        surveys = yield async_db.list_external_surveys()
         self.render("ag_pulldown.html", currentuser=self.current_user,
                     barcodes=[], surveys=surveys, errors='')
 
     @authenticated
+    @coroutine
     def post(self):
         # Do nothing if no file given
         if 'barcodes' not in self.request.files:
-            surveys = db.list_external_surveys()
+            surveys = yield async_db.list_external_surveys()
             self.render("ag_pulldown.html", currentuser=self.current_user,
                         barcodes='', blanks='', external='', surveys=surveys,
                         errors="No barcode file given, thus nothing could "
@@ -38,7 +41,7 @@ class AGPulldownHandler(BaseHandler):
             external = ','.join(hold)
         else:
             external = ''
-        surveys = db.list_external_surveys()
+        surveys = yield async_db.list_external_surveys()
         self.render("ag_pulldown.html", currentuser=self.current_user,
                     barcodes=",".join(barcodes), blanks=",".join(blanks),
                     surveys=surveys, external=external, errors='')
@@ -47,6 +50,7 @@ class AGPulldownHandler(BaseHandler):
 @set_access(['Metadata Pulldown'])
 class AGPulldownDLHandler(BaseHandler):
     @authenticated
+    @coroutine
     def post(self):
         barcodes = self.get_argument('barcodes').split(',')
         if self.get_argument('blanks'):
@@ -57,35 +61,48 @@ class AGPulldownDLHandler(BaseHandler):
             external = self.get_argument('external').split(',')
         else:
             external = []
-        # Get metadata and create zip file
-        metadata, failures = db.pulldown(barcodes, blanks, external)
+        # Get metadata, spooled to temporary files per survey
+        surveys, failures = yield async_db.pulldown_iter(barcodes, blanks,
+                                                         external)
 
-        meta_zip = InMemoryZip()
-        failed = '\n'.join(['\t'.join(bc) for bc in viewitems(failures)])
-        failtext = ("The following barcodes were not retrieved "
-                    "for any survey:\n%s" % failed)
-        meta_zip.append("failures.txt", failtext)
-        for survey, meta in viewitems(metadata):
-            meta_zip.append('survey_%s_md.txt' % survey, meta)
-
-        # write out zip file
         self.add_header('Content-type',  'application/octet-stream')
         self.add_header('Content-Transfer-Encoding', 'binary')
         self.add_header('Accept-Ranges', 'bytes')
         self.add_header('Content-Encoding', 'none')
         self.add_header('Content-Disposition',
                         'attachment; filename=metadata.zip')
-        self.write(meta_zip.write_to_buffer())
-        self.flush()
+
+        # stream the zip file out as it is compressed, so the pulldown is
+        # never held in memory
+        meta_zip = StreamingZip()
+        for survey, blocks in surveys:
+            chunks = meta_zip.add('survey_%s_md.txt' % survey, blocks)
+            while True:
+                data = yield async_db.run(next, chunks, None)
+                if data is None:
+                    break
+                if self.request.connection.stream.closed():
+                    # client went away, so stop compressing for nobody
+                    return
+                self.write(data)
+                yield Task(self.flush)
+
+        failed = '\n'.join(['\t'.join(bc) for bc in viewitems(failures)])
+        failtext = ("The following barcodes were not retrieved "
+                    "for any survey:\n%s" % failed)
+        for data in meta_zip.add('failures.txt', [failtext.encode('utf-8')]):
+            self.write(data)
+        self.write(meta_zip.close())
         self.finish()
 
 
 @set_access(['Metadata Pulldown'])
 class UpdateEBIStatusHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
         try:
-            db.set_deposited_ebi()
+            yield async_db.set_deposited_ebi()
             msg = 'Successfully updated barcodes in database'
         except Exception as e:
             msg = 'ERROR: %s' % str(e)
@@ -1,62 +1,46 @@
 #!/usr/bin/env python
 from tornado.web import authenticated
+from tornado.gen import coroutine
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 
-from knimin import db
+from knimin import async_db
 
 
 @set_access(['Search'])
 class AGSearchHandler(BaseHandler):
+    # logins shown per page of results
+    page_size = 25
+
     @authenticated
     def get(self):
         self.render("ag_search.html", results=None, handouts=None,
                     currentuser=self.current_user)
 
     @authenticated
+    @coroutine
     def post(self):
         term = self.get_argument('search_term')
-        results = {}
-        # search participant info
-        logins = db.search_participant_info(term)
-        results = set(logins)
-        # search kit info and add to resluts
-        logins = db.search_kits(term)
-        results = results | set(logins)
-        #  search barcode and add to results
-        logins = db.search_barcodes(term)
-        results = results | set(logins)
-        # search handout kits
-        handouts = db.search_handout_kits(term)
+        try:
+            page = max(int(self.get_argument('page', 1)), 1)
+        except ValueError:
+            page = 1
+        # search participant info, kit info and barcodes in one query, and
+        # handout kits at the same time
+        matches, handouts = yield [async_db.search(term, limit=None),
+                                   async_db.search_handout_kits(term)]
+        logins = sorted({m['ag_login_id'] for m in matches
+                         if m['type'] != 'handout'})
 
-        # now take the ag_login_ids and collect the information to display
-        display_results = []  # list of dictionatries
-        for login in results:
-            login_display = {}
-            login_display['login_info'] = db.get_login_info(login)
-            login_display['humans'] = db.getHumanParticipants(
-                login)
-            login_display['animals'] = db.getAnimalParticipants(
-                login)
-            login_display['kit'] = db.get_kit_info_by_login(login)
-            for kit in login_display['kit']:
-                barcode_info = {}
-                ag_barcodes = db.get_barcode_info_by_kit_id(
-                    kit['ag_kit_id'])
-                barcode_info = {}
-                for ag_barcode in ag_barcodes:
-                    barcode_info[ag_barcode['barcode']] = {}
-                    barcode_info[ag_barcode['barcode']]['ag_info'] = ag_barcode
-                    lab_barcode_info = db.get_barcode_details(
-                        ag_barcode['barcode'])
-                    plate = db.get_plate_for_barcode(
-                        ag_barcode['barcode'])
-                    barcode_info[ag_barcode['barcode']]['barcode_info'] = \
-                        lab_barcode_info
-                    barcode_info[ag_barcode['barcode']]['plate'] = plate
-                kit['barcode_info'] = barcode_info
-            display_results.append(login_display)
+        # only collect the information to display for the page asked for
+        num_pages = max((len(logins) - 1) // self.page_size + 1, 1)
+        page = min(page, num_pages)
+        start = (page - 1) * self.page_size
+        display_results = yield async_db.load_search_results(
+            logins[start:start + self.page_size])
 
         # now render the page
         self.render("ag_search.html", results=display_results,
-                    handouts=handouts, currentuser=self.current_user)
+                    handouts=handouts, currentuser=self.current_user,
+                    search_term=term, page=page, num_pages=num_pages,
+                    num_results=len(logins))
@@ -2,15 +2,17 @@
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
 from tornado.web import authenticated
+from tornado.gen import coroutine
 
-from knimin import db
+from knimin import async_db
 
 
 @set_access(['Base'])
 class AGStatsHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
-        stats = db.getAGStats()
+        stats = yield async_db.getAGStats()
         for item, stat in stats:
             stat = '' if stat is None else stat
         self.render("ag_stats.html", stats=stats, loginerror='')
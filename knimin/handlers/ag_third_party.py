@@ -2,11 +2,12 @@
 from io import StringIO
 from future.utils import viewitems
 from tornado.web import authenticated
+from tornado.gen import coroutine
 from wtforms import (Form, SelectField, FileField, TextField, validators)
 
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
-from knimin import db
+from knimin import async_db
 
 
 class ThirdPartyData(Form):
@@ -33,16 +34,20 @@ class NewThirdParty(Form):
 @set_access(['External surveys'])
 class AGThirdPartyHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
         form = ThirdPartyData()
-        form.survey.choices = [(x, x) for x in db.list_external_surveys()]
+        surveys = yield async_db.list_external_surveys()
+        form.survey.choices = [(x, x) for x in surveys]
         self.render("ag_third_party.html", the_form=form,
                     errors='')
 
     @authenticated
+    @coroutine
     def post(self):
         form = ThirdPartyData()
-        form.survey.choices = [(x, x) for x in db.list_external_surveys()]
+        surveys = yield async_db.list_external_surveys()
+        form.survey.choices = [(x, x) for x in surveys]
         msg = ''
         seperators = {'comma': ',', 'tab': '\t', 'space': ' '}
 
@@ -59,7 +64,7 @@ class AGThirdPartyHandler(BaseHandler):
             "\r\n", "\n").replace("\r", "\n")
         file_body = StringIO(unicode(file_body), newline=None)
         try:
-            count = db.store_external_survey(
+            count = yield async_db.store_external_survey(
                 file_body, form.survey.data,
                 separator=seperators[form.seperator.data],
                 survey_id_col=form.survey_id.data, trim=form.trim.data)
@@ -83,6 +88,7 @@ class AGNewThirdPartyHandler(BaseHandler):
                     errors='')
 
     @authenticated
+    @coroutine
     def post(self):
         form = NewThirdParty()
         msg = ''
@@ -94,8 +100,8 @@ class AGNewThirdPartyHandler(BaseHandler):
             return
 
         try:
-            db.add_external_survey(form.name.data, form.description.data,
-                                   form.url.data)
+            yield async_db.add_external_survey(
+                form.name.data, form.description.data, form.url.data)
         except Exception as e:
             # Print any error that happens to the page
             msg = str(e)
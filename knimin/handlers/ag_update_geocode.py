@@ -1,24 +1,27 @@
 #!/usr/bin/env python
 from tornado.web import authenticated
+from tornado.gen import coroutine
 from knimin.handlers.base import BaseHandler
 
-from knimin import db
+from knimin import async_db
 
 
 class AGUpdateGeocodeHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
-        stats = db.getGeocodeStats()
+        stats = yield async_db.getGeocodeStats()
         self.render("ag_update_geocode.html", stats=stats,
                     currentuser=self.current_user)
 
     @authenticated
+    @coroutine
     def post(self):
         retry = int(self.get_argument("retry", 0))
         limit = int(self.get_argument('limit', -1))
         limit = None if limit == -1 else limit
-        db.addGeocodingInfo(limit, retry)
-        stats = db.getGeocodeStats()
+        yield async_db.addGeocodingInfo(limit, retry)
+        stats = yield async_db.getGeocodeStats()
 
         self.render("ag_update_geocode.html", stats=stats,
                     currentuser=self.current_user)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 
 from tornado.escape import json_encode
+from tornado.gen import coroutine
 
-from knimin import db
+from knimin import async_db
 from knimin.lib.data_access import IncorrectEmailError, IncorrectPasswordError
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
@@ -19,6 +20,7 @@ class AuthLoginHandler(BaseHandler):
     def get(self):
         self.redirect("/")
 
+    @coroutine
     def post(self):
         email = self.get_argument("email", "").strip().lower()
         password = self.get_argument("password", "")
@@ -27,7 +29,7 @@ class AuthLoginHandler(BaseHandler):
 
         success = False
         try:
-            success = db.authenticate_user(email, password)
+            success = yield async_db.authenticate_user(email, password)
         except IncorrectEmailError:
             msg = "Unknown user"
         except IncorrectPasswordError:
@@ -1,18 +1,21 @@
 #!/usr/bin/env python
 from tornado.web import authenticated
+from tornado.gen import coroutine, Return
 from knimin.handlers.base import BaseHandler
 from datetime import datetime
 
-from knimin import db
+from knimin import async_db
 from knimin.lib.constants import survey_type
 from knimin.lib.mail import send_email
 from knimin.handlers.access_decorators import set_access
 
 
 class BarcodeUtilHelper(object):
+    @coroutine
     def get_ag_details(self, barcode):
-        ag_details = db.getAGBarcodeDetails(barcode)
-        _, failures = db.pulldown([barcode], [])
+        ag_details, (_, failures) = yield [
+            async_db.getAGBarcodeDetails(barcode),
+            async_db.pulldown([barcode], [])]
 
         if len(ag_details) == 0 and failures:
             div_id = "no_metadata"
@@ -32,7 +35,7 @@ class BarcodeUtilHelper(object):
             if ag_details['other'] == 'Y':
                 ag_details['other_checked'] = 'checked'
 
-            survey_id = db.get_barcode_survey(barcode)
+            survey_id = yield async_db.get_barcode_survey(barcode)
 
             # it has all sample details
             # (sample time, date, site)
@@ -61,8 +64,9 @@ class BarcodeUtilHelper(object):
             message = ("In American Gut project group but no "
                        "American Gut info for barcode")
             ag_details['email_type'] = "-1"
-        return div_id, message, ag_details
+        raise Return((div_id, message, ag_details))
 
+    @coroutine
     def update_ag_barcode(self, barcode, login_user, login_email, email_type,
                           sent_date, send_mail, sample_date, sample_time,
                           other_text):
@@ -76,7 +80,8 @@ class BarcodeUtilHelper(object):
                 email_msg = ("Sent email successfully to kit owner %s" %
                              login_email)
                 try:
-                    send_email(body_message, subject, login_email)
+                    yield async_db.run(send_email, body_message, subject,
+                                       login_email)
                 except:
                     email_msg = ("Email sending to (%s) failed (barcode: %s)!"
                                  "<br/>" % (login_email, barcode))
@@ -91,12 +96,12 @@ class BarcodeUtilHelper(object):
         ag_update_msg = ("Barcode %s AG info was successfully updated" %
                          barcode)
         try:
-            db.updateAKB(barcode, moldy, overloaded, other, other_text,
-                         sent_date)
+            yield async_db.updateAKB(barcode, moldy, overloaded, other,
+                                     other_text, sent_date)
         except:
             ag_update_msg = ("Barcode %s AG update failed!!!" % barcode)
 
-        return email_msg, ag_update_msg
+        raise Return((email_msg, ag_update_msg))
 
     def _build_email(self, login_user, barcode, email_type,
                      sample_date, sample_time):
@@ -179,6 +184,7 @@ Thank you for your participation!
 @set_access(['Scan Barcodes'])
 class BarcodeUtilHandler(BaseHandler, BarcodeUtilHelper):
     @authenticated
+    @coroutine
     def get(self):
         barcode = self.get_argument('barcode', None)
         if barcode is None:
@@ -189,7 +195,7 @@ class BarcodeUtilHandler(BaseHandler, BarcodeUtilHelper):
                         currentuser=self.current_user)
             return
         # gather info to display
-        barcode_details = db.get_barcode_details(barcode)
+        barcode_details = yield async_db.get_barcode_details(barcode)
         if len(barcode_details) == 0:
             div_id = "invalid_barcode"
             message = ("Barcode %s does not exist in the database" %
@@ -203,9 +209,8 @@ class BarcodeUtilHandler(BaseHandler, BarcodeUtilHelper):
                         msgs=None, currentuser=self.current_user)
             return
 
-        barcode_projects, parent_project = db.getBarcodeProjType(
-            barcode)
-        project_names = db.getProjectNames()
+        (barcode_projects, parent_project), project_names = yield [
+            async_db.getBarcodeProjType(barcode), async_db.getProjectNames()]
 
         # barcode exists get general info
         if barcode_details['status'] is None:
@@ -224,7 +229,7 @@ class BarcodeUtilHandler(BaseHandler, BarcodeUtilHelper):
         # get project info for div
         ag_details = []
         if parent_project == 'American Gut':
-            div_id, message, ag_details = self.get_ag_details(barcode)
+            div_id, message, ag_details = yield self.get_ag_details(barcode)
         else:
             div_id = "verified"
             message = "Barcode Info is correct"
@@ -239,6 +244,7 @@ class BarcodeUtilHandler(BaseHandler, BarcodeUtilHelper):
                     currentuser=self.current_user)
 
     @authenticated
+    @coroutine
     def post(self):
         barcode = self.get_argument('barcode')
         postmark_date = self.get_argument('postmark_date', None)
@@ -265,18 +271,18 @@ class BarcodeUtilHandler(BaseHandler, BarcodeUtilHelper):
         if not scan_date:
             scan_date = None
         try:
-            db.updateBarcodeStatus('Received',
-                                   postmark_date,
-                                   scan_date, barcode,
-                                   biomass_remaining_value,
-                                   sequencing_status,
-                                   obsolete_status)
+            yield async_db.updateBarcodeStatus('Received',
+                                               postmark_date,
+                                               scan_date, barcode,
+                                               biomass_remaining_value,
+                                               sequencing_status,
+                                               obsolete_status)
             gen_update_msg = "Barcode %s general details updated" % barcode
         except:
             gen_update_msg = "Barcode %s general details failed" % barcode
 
         email_msg = ag_update_msg = project_msg = None
-        exisiting_proj, parent_project = db.getBarcodeProjType(
+        exisiting_proj, parent_project = yield async_db.getBarcodeProjType(
             barcode)
         # This WILL NOT let you remove a sample from being in AG if it is
         # part of AG to begin with
@@ -285,14 +291,16 @@ class BarcodeUtilHandler(BaseHandler, BarcodeUtilHelper):
             try:
                 add_projects = projects.difference(exisiting_proj)
                 rem_projects = exisiting_proj.difference(projects)
-                db.setBarcodeProjects(barcode, add_projects, rem_projects)
+                yield async_db.setBarcodeProjects(barcode, add_projects,
+                                                  rem_projects)
                 project_msg = "Project successfully changed"
             except:
                 project_msg = "Error changing project"
 
-            new_proj, parent_project = db.getBarcodeProjType(barcode)
+            new_proj, parent_project = yield async_db.getBarcodeProjType(
+                barcode)
         if parent_project == 'American Gut':
-            email_msg, ag_update_msg = self.update_ag_barcode(
+            email_msg, ag_update_msg = yield self.update_ag_barcode(
                 barcode, login_user, login_email, email_type, sent_date,
                 send_mail, sample_date, sample_time, other_text)
         self.render("barcode_util.html", div_and_msg=None,
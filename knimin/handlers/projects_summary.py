@@ -1,14 +1,15 @@
 #!/usr/bin/env python
 from tornado.web import authenticated
+from tornado.gen import coroutine
 from knimin.handlers.base import BaseHandler
 from knimin.handlers.access_decorators import set_access
-from knimin import db
+from knimin import async_db
 
 
 @set_access(['Base'])
 class ProjectsSummaryHandler(BaseHandler):
     @authenticated
+    @coroutine
     def get(self):
-        projects = db.getProjectNames()
-        info = [(p, len(db.get_barcodes_for_projects([p]))) for p in projects]
-        self.render('projects_summary.html', proj_counts=info)
+        summary = yield async_db.project_summary()
+        self.render('projects_summary.html', summary=summary)
@@ -0,0 +1,64 @@
+from functools import wraps
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncKniminAccess(object):
+    """Runs KniminAccess methods on a bounded thread pool
+
+    Parameters
+    ----------
+    db : KniminAccess
+        The data access object whose methods are run off the IOLoop
+    max_workers : int
+        Maximum number of methods running at the same time. Should not be
+        larger than the connection pool, or workers will wait on connections
+
+    Notes
+    -----
+    Every public method of the wrapped object is available with the same
+    arguments, but returns a Future instead of the result, so tornado
+    coroutines can yield it while the IOLoop keeps serving other requests::
+
+        @coroutine
+        def get(self):
+            users = yield async_db.get_users()
+
+    Public attributes that are not methods are returned unchanged.
+    """
+    def __init__(self, db, max_workers):
+        self._db = db
+        self._executor = ThreadPoolExecutor(max_workers)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self._db, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def submit(*args, **kwargs):
+            return self._executor.submit(attr, *args, **kwargs)
+        return submit
+
+    def run(self, func, *args, **kwargs):
+        """Runs any other blocking callable on the data access threads
+
+        Parameters
+        ----------
+        func : callable
+            Function to run
+        args, kwargs
+            Arguments passed to the function
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future resolving to what the function returns
+        """
+        return self._executor.submit(func, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        """Stops the worker threads once queued calls are done"""
+        self._executor.shutdown(wait)
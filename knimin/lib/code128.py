@@ -185,14 +185,16 @@ def code128_format(data):
     return codes
 
 
+def code128_widths(text, thickness=1):
+    """Widths of the alternating bars and spaces of a barcode, bar first"""
+    return [int(weight) * thickness for code in code128_format(text)
+            for weight in WEIGHTS[code]]
+
+
 def code128_image(text, height=100, width=None, thickness=3, quiet_zone=True,
                   font=None, show_text=False):
-    data = code128_format(text)
     barcode_height = height - 25 if show_text else height
-    barcode_widths = []
-    for code in data:
-        for weight in WEIGHTS[code]:
-            barcode_widths.append(int(weight) * thickness)
+    barcode_widths = code128_widths(text, thickness)
     barcode_width = sum(barcode_widths)
     x = 0
 
@@ -24,6 +24,10 @@ class KniminConfig(object):
         If in debug state
     base_log_dir : str
         Path to the base directory where the log file will be written
+    print_workers : int
+        Number of processes labadmin print-barcodes makes pages in by default
+    hash_workers : int
+        Number of threads new kit passwords are hashed in
     user : str
         The postgres user
     password : str
@@ -34,6 +38,37 @@ class KniminConfig(object):
         The host where the database lives
     port : int
         The port used to connect to the postgres database in the previous host
+    db_pool_min : int
+        Number of postgres connections opened at startup
+    db_pool_max : int
+        Maximum number of postgres connections open at the same time.
+        Default 4
+    db_pool_timeout : float or None
+        Seconds to wait for a free postgres connection, None waits forever.
+        Default 30
+    geocoding_url : str
+        Base URL of the geocoding and elevation APIs
+    geocoding_rate : float
+        Maximum requests per second sent to the geocoding APIs
+    geocoding_workers : int
+        Number of geocoding requests in flight at once
+    geocoding_elevation_batch : int
+        Number of locations looked up per elevation request
+    geocoding_cache_fp : str or None
+        Path of the geocoding results cache, None to not cache them
+    geocoding_cache_size : int
+        Number of addresses kept in the geocoding results cache
+    geocoding_negative_ttl : float
+        Days addresses not found are kept in the geocoding results cache
+    geocoding_gazetteer_fp : str or None
+        GeoNames postal code dump zipcodes are geocoded with offline, None to
+        geocode them with the geocoding API
+    geocoding_gazetteer_countries_fp : str or None
+        GeoNames country info file, to look up gazetteer zipcodes by country
+        name
+    geocoding_dem_dir : str or None
+        Directory of SRTM .hgt tiles elevations are looked up in, None to
+        look them up with the elevation API
 
     Notes
     -----
@@ -62,6 +97,9 @@ class KniminConfig(object):
         self._get_postgres(config)
         self._get_tornado(config)
         self._get_email(config)
+        self._get_geocoding(config)
+        self._get_gazetteer(config)
+        self._get_elevation(config)
 
     def _get_main(self, config):
         """Get the configuration of the main section"""
@@ -69,6 +107,12 @@ class KniminConfig(object):
         self.help_email = config.get('main', 'help_email')
         self.base_data_dir = config.get('main', 'base_data_dir')
         self.base_log_dir = config.get('main', 'BASE_LOG_DIR')
+        self.print_workers = 1
+        if config.has_option('main', 'print_workers'):
+            self.print_workers = config.getint('main', 'print_workers')
+        self.hash_workers = 1
+        if config.has_option('main', 'hash_workers'):
+            self.hash_workers = config.getint('main', 'hash_workers')
 
     def _get_postgres(self, config):
         """Get the configuration of the postgres section"""
@@ -77,6 +121,17 @@ class KniminConfig(object):
         self.db_database = config.get('postgres', 'database')
         self.db_host = config.get('postgres', 'host')
         self.db_port = config.getint('postgres', 'port')
+        # connection pool settings are optional, defaults as in the example
+        # configuration
+        self.db_pool_min = 1
+        self.db_pool_max = 4
+        self.db_pool_timeout = 30.0
+        if config.has_option('postgres', 'pool_min'):
+            self.db_pool_min = config.getint('postgres', 'pool_min')
+        if config.has_option('postgres', 'pool_max'):
+            self.db_pool_max = config.getint('postgres', 'pool_max')
+        if config.has_option('postgres', 'pool_timeout'):
+            self.db_pool_timeout = config.getfloat('postgres', 'pool_timeout')
 
     def _get_tornado(self, config):
         """Get tornado config bits"""
@@ -89,4 +144,50 @@ class KniminConfig(object):
         self.smtp_user = config.get('email', 'USERNAME')
         self.smtp_password = config.get('email', 'PASSWORD')
 
+    def _get_geocoding(self, config):
+        """Get the configuration of the optional geocoding section"""
+        self.geocoding_url = 'https://maps.googleapis.com'
+        self.geocoding_rate = 50.0
+        self.geocoding_workers = 8
+        self.geocoding_elevation_batch = 50
+        self.geocoding_cache_fp = None
+        self.geocoding_cache_size = 100000
+        self.geocoding_negative_ttl = 30.0
+        if not config.has_section('geocoding'):
+            return
+        if config.has_option('geocoding', 'url'):
+            self.geocoding_url = config.get('geocoding', 'url')
+        if config.has_option('geocoding', 'rate'):
+            self.geocoding_rate = config.getfloat('geocoding', 'rate')
+        if config.has_option('geocoding', 'workers'):
+            self.geocoding_workers = config.getint('geocoding', 'workers')
+        if config.has_option('geocoding', 'elevation_batch'):
+            self.geocoding_elevation_batch = config.getint(
+                'geocoding', 'elevation_batch')
+        if config.has_option('geocoding', 'cache_fp'):
+            self.geocoding_cache_fp = config.get('geocoding', 'cache_fp')
+        if config.has_option('geocoding', 'cache_size'):
+            self.geocoding_cache_size = config.getint('geocoding',
+                                                      'cache_size')
+        if config.has_option('geocoding', 'negative_ttl'):
+            self.geocoding_negative_ttl = config.getfloat('geocoding',
+                                                          'negative_ttl')
+
+    def _get_gazetteer(self, config):
+        """Get the offline gazetteer options of the geocoding section"""
+        self.geocoding_gazetteer_fp = None
+        self.geocoding_gazetteer_countries_fp = None
+        if config.has_option('geocoding', 'gazetteer_fp'):
+            self.geocoding_gazetteer_fp = config.get('geocoding',
+                                                     'gazetteer_fp')
+        if config.has_option('geocoding', 'gazetteer_countries_fp'):
+            self.geocoding_gazetteer_countries_fp = config.get(
+                'geocoding', 'gazetteer_countries_fp')
+
+    def _get_elevation(self, config):
+        """Get the offline elevation options of the geocoding section"""
+        self.geocoding_dem_dir = None
+        if config.has_option('geocoding', 'dem_dir'):
+            self.geocoding_dem_dir = config.get('geocoding', 'dem_dir')
+
 config = KniminConfig()
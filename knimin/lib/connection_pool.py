@@ -0,0 +1,217 @@
+from contextlib import contextmanager
+from threading import Condition
+from time import time
+
+from psycopg2 import Error as PostgresError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of postgres connections
+
+    Parameters
+    ----------
+    connect_func : callable
+        Called without arguments to open a new connection
+    minconn : int, optional
+        Number of connections opened when the pool is created. Default 1
+    maxconn : int, optional
+        Maximum number of connections open at the same time. Default 1
+    timeout : float, optional
+        Seconds to wait for a free connection before giving up. Default None,
+        wait forever
+    check_after : float, optional
+        Seconds a connection can sit idle before it is pinged to make sure it
+        is still alive when checked out. Default 30
+
+    Notes
+    -----
+    Connections are never shared: a connection checked out by one thread is
+    not handed to another one until it is returned to the pool. Connections
+    that were closed or fail the health check are dropped and replaced.
+    """
+    def __init__(self, connect_func, minconn=1, maxconn=1, timeout=None,
+                 check_after=30):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: min %d, max %d"
+                             % (minconn, maxconn))
+        self._connect = connect_func
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+
+        self._cond = Condition()
+        # idle connections as [(connection, time returned), ...]
+        self._idle = []
+        self._in_use = set()
+        # connections being opened, counted so maxconn is never exceeded
+        self._opening = 0
+        self._stats = {'checkouts': 0, 'connects': 0, 'discarded': 0,
+                       'failed_checks': 0, 'waits': 0, 'timeouts': 0}
+
+        for _ in range(minconn):
+            self._idle.append((self._new_connection(), time()))
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['connects'] += 1
+        return conn
+
+    def _close(self, conn):
+        """Closes a connection, ignoring errors from dead connections"""
+        try:
+            conn.close()
+        except PostgresError:
+            pass
+
+    def _is_alive(self, conn):
+        """Checks the connection still answers queries"""
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except PostgresError:
+            return False
+        return True
+
+    def getconn(self):
+        """Checks out a connection from the pool
+
+        Returns
+        -------
+        psycopg2.connection
+            A connection only the caller is using
+
+        Raises
+        ------
+        PoolExhaustedError
+            No connection became available within the pool timeout
+        """
+        deadline = None if self.timeout is None else time() + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and \
+                        len(self._in_use) + self._opening >= self.maxconn:
+                    self._stats['waits'] += 1
+                    remaining = None if deadline is None else deadline - time()
+                    if remaining is not None and remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolExhaustedError(
+                            "No database connection available after %s "
+                            "seconds (%d in use)"
+                            % (self.timeout, len(self._in_use)))
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, returned = self._idle.pop()
+                    # reserve the slot while the health check runs
+                    self._opening += 1
+                    stale = time() - returned > self.check_after
+                else:
+                    self._opening += 1
+
+            try:
+                if conn is None:
+                    conn = self._new_connection()
+                elif conn.closed or (stale and not self._is_alive(conn)):
+                    with self._cond:
+                        self._stats['failed_checks'] += 1
+                        self._stats['discarded'] += 1
+                    self._close(conn)
+                    conn = None
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+
+            with self._cond:
+                self._opening -= 1
+                if conn is None:
+                    # dead connection dropped, try again for a new one
+                    self._cond.notify()
+                    continue
+                self._in_use.add(conn)
+                self._stats['checkouts'] += 1
+                return conn
+
+    def putconn(self, conn, discard=False):
+        """Returns a connection to the pool
+
+        Parameters
+        ----------
+        conn : psycopg2.connection
+            Connection previously checked out with `getconn`
+        discard : bool, optional
+            Close the connection instead of keeping it for reuse
+        """
+        if not discard and not conn.closed:
+            # never hand out a connection with a transaction left open
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except PostgresError:
+                discard = True
+
+        with self._cond:
+            self._in_use.discard(conn)
+            if discard or conn.closed:
+                self._stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time()))
+                conn = None
+            self._cond.notify()
+
+        if conn is not None:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection for the duration of the with block
+
+        Connections closed while checked out, e.g. the server dropped them,
+        are discarded instead of being returned to the pool.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        """Usage statistics for the pool
+
+        Returns
+        -------
+        dict
+            Current pool size as `min`, `max`, `open`, `in_use` and `idle`,
+            plus counters of `checkouts`, `connects`, `discarded`,
+            `failed_checks`, `waits` and `timeouts` since creation
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'min': self.minconn,
+                'max': self.maxconn,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'open': len(self._in_use) + len(self._idle)})
+        return stats
+
+    def closeall(self):
+        """Closes all idle connections and stops tracking the in use ones"""
+        with self._cond:
+            idle = [c for c, _ in self._idle]
+            self._idle = []
+            self._in_use = set()
+        for conn in idle:
+            self._close(conn)
@@ -1,16 +1,23 @@
 from __future__ import unicode_literals
 from contextlib import contextmanager
 from collections import defaultdict, namedtuple
-from os import walk
-from os.path import join, splitext, isdir, abspath
+from os import mkdir, remove, rename, walk
+from os.path import join, splitext, isdir, abspath, exists
 from copy import copy
+from heapq import merge
+from functools import partial
 from re import sub
-from hashlib import sha512
 from datetime import datetime, time, timedelta
+from tempfile import SpooledTemporaryFile, mkdtemp
+from multiprocessing import Pool
+from shutil import rmtree
+from threading import Lock
+from time import sleep
 import json
 import re
 
 from bcrypt import hashpw, gensalt
+from concurrent.futures import ThreadPoolExecutor
 from future.utils import viewitems
 
 from psycopg2 import connect, Error as PostgresError
@@ -18,13 +25,17 @@ from psycopg2.extras import DictCursor
 
 from mail import send_email
 from util import (make_valid_kit_ids, make_verification_code, make_passwd,
-                  categorize_age, categorize_etoh, categorize_bmi, correct_age,
-                  fetch_url, correct_bmi)
-from constants import (md_lookup, month_int_lookup, month_str_lookup,
-                       regions_by_state, blanks_values, season_lookup,
-                       ebi_remove, env_lookup)
-from geocoder import geocode, Location, GoogleAPILimitExceeded
+                  fetch_url, group_barcodes_by_base, index_barcode_suffixes,
+                  shard_barcodes)
+from constants import blanks_values, ebi_remove, env_lookup
+from geocoder import geocode, Location, BatchGeocoder
+from geocode_cache import GeocodeCache
+from gazetteer import Gazetteer
+from elevation import HGTElevation
 from string_converter import converter
+from connection_pool import ConnectionPool
+from reference_cache import ReferenceCache
+from survey_format import format_human_barcode, format_human_frame
 
 
 class IncorrectEmailError(Exception):
@@ -36,19 +47,59 @@ class IncorrectPasswordError(Exception):
 
 
 class SQLHandler(object):
-    """Encapsulates the DB connection with the Postgres DB
+    """Encapsulates the DB connections with the Postgres DB
 
     Sourced from QIITA's SQLConnectionHandler
+
+    Parameters
+    ----------
+    config : KniminConfig
+        Configuration with the connection details and pool size
+    setup_sql : list of str, optional
+        SQL statements to run on every new connection. Default None
+
+    Notes
+    -----
+    Connections are kept in a pool of `config.db_pool_min` to
+    `config.db_pool_max` connections. Each query checks out its own
+    connection, so the handler can be shared between threads.
     """
-    def __init__(self, config):
-        self._connection = connect(user=config.db_user,
-                                   password=config.db_password,
-                                   database=config.db_database,
-                                   host=config.db_host,
-                                   port=config.db_port)
+    def __init__(self, config, setup_sql=None):
+        # statements run on every new connection, e.g. to set the search path
+        self._setup_sql = setup_sql if setup_sql is not None else []
+        self._config = config
+        self._pool = ConnectionPool(self._connect, config.db_pool_min,
+                                    config.db_pool_max,
+                                    timeout=config.db_pool_timeout)
 
     def __del__(self):
-        self._connection.close()
+        # __init__ may have failed before the pool was made
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            pool.closeall()
+
+    def _connect(self):
+        """Opens a new connection to the database for the pool"""
+        config = self._config
+        conn = connect(user=config.db_user, password=config.db_password,
+                       database=config.db_database, host=config.db_host,
+                       port=config.db_port)
+        if self._setup_sql:
+            with conn.cursor() as cur:
+                for sql in self._setup_sql:
+                    cur.execute(sql)
+            conn.commit()
+        return conn
+
+    def pool_stats(self):
+        """Usage statistics of the connection pool
+
+        Returns
+        -------
+        dict
+            Pool size and usage counters, see ConnectionPool.stats
+        """
+        return self._pool.stats()
 
     @contextmanager
     def cursor(self):
@@ -57,9 +108,15 @@ class SQLHandler(object):
         Returns
         -------
         pgcursor : psycopg2.cursor
+
+        Notes
+        -----
+        The cursor's connection is checked out of the pool until the with
+        block exits, and anything not committed is rolled back on return.
         """
-        with self._connection.cursor(cursor_factory=DictCursor) as cur:
-            yield cur
+        with self._pool.connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                yield cur
 
     def _check_sql_args(self, sql_args):
         """ Checks that sql_args have the correct type
@@ -105,23 +162,38 @@ class SQLHandler(object):
         else:
             self._check_sql_args(sql_args)
 
-        # Execute the query
-        with self.cursor() as cur:
+        # Execute the query on a connection checked out for this call only
+        with self._pool.connection() as conn, \
+                conn.cursor(cursor_factory=DictCursor) as cur:
             try:
                 if many:
                     cur.executemany(sql, sql_args)
                 else:
                     cur.execute(sql, sql_args)
                 yield cur
-                self._connection.commit()
+                conn.commit()
             except PostgresError as e:
-                self._connection.rollback()
-                try:
-                    err_sql = cur.mogrify(sql, sql_args)
-                except:
-                    err_sql = cur.mogrify(sql, sql_args[0])
-                raise ValueError(("\nError running SQL query: %s"
-                                  "\nError: %s" % (err_sql, e)))
+                raise self._sql_error(conn, cur, sql, sql_args, e)
+
+    def _sql_error(self, conn, cur, sql, sql_args, error):
+        """Rolls back a failed query and builds the error to raise
+
+        Returns
+        -------
+        ValueError
+            Error with the failed SQL query and the postgres error
+        """
+        if conn.closed:
+            # dropped connection, the pool discards it on return
+            err_sql = sql
+        else:
+            try:
+                err_sql = cur.mogrify(sql, sql_args)
+            except:
+                err_sql = cur.mogrify(sql, sql_args[0])
+            conn.rollback()
+        return ValueError(("\nError running SQL query: %s"
+                           "\nError: %s" % (err_sql, error)))
 
     def execute_fetchall(self, sql, sql_args=None):
         """ Executes a fetchall SQL query
@@ -147,6 +219,78 @@ class SQLHandler(object):
             result = pgcursor.fetchall()
         return result
 
+    @contextmanager
+    def _server_cursor(self, sql, sql_args, tuples):
+        """Executes a query on a named (server-side) cursor
+
+        Parameters
+        ----------
+        sql: str
+            The SQL query
+        sql_args: tuple or list
+            The arguments for the SQL query
+        tuples: bool
+            Whether rows are plain tuples instead of DictRows
+
+        Returns
+        -------
+        pgcursor : psycopg2.cursor
+            The cursor in which the SQL query was executed. Its connection is
+            checked out of the pool until the with block exits
+
+        Raises
+        ------
+        ValueError
+            If there is some error executing the SQL query or fetching rows
+        """
+        self._check_sql_args(sql_args)
+        with self._pool.connection() as conn:
+            cur = conn.cursor('knimin_server_cursor',
+                              cursor_factory=None if tuples else DictCursor)
+            try:
+                cur.execute(sql, sql_args)
+                yield cur
+                cur.close()
+                conn.commit()
+            except PostgresError as e:
+                raise self._sql_error(conn, cur, sql, sql_args, e)
+
+    def execute_iter(self, sql, sql_args=None, itersize=2000, tuples=False):
+        """ Executes a query, iterating over the results on the server side
+
+        Parameters
+        ----------
+        sql: str
+            The SQL query
+        sql_args: tuple or list, optional
+            The arguments for the SQL query
+        itersize: int, optional
+            Number of rows fetched from the server at a time. Default 2000
+        tuples: bool, optional
+            If True, rows are plain tuples instead of DictRows. Default False
+
+        Yields
+        ------
+        DictRow or tuple
+            The result rows, one at a time
+
+        Notes
+        -----
+        The rows are read through a named (server-side) cursor, so only
+        `itersize` rows are in memory at once. The connection stays checked
+        out of the pool until the iteration finishes or the generator is
+        closed.
+
+        from psycopg2 documentation, only variable values should be bound
+        via sql_args, it shouldn't be used to set table or field names.
+        For those elements, ordinary string formatting should be used
+        before running execute.
+        """
+        with self._server_cursor(sql, sql_args, tuples) as cur:
+            cur.itersize = itersize
+            for row in cur:
+                yield row
+
     def execute_fetchone(self, sql, sql_args=None):
         """ Executes a fetchone SQL query
 
@@ -238,8 +382,8 @@ class SQLHandler(object):
         with self._sql_executor(sql, sql_args_list, True):
             pass
 
-    def execute_proc_return_cursor(self, procname, proc_args):
-        """Executes a stored procedure and returns a cursor
+    def execute_proc_fetchall(self, procname, proc_args):
+        """Executes a stored procedure and fetches the cursor it opens
 
         Parameters
         ----------
@@ -247,12 +391,21 @@ class SQLHandler(object):
             the name of the stored procedure
         proc_args: list
             arguments sent to the stored procedure
+
+        Returns
+        -------
+        list of DictRow
+            The rows of the cursor opened by the stored procedure
         """
-        proc_args.append('cur2')
-        cur = self._connection.cursor()
-        cur.callproc(procname, proc_args)
-        cur.close()
-        return self._connection.cursor('cur2')
+        proc_args = list(proc_args) + ['cur2']
+        # the procedure and the cursor must share the connection
+        with self._pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.callproc(procname, proc_args)
+            with conn.cursor('cur2', cursor_factory=DictCursor) as cur:
+                rows = cur.fetchall()
+            conn.commit()
+        return rows
 
 
 class KniminAccess(object):
@@ -292,10 +445,171 @@ class KniminAccess(object):
                      'Water']
 
     def __init__(self, config):
-        self._con = SQLHandler(config)
-        self._con.execute('set search_path to ag, barcodes, public')
+        self._con = SQLHandler(
+            config, setup_sql=['set search_path to ag, barcodes, public'])
         self.config = config
 
+        # reference tables every pulldown needs, shared between requests
+        self._refs = ReferenceCache()
+        self._refs.register('zipcodes', partial(self._load_zipcodes, False),
+                            partial(self._table_version, ['zipcodes']))
+        self._refs.register('zipcodes_full',
+                            partial(self._load_zipcodes, True),
+                            partial(self._table_version, ['zipcodes']))
+        self._refs.register('countries', self._load_countries,
+                            partial(self._table_version,
+                                    ['iso_country_lookup']))
+        self._refs.register('duplicate_consents',
+                            self._load_duplicate_consents,
+                            partial(self._table_version,
+                                    ['duplicate_consents',
+                                     'ag_login_surveys']))
+
+        # users and their access levels, so authorizing a request needs no
+        # query. Changes through alter_access_levels are seen right away,
+        # changes made directly in the database once the TTL expires
+        self._permissions = ReferenceCache(ttl=60)
+        self._permissions.register('users', self._load_user_access)
+        self._permissions.register('access_levels', self._load_access_names)
+        # statistics pages, rendered from memory and refreshed in the
+        # background once five minutes old. This keeps the pages off the
+        # database without a persisted summary table, which as a schema
+        # patch would also need triggers to keep it current
+        self._dashboard = ReferenceCache(ttl=3600, refresh_after=300)
+        self._dashboard.register('ag_stats', self._load_ag_stats)
+        self._dashboard.register('geocode_stats', self._load_geocode_stats)
+        self._dashboard.register('project_summary',
+                                 self._load_project_summary)
+
+        # geocoding results kept between runs, if configured
+        self._geocode_cache = None
+        if config.geocoding_cache_fp:
+            self._geocode_cache = GeocodeCache(
+                config.geocoding_cache_fp, config.geocoding_cache_size,
+                config.geocoding_negative_ttl * 86400)
+        # offline elevations, used instead of the elevation API
+        self._elevation = None
+        if config.geocoding_dem_dir:
+            self._elevation = HGTElevation(config.geocoding_dem_dir)
+        # offline gazetteer, loaded the first time a zipcode is geocoded
+        self._gazetteer = None
+        self._gazetteer_lock = Lock()
+
+    def _get_gazetteer(self):
+        """The offline gazetteer, None if not configured
+
+        Returns
+        -------
+        Gazetteer or None
+            The gazetteer, loaded on first use
+        """
+        if self.config.geocoding_gazetteer_fp is None:
+            return None
+        with self._gazetteer_lock:
+            if self._gazetteer is None:
+                self._gazetteer = Gazetteer.load(
+                    self.config.geocoding_gazetteer_fp,
+                    self.config.geocoding_gazetteer_countries_fp)
+        return self._gazetteer
+
+    def _table_version(self, tables):
+        """Modification counters for tables in the ag schema
+
+        Parameters
+        ----------
+        tables : list of str
+            Tables to get the counters for
+
+        Returns
+        -------
+        list of tuple
+            (table, rows inserted + updated + deleted), changing whenever the
+            table does
+        """
+        sql = """SELECT relname, n_tup_ins + n_tup_upd + n_tup_del
+                 FROM pg_stat_user_tables
+                 WHERE schemaname = 'ag' AND relname IN %s
+                 ORDER BY relname"""
+        return [tuple(row) for row in
+                self._con.execute_fetchall(sql, [tuple(tables)])]
+
+    def _load_user_access(self):
+        """Access levels of every user, cached as 'users'
+
+        Returns
+        -------
+        dict of frozenset
+            {email: frozenset of access level names}, empty for users
+            without any access level
+        """
+        sql = """SELECT email, array_remove(array_agg(access_name), NULL)
+                 FROM ag.labadmin_users
+                 LEFT JOIN ag.labadmin_users_access USING (email)
+                 LEFT JOIN ag.labadmin_access USING (access_id)
+                 GROUP BY email"""
+        return {email: frozenset(levels) for email, levels in
+                self._con.execute_fetchall(sql)}
+
+    def _load_access_names(self):
+        """Names of all access levels, cached as 'access_levels'
+
+        Returns
+        -------
+        frozenset of str
+            The access level names
+        """
+        sql = "SELECT access_name FROM ag.labadmin_access"
+        return frozenset(x[0] for x in self._con.execute_fetchall(sql))
+
+    def _load_zipcodes(self, full):
+        """Geocode lookup for all zipcodes, cached as 'zipcodes'
+
+        Parameters
+        ----------
+        full : bool
+            Whether to keep full precision, otherwise round to one decimal
+
+        Returns
+        -------
+        dict of dict
+            {zipcode: {country: (latitude, longitude, elevation, state)}}
+        """
+        # tuples are latitude, longitude, elevation, state
+        if full:
+            zipcode_sql = """SELECT UPPER(zipcode), country,
+                                 latitude::numeric,
+                                 longitude::numeric,
+                                 elevation::numeric, state
+                             FROM zipcodes"""
+        else:
+            zipcode_sql = """SELECT UPPER(zipcode), country,
+                                 round(latitude::numeric, 1),
+                                 round(longitude::numeric,1),
+                                 round(elevation::numeric, 1), state
+                             FROM zipcodes"""
+        zip_lookup = defaultdict(dict)
+        for row in self._con.execute_iter(zipcode_sql, tuples=True):
+            zip_lookup[row[0]][row[1]] = map(
+                lambda x: x if x is not None else 'Unspecified', row[2:])
+        return dict(zip_lookup)
+
+    def _load_countries(self):
+        """EBI country names for each country, cached as 'countries'"""
+        country_sql = "SELECT country, EBI from ag.iso_country_lookup"
+        country_lookup = dict(self._con.execute_fetchall(country_sql))
+        # Add for scrubbed testing database
+        country_lookup['REMOVED'] = 'REMOVED'
+        return country_lookup
+
+    def _load_duplicate_consents(self):
+        """Participant names of duplicate surveys, cached as
+        'duplicate_consents'"""
+        dupes_sql = """SELECT duplicate_survey_id, participant_name
+                       FROM ag.duplicate_consents dc
+                       JOIN ag.ag_login_surveys als USING (ag_login_id)
+                       WHERE  dc.main_survey_id = als.survey_id"""
+        return dict(self._con.execute_iter(dupes_sql, tuples=True))
+
     def _get_col_names_from_cursor(self, cur):
         if cur.description:
             return [x[0] for x in cur.description]
@@ -319,7 +633,8 @@ class KniminAccess(object):
 
         Notes
         -----
-        For uses with Admin acces, this will always return true.
+        For uses with Admin acces, this will always return true. Users and
+        access levels are cached, so this runs no query most of the time.
 
         Raises
         ------
@@ -327,18 +642,29 @@ class KniminAccess(object):
             Unknown access level passed
         """
         # Make sure all access levels passed exist
-        sql = "Select 1 from ag.labadmin_access WHERE access_name = %s"
+        known = self._permissions.get('access_levels')
         for level in access_levels:
-            if self._con.execute_fetchone(sql, [level]) is None:
+            if level not in known:
                 raise ValueError('Unknown access level %s' % level)
 
-        sql = """SELECT EXISTS(
-                    SELECT 1
-                    FROM ag.labadmin_users_access
-                    JOIN ag.labadmin_access USING (access_id)
-                    WHERE email = %s AND access_name IN %s)"""
-        access = tuple(access_levels + ['Admin'])
-        return self._con.execute_fetchone(sql, [email, access])[0]
+        user_levels = self._permissions.get('users').get(email, frozenset())
+        return 'Admin' in user_levels or \
+            not user_levels.isdisjoint(access_levels)
+
+    def is_user(self, email):
+        """Whether a user exists, checked against the cached users
+
+        Parameters
+        ----------
+        email : str
+            Email of user to check
+
+        Returns
+        -------
+        bool
+            Whether the user exists
+        """
+        return email in self._permissions.get('users')
 
     def get_users(self):
         """Get a list of users in the system
@@ -426,6 +752,8 @@ class KniminAccess(object):
                      VALUES (%s, %s)"""
             self._con.executemany(sql, [(email, l) for l in add])
 
+        self._permissions.invalidate('users')
+
     def get_ag_barcode_details(self, barcodes):
         """Retrieve sample, kit, and login details by barcode
 
@@ -446,7 +774,7 @@ class KniminAccess(object):
                     (survey_id, ag_login_id)
                  JOIN ag_login USING (ag_login_id)
                  WHERE barcode in %s"""
-        res = self._con.execute_fetchall(sql, [tuple(b[:9] for b in barcodes)])
+        res = self._con.execute_iter(sql, [tuple(b[:9] for b in barcodes)])
         return {row[0]: dict(row) for row in res}
 
     def get_surveys(self, barcodes):  # noqa
@@ -472,33 +800,38 @@ class KniminAccess(object):
         ALLERGIC_TO portion taken from the shortname column of the question
         table).
         """
-        # SINGLE answers SQL
-        single_sql = \
-            """SELECT S.survey_id, barcode, question_shortname, response
-               FROM ag.ag_kit_barcodes
-               JOIN ag.survey_answers SA USING (survey_id)
-               JOIN ag.survey_question USING (survey_question_id)
-               JOIN ag.survey_question_response_type USING (survey_question_id)
-               JOIN ag.group_questions GQ USING (survey_question_id)
-               JOIN ag.surveys S USING (survey_group)
-               WHERE survey_response_type='SINGLE'
-                   AND (withdrawn IS NULL OR withdrawn != 'Y')
-                   AND barcode in %s"""
-
-        # MULTIPLE answers SQL
-        multiple_sql = \
-            """SELECT S.survey_id, barcode, question_shortname,
-                      array_agg(response) as responses
-               FROM ag.ag_kit_barcodes
-               JOIN ag.survey_answers USING (survey_id)
-               JOIN ag.survey_question USING (survey_question_id)
-               JOIN ag.survey_question_response_type USING (survey_question_id)
-               JOIN ag.group_questions USING (survey_question_id)
-               JOIN ag.surveys S USING (survey_group)
-               WHERE survey_response_type='MULTIPLE'
-                   AND (withdrawn IS NULL OR withdrawn != 'Y')
-                   AND barcode in %s
-               GROUP BY S.survey_id, barcode, question_shortname"""
+        # All answers in one pass. SINGLE and MULTIPLE answers are grouped so
+        # each row holds every response given to the question, and STRING and
+        # TEXT answers are tagged OTHER since they are stored as json
+        sql = """SELECT S.survey_id, barcode, question_shortname,
+                        survey_response_type AS response_type,
+                        array_agg(response::varchar) AS responses
+                 FROM ag.ag_kit_barcodes
+                 JOIN ag.survey_answers USING (survey_id)
+                 JOIN ag.survey_question USING (survey_question_id)
+                 JOIN ag.survey_question_response_type
+                    USING (survey_question_id)
+                 JOIN ag.group_questions USING (survey_question_id)
+                 JOIN ag.surveys S USING (survey_group)
+                 WHERE survey_response_type IN ('SINGLE', 'MULTIPLE')
+                     AND (withdrawn IS NULL OR withdrawn != 'Y')
+                     AND barcode IN %s
+                 GROUP BY S.survey_id, barcode, question_shortname,
+                          survey_response_type
+                 UNION ALL
+                 SELECT S.survey_id, barcode, question_shortname,
+                        'OTHER' AS response_type,
+                        ARRAY[response::varchar] AS responses
+                 FROM ag.ag_kit_barcodes
+                 JOIN ag.survey_answers_other USING (survey_id)
+                 JOIN ag.survey_question USING (survey_question_id)
+                 JOIN ag.survey_question_response_type
+                    USING (survey_question_id)
+                 JOIN ag.group_questions USING (survey_question_id)
+                 JOIN ag.surveys S USING (survey_group)
+                 WHERE survey_response_type IN ('STRING', 'TEXT')
+                     AND (withdrawn IS NULL OR withdrawn != 'Y')
+                     AND barcode IN %s"""
 
         # Also need to get the possible responses for multiples
         multiple_responses_sql = \
@@ -508,21 +841,6 @@ class KniminAccess(object):
                JOIN survey_question_response USING (survey_question_id)
                WHERE survey_response_type = 'MULTIPLE'"""
 
-        # STRING and TEXT answers SQL
-        others_sql = \
-            """SELECT S.survey_id, barcode, question_shortname, response
-               FROM ag.ag_kit_barcodes
-               JOIN ag.survey_answers_other SA USING (survey_id)
-               JOIN ag.survey_question USING (survey_question_id)
-               JOIN ag.survey_question_response_type USING (survey_question_id)
-               JOIN ag.group_questions GQ USING (survey_question_id)
-               JOIN ag.surveys S USING (survey_group)
-               WHERE survey_response_type IN ('STRING', 'TEXT')
-                   AND (withdrawn IS NULL OR withdrawn != 'Y')
-                   AND barcode IN %s"""
-
-        # Get third party surveys, if there is one and one is requested
-
         # Formats a question and response for a MULTIPLE question into a header
         def _translate_multiple_response_to_header(question, response):
             response = response.replace(" ", "_")
@@ -539,78 +857,45 @@ class KniminAccess(object):
             multiples_headers[question][response] = \
                 _translate_multiple_response_to_header(question, response)
 
-        # find special case barcodes with appended info and store them
-        special_bc = sorted(b for b in barcodes if len(b) > 9)
+        # find special case barcodes with appended info and index them by
+        # the barcode they were made from
+        special_bc = index_barcode_suffixes(barcodes)
         # Strip off any appending from barcodes before getting data
         bc = tuple(set(b[:9] for b in barcodes))
-        # this function reduces code duplication by generalizing as much
-        # as possible how questions and responses are fetched from the db
-
-        def _format_responses_as_dict(sql, json=False, multiple=False):
-            ret_dict = defaultdict(lambda: defaultdict(dict))
-            for survey, barcode, q, a in self._con.execute_fetchall(sql, [bc]):
-                # Get special barcodes that match, if applicable
-                match = [x for x in special_bc if barcode in x]
-                if not match:
-                    match = [barcode]
-
-                if json:
-                    # Clean since all json are single-element lists
-                    # and we want no seperators at the beginning or end of data
-                    a = unicode(a, 'utf-8')
-                    a = a.strip('"\'[]_,\t\r\n\\/ ')
-                if multiple:
-                    for response, header in multiples_headers[q].items():
-                        for bcs in match:
-                            ret_dict[survey][bcs][header] = \
-                                'Yes' if response in a else 'No'
-                else:
-                    for bcs in match:
-                        ret_dict[survey][bcs][q] = a
-            return ret_dict
-
-        single_results = _format_responses_as_dict(single_sql)
-        others_results = _format_responses_as_dict(others_sql, json=True)
-        multiple_results = _format_responses_as_dict(multiple_sql,
-                                                     multiple=True)
-
-        # combine the results for each barcode
-        for survey, barcodes in single_results.items():
-            for barcode in barcodes:
-                single_results[survey][barcode].update(
-                    others_results[survey][barcode])
-                single_results[survey][barcode].update(
-                    multiple_results[survey][barcode])
-
-        # At this point, the variable name is a misnomer, as it contains
-        # the results from all question types
-        return single_results
-
-    def _months_between_dates(self, d1, d2):
-        """Calculate the number of months between two dates
-
-        Parameters
-        ----------
-        d1 : datetime
-            First date
-        d2 : datetime
-            Second date
-
-        Raises
-        ------
-        ValueError
-            if the first date is greater than the second date
 
-        Notes
-        -----
-        - Assumes the first date d1 is not greater than the second date d2
-        - Ignores the day (uses only year and month)
-        """
-        if d1 > d2:
-            raise ValueError("First date must not be greater than the second")
+        results = defaultdict(lambda: defaultdict(dict))
+        # only barcodes with SINGLE answers are pulled down
+        answered = set()
+        for survey, barcode, q, rtype, a in self._con.execute_iter(
+                sql, [bc, bc], tuples=True):
+            # Get special barcodes that match, if applicable
+            match = special_bc.get(barcode, [barcode])
+
+            if rtype == 'MULTIPLE':
+                for response, header in multiples_headers[q].items():
+                    answer = 'Yes' if response in a else 'No'
+                    for bcs in match:
+                        results[survey][bcs][header] = answer
+                continue
 
-        # Calculate the number of 12-month periods between the years
-        return (d2.year - d1.year) * 12 + (d2.month - d1.month)
+            if rtype == 'SINGLE':
+                answered.update((survey, bcs) for bcs in match)
+                a = a[-1]
+            else:
+                # Clean since all json are single-element lists
+                # and we want no seperators at the beginning or end of data
+                a = unicode(a[0], 'utf-8')
+                a = a.strip('"\'[]_,\t\r\n\\/ ')
+            for bcs in match:
+                results[survey][bcs][q] = a
+
+        for survey, barcodes in results.items():
+            for barcode in list(barcodes):
+                if (survey, barcode) not in answered:
+                    del barcodes[barcode]
+            if not barcodes:
+                del results[survey]
+        return results
 
     def _geocode(self, barcode, zipcode, country, zip_lookup, country_lookup):
         """Adds geocoding information to the barcoe for pulldown"""
@@ -629,15 +914,23 @@ class KniminAccess(object):
             if info.lat is not None:
                 barcode['LATITUDE'] = "%.1f" % info.lat
                 barcode['LONGITUDE'] = "%.1f" % info.long
-                barcode['ELEVATION'] = "%.1f" % info.elev
+                # elevations are not always known offline
+                if info.elev is None:
+                    elev = barcode['ELEVATION'] = 'Unspecified'
+                else:
+                    elev = round(info.elev, 1)
+                    barcode['ELEVATION'] = "%.1f" % info.elev
                 barcode['STATE'] = info.state
                 barcode['COUNTRY'] = country_lookup[info.country]
                 barcode['GEO_LOC_NAME'] = ':'.join(
                     [barcode['COUNTRY'], barcode['STATE']])
-                # Store in dict so we don't geocode again
-                zip_lookup[zipcode][country] = (
-                    round(info.lat, 1), round(info.long, 1),
-                    round(info.elev, 1), info.state)
+                # Store in dict so we don't geocode again, without changing
+                # the per country dicts shared with the reference cache
+                known = dict(zip_lookup.get(zipcode, {}))
+                known[country] = (
+                    round(info.lat, 1), round(info.long, 1), elev,
+                    info.state)
+                zip_lookup[zipcode] = known
             else:
                 barcode['LATITUDE'] = 'Unspecified'
                 barcode['LONGITUDE'] = 'Unspecified'
@@ -646,9 +939,11 @@ class KniminAccess(object):
                 barcode['COUNTRY'] = 'Unspecified'
                 barcode['GEO_LOC_NAME'] = 'Unspecified'
                 # Store in dict so we don't geocode again
-                zip_lookup[zipcode][country] = (
+                known = dict(zip_lookup.get(zipcode, {}))
+                known[country] = (
                     'Unspecified', 'Unspecified', 'Unspecified',
                     'Unspecified')
+                zip_lookup[zipcode] = known
         return barcode
 
     def format_survey_data(self, md, external_surveys=None, full=False):  # noqa
@@ -685,36 +980,11 @@ class KniminAccess(object):
         barcode_info = self.get_ag_barcode_details(all_barcodes)
 
         # tuples are latitude, longitude, elevation, state
-        if full:
-            zipcode_sql = """SELECT UPPER(zipcode), country,
-                                 latitude::numeric,
-                                 longitude::numeric,
-                                 elevation::numeric, state
-                             FROM zipcodes"""
-        else:
-            zipcode_sql = """SELECT UPPER(zipcode), country,
-                                 round(latitude::numeric, 1),
-                                 round(longitude::numeric,1),
-                                 round(elevation::numeric, 1), state
-                             FROM zipcodes"""
-        zip_lookup = defaultdict(dict)
-        for row in self._con.execute_fetchall(zipcode_sql):
-            zip_lookup[row[0]][row[1]] = map(
-                lambda x: x if x is not None else 'Unspecified', row[2:])
-
-        country_sql = "SELECT country, EBI from ag.iso_country_lookup"
-        country_lookup = dict(self._con.execute_fetchall(country_sql))
-        # Add for scrubbed testing database
-        country_lookup['REMOVED'] = 'REMOVED'
-
-        survey_sql = "SELECT barcode, survey_id FROM ag.ag_kit_barcodes"
-        survey_lookup = dict(self._con.execute_fetchall(survey_sql))
-
-        dupes_sql = """SELECT duplicate_survey_id, participant_name
-                       FROM ag.duplicate_consents dc
-                       JOIN ag.ag_login_surveys als USING (ag_login_id)
-                       WHERE  dc.main_survey_id = als.survey_id"""
-        dupes_lookup = dict(self._con.execute_fetchall(dupes_sql))
+        # copied since newly geocoded zipcodes are added to it
+        zip_lookup = dict(self._refs.get('zipcodes_full' if full
+                                         else 'zipcodes'))
+        country_lookup = self._refs.get('countries')
+        dupes_lookup = self._refs.get('duplicate_consents')
 
         # Get external survey answers and normalize column names
         external_sql = """SELECT survey_id, external_survey, answers
@@ -759,196 +1029,36 @@ class KniminAccess(object):
             md[1][barcode] = self._geocode(md[1][barcode], zipcode, country,
                                            zip_lookup, country_lookup)
 
-        # Human survey (id 1)
-        for barcode, responses in md[1].items():
-            bc_info = barcode_info[barcode[:9]]
-            try:
-                # convert numeric fields
-                for field in ('HEIGHT_CM', 'WEIGHT_KG'):
-                    md[1][barcode][field] = sub('[^0-9.]',
-                                                '', md[1][barcode][field])
-                    if md[1][barcode][field]:
-                        md[1][barcode][field] = float(md[1][barcode][field])
-                    else:
-                        md[1][barcode][field] = 'Unspecified'
-
-                # Correct height units
-                if responses['HEIGHT_UNITS'] == 'inches' and \
-                        isinstance(md[1][barcode]['HEIGHT_CM'], float):
-                    md[1][barcode]['HEIGHT_CM'] = \
-                        2.54*md[1][barcode]['HEIGHT_CM']
-                md[1][barcode]['HEIGHT_UNITS'] = 'centimeters'
-
-                # Correct weight units
-                if responses['WEIGHT_UNITS'] == 'pounds' and \
-                        isinstance(md[1][barcode]['WEIGHT_KG'], float):
-                    md[1][barcode]['WEIGHT_KG'] = \
-                        md[1][barcode]['WEIGHT_KG']/2.20462
-                md[1][barcode]['WEIGHT_UNITS'] = 'kilograms'
-
-                if all([isinstance(md[1][barcode]['WEIGHT_KG'], float),
-                        md[1][barcode]['WEIGHT_KG'] != 0.0,
-                        isinstance(md[1][barcode]['HEIGHT_CM'], float),
-                        md[1][barcode]['HEIGHT_CM'] != 0.0]):
-                    md[1][barcode]['BMI'] = md[1][barcode]['WEIGHT_KG'] / \
-                        (md[1][barcode]['HEIGHT_CM']/100)**2
-                else:
-                    md[1][barcode]['BMI'] = 'Unspecified'
-
-                # Get age in years (int) and remove birth month
-                if responses['BIRTH_MONTH'] != 'Unspecified' and \
-                        responses['BIRTH_YEAR'] != 'Unspecified':
-                    birthdate = datetime(
-                        int(responses['BIRTH_YEAR']),
-                        int(month_int_lookup[responses['BIRTH_MONTH']]), 1)
-                    now = datetime.now()
-                    md[1][barcode]['AGE_YEARS'] = int(
-                        self._months_between_dates(birthdate, now) / 12.0)
-                else:
-                    md[1][barcode]['AGE_YEARS'] = 'Unspecified'
-
-                # GENDER to SEX
-                sex = md[1][barcode]['GENDER']
-                if sex is not None:
-                    sex = sex.lower()
-                else:
-                    sex = 'Unspecified'
-                md[1][barcode]['SEX'] = sex
+        # Human survey (id 1), formatting all barcodes it can at once and
+        # the ones needing geocoding, or failing, one at a time
+        now = datetime.now()
+        remaining = format_human_frame(md[1], barcode_info, zip_lookup,
+                                       country_lookup, dupes_lookup, now)
 
-                # convenience variable
-                site = bc_info['site_sampled']
+        def geocode_row(row, zipcode, country):
+            return self._geocode(row, zipcode, country, zip_lookup,
+                                 country_lookup)
 
-                # Invariant information
-                md[1][barcode]['ANONYMIZED_NAME'] = barcode
-                md[1][barcode]['HOST_TAXID'] = 9606
-                md[1][barcode]['SCIENTIFIC_NAME'] = 'Homo sapiens'
-                md[1][barcode]['TITLE'] = 'American Gut Project'
-                md[1][barcode]['ASSIGNED_FROM_GEO'] = 'Yes'
-                md[1][barcode]['ENV_BIOME'] = 'dense settlement biome'
-                md[1][barcode]['ENV_FEATURE'] = 'human-associated habitat'
-                md[1][barcode]['DNA_EXTRACTED'] = 'Yes'
-                md[1][barcode]['PHYSICAL_SPECIMEN_REMAINING'] = 'Yes'
-                md[1][barcode]['PHYSICAL_SPECIMEN_LOCATION'] = 'UCSDMI'
-                md[1][barcode]['HOST_COMMON_NAME'] = 'human'
-
-                # Sample-dependent information
-                zipcode = md[1][barcode]['ZIP_CODE'].upper()
-                country = bc_info['country']
-                md[1][barcode] = self._geocode(
-                    md[1][barcode], zipcode, country, zip_lookup,
-                    country_lookup)
-
-                md[1][barcode]['SURVEY_ID'] = survey_lookup[barcode[:9]]
-                md[1][barcode].update(md_lookup[site])
-                md[1][barcode]['COLLECTION_DATE'] = \
-                    bc_info['sample_date'].strftime('%m/%d/%Y')
-
-                if bc_info['sample_time']:
-                    md[1][barcode]['COLLECTION_TIME'] = \
-                        bc_info['sample_time'].strftime('%H:%M')
-                else:
-                    # If no time data, show unspecified and default to midnight
-                    md[1][barcode]['COLLECTION_TIME'] = 'Unspecified'
-                    bc_info['sample_time'] = time(0, 0)
-
-                md[1][barcode]['COLLECTION_TIMESTAMP'] = datetime.combine(
-                    bc_info['sample_date'],
-                    bc_info['sample_time']).strftime('%m/%d/%Y %H:%M')
-
-                participant_name = dupes_lookup.get(
-                    md[1][barcode]['SURVEY_ID'],
-                    bc_info['participant_name']).lower()
-
-                md[1][barcode]['HOST_SUBJECT_ID'] = sha512(
-                    bc_info['ag_login_id'] + participant_name).hexdigest()
-                md[1][barcode]['PUBLIC'] = 'Yes'
-
-                # Convert finer grained IBD to coarser grained
-                ibd = md[1][barcode].get('IBD_DIAGNOSIS_REFINED',
-                                         'Unspecified')
-                if ibd != 'Unspecified':
-                    if ibd in {"Ileal Crohn's Disease",
-                               "Colonic Crohn's Disease",
-                               "Ileal and Colonic Crohn's Disease"}:
-                        md[1][barcode]['IBD_DIAGNOSIS'] = "Crohn's disease"
-                    elif ibd == 'Ulcerative colitis':
-                        md[1][barcode]['IBD_DIAGNOSIS'] = 'Ulcerative colitis'
-
-                # Add categorization columns
-                md[1][barcode]['ALCOHOL_CONSUMPTION'] = categorize_etoh(
-                    md[1][barcode]['ALCOHOL_FREQUENCY'])
-                md[1][barcode]['BMI_CAT'] = categorize_bmi(
-                    md[1][barcode]['BMI'])
-                md[1][barcode]['BMI_CORRECTED'] = correct_bmi(
-                    md[1][barcode]['BMI'])
-                md[1][barcode]['COLLECTION_SEASON'] = season_lookup[
-                    bc_info['sample_date'].month]
-                state = md[1][barcode]['STATE']
-                try:
-                    md[1][barcode]['CENSUS_REGION'] = \
-                        regions_by_state[state]['Census_1']
-                    md[1][barcode]['ECONOMIC_REGION'] = \
-                        regions_by_state[state]['Economic']
-                except KeyError:
-                    md[1][barcode]['CENSUS_REGION'] = 'Unspecified'
-                    md[1][barcode]['ECONOMIC_REGION'] = 'Unspecified'
-                md[1][barcode]['SUBSET_AGE'] = \
-                    19 < md[1][barcode]['AGE_YEARS'] < 70 and \
-                    not md[1][barcode]['AGE_YEARS'] == 'Unspecified'
-                md[1][barcode]['SUBSET_DIABETES'] = \
-                    (md[1][barcode]['DIABETES'] ==
-                        'I do not have this condition')
-                md[1][barcode]['SUBSET_IBD'] = \
-                    md[1][barcode]['IBD'] == 'I do not have this condition'
-                md[1][barcode]['SUBSET_ANTIBIOTIC_HISTORY'] = \
-                    (md[1][barcode]['ANTIBIOTIC_HISTORY'] ==
-                     'I have not taken antibiotics in the past year.')
-                md[1][barcode]['SUBSET_BMI'] = \
-                    18.5 <= md[1][barcode]['BMI'] < 30 and \
-                    not md[1][barcode]['BMI'] == 'Unspecified'
-                md[1][barcode]['SUBSET_HEALTHY'] = all([
-                    md[1][barcode]['SUBSET_AGE'],
-                    md[1][barcode]['SUBSET_DIABETES'],
-                    md[1][barcode]['SUBSET_IBD'],
-                    md[1][barcode]['SUBSET_ANTIBIOTIC_HISTORY'],
-                    md[1][barcode]['SUBSET_BMI']])
-                md[1][barcode]['COLLECTION_MONTH'] = month_str_lookup.get(
-                    bc_info['sample_date'].month, 'Unspecified')
-                md[1][barcode]['AGE_CORRECTED'] = correct_age(
-                    md[1][barcode]['AGE_YEARS'], md[1][barcode]['HEIGHT_CM'],
-                    md[1][barcode]['WEIGHT_KG'],
-                    md[1][barcode]['ALCOHOL_CONSUMPTION'])
-                md[1][barcode]['AGE_CAT'] = categorize_age(
-                    md[1][barcode]['AGE_CORRECTED'])
-
-                # make sure conversions are done
-                if md[1][barcode]['WEIGHT_KG'] != 'Unspecified':
-                    md[1][barcode]['WEIGHT_KG'] = int(
-                        md[1][barcode]['WEIGHT_KG'])
-                if md[1][barcode]['HEIGHT_CM'] != 'Unspecified':
-                    md[1][barcode]['HEIGHT_CM'] = int(
-                        md[1][barcode]['HEIGHT_CM'])
-                if md[1][barcode]['BMI'] != 'Unspecified':
-                    md[1][barcode]['BMI'] = '%.2f' % md[1][barcode]['BMI']
-
-                # Get rid of columns not wanted for pulldown
-                if not full:
-                    for col in ebi_remove:
-                        try:
-                            del md[1][barcode][col]
-                        except KeyError:
-                            # Column doesn't exist already for survey
-                            # (retired), so no removal needed
-                            pass
-
-                # Add the external surveys
-                if unknown_external:
-                    md[1][barcode].update(external.get(md[1][barcode][
-                        'SURVEY_ID'], unknown_external))
+        for barcode in remaining:
+            bc_info = barcode_info[barcode[:9]]
+            try:
+                format_human_barcode(barcode, md[1][barcode], bc_info,
+                                     dupes_lookup, geocode_row, now)
             except Exception as e:
                 # Add barcode to error and remove from metadata info
                 errors[barcode] = str(e)
                 del md[1][barcode]
+
+        for barcode, row in viewitems(md[1]):
+            # Get rid of columns not wanted for pulldown
+            if not full:
+                for col in ebi_remove:
+                    # Column may not exist for survey (retired)
+                    row.pop(col, None)
+
+            # Add the external surveys
+            if unknown_external:
+                row.update(external.get(row['SURVEY_ID'], unknown_external))
         return md, errors
 
     def format_environmental(self, barcodes):
@@ -969,20 +1079,9 @@ class KniminAccess(object):
         barcode_info = self.get_ag_barcode_details(
             [b[0][:9] for b in barcodes])
         # tuples are latitude, longitude, elevation, state
-        zipcode_sql = """SELECT UPPER(zipcode), country,
-                             round(latitude::numeric, 1),
-                             round(longitude::numeric,1),
-                             round(elevation::numeric, 1), state
-                         FROM zipcodes"""
-        zip_lookup = defaultdict(dict)
-        for row in self._con.execute_fetchall(zipcode_sql):
-            zip_lookup[row[0]][row[1]] = map(
-                lambda x: x if x is not None else 'Unspecified', row[2:])
-
-        country_sql = "SELECT country, EBI from ag.iso_country_lookup"
-        country_lookup = dict(self._con.execute_fetchall(country_sql))
-        # Add for scrubbed testing database
-        country_lookup['REMOVED'] = 'REMOVED'
+        # copied since newly geocoded zipcodes are added to it
+        zip_lookup = dict(self._refs.get('zipcodes'))
+        country_lookup = self._refs.get('countries')
 
         for barcode, env in barcodes:
             # Not using defaultdict so we don't ever allow accidental insertion
@@ -1035,62 +1134,645 @@ class KniminAccess(object):
 
         Returns
         -------
-        list of tuple
-            (barcode, participant name)
-        """
-        sql = """SELECT barcode, participant_name
-                 FROM ag.ag_kit_barcodes
-                 JOIN ag.ag_login_surveys USING (survey_id)
-                 WHERE participant_name IS NOT NULL"""
-        return self._con.execute_fetchall(sql)
+        list of tuple
+            (barcode, participant name)
+        """
+        sql = """SELECT barcode, participant_name
+                 FROM ag.ag_kit_barcodes
+                 JOIN ag.ag_login_surveys USING (survey_id)
+                 WHERE participant_name IS NOT NULL"""
+        return list(self._con.execute_iter(sql))
+
+    def _convert_header(self, survey, header):
+        return converter.camel_to_snake('_'.join(
+            [survey.replace(' ', '_'), header])).upper()
+
+    def pulldown(self, barcodes, blanks=None, external=None, full=False):
+        """Pulls down AG metadata for given barcodes
+
+        Parameters
+        ----------
+        barcodes : list of str
+            Barcodes to pull metadata down for
+        blanks : list of str, optional
+            Names for the blanks to add. Default None
+            Blanks added to survey 1
+        external : list of str, optional
+            External surveys to add to the pulldown, default None
+        full : bool, optional
+            If True do a full pulldown, otherwise do an EBI-cleaned pulldown.
+            Default False.
+
+        Returns
+        -------
+        metadata : dict of str
+            Tab delimited qiita sample template, keyed to survey ID it came
+            from
+        failures : dict
+            Barcodes unable to pull metadata down, in the form
+            {barcode: reason, ...}
+
+        See Also
+        --------
+        pulldown_iter
+        """
+        surveys, failures = self.pulldown_iter(barcodes, blanks, external,
+                                               full)
+        metadata = {survey: b''.join(blocks) for survey, blocks in surveys}
+        return metadata, failures
+
+    def pulldown_iter(self, barcodes, blanks=None, external=None,
+                      full=False, chunk_size=1000, block_size=65536):
+        """Pulls down AG metadata without holding it all in memory
+
+        Parameters
+        ----------
+        barcodes : list of str
+            Barcodes to pull metadata down for
+        blanks : list of str, optional
+            Names for the blanks to add. Default None
+            Blanks added to survey 1
+        external : list of str, optional
+            External surveys to add to the pulldown, default None
+        full : bool, optional
+            If True do a full pulldown, otherwise do an EBI-cleaned pulldown.
+            Default False.
+        chunk_size : int, optional
+            Number of barcodes formatted at a time. Default 1000
+        block_size : int, optional
+            Size in bytes of the blocks yielded for each survey. Default 64KB
+
+        Returns
+        -------
+        surveys : generator of (int, generator of str)
+            Survey ID and the utf-8 encoded blocks of its tab delimited qiita
+            sample template, in survey order
+        failures : dict
+            Barcodes unable to pull metadata down, in the form
+            {barcode: reason, ...}
+
+        Notes
+        -----
+        Barcodes are formatted `chunk_size` at a time and the rows written to
+        a spooled temporary file per survey, so memory use depends on the
+        chunk size and not on the number of barcodes pulled down. Rows are in
+        barcode order, same as `pulldown`.
+        """
+        # keep barcodes with appended info in the same chunk as their base
+        # barcode, since they replace it in the survey results
+        by_base = group_barcodes_by_base(barcodes)
+        bases = sorted(by_base)
+
+        errors = {}
+        barcodes_seen = set()
+        spools = {}
+        try:
+            for start in range(0, len(bases), chunk_size):
+                chunk = [b for base in bases[start:start + chunk_size]
+                         for b in by_base[base]]
+                self._spool_pulldown_chunk(chunk, external, full, spools,
+                                           barcodes_seen, errors)
+
+            if 1 in spools and blanks:
+                # only add blanks to human survey sample data
+                spool, headers = spools[1]
+                spool.write(self._pulldown_blanks(blanks, headers))
+
+            # Do the pulldown for the environmental samples
+            env_barcodes = self._pulldown_environmental(
+                barcodes, barcodes_seen, errors)
+        except Exception:
+            for spool, _ in spools.values():
+                spool.close()
+            raise
+
+        failures = set(barcodes).union(env_barcodes)
+        failures = self._explain_pulldown_failures(
+            failures.difference(barcodes_seen))
+        failures.update(errors)
+
+        return self._read_spools(spools, block_size), failures
+
+    def _spool_pulldown_chunk(self, chunk, external, full, spools,
+                              barcodes_seen, errors):
+        """Formats a chunk of barcodes and writes them to the survey spools
+
+        Parameters
+        ----------
+        chunk : list of str
+            Barcodes to format
+        external : list of str or None
+            External surveys to add to the pulldown
+        full : bool
+            Whether to do a full pulldown
+        spools : dict of tuple
+            {survey: (spool, headers)}, spools are started as needed
+        barcodes_seen : set of str
+            Barcodes formatted, updated with the chunk's
+        errors : dict
+            Formatting errors, updated with the chunk's
+        """
+        survey_info = self.get_surveys(chunk)
+        if not survey_info:
+            return
+        results, err = self.format_survey_data(survey_info, external, full)
+        errors.update(err)
+        for survey, bc_responses in viewitems(results):
+            if not bc_responses:
+                continue
+            if survey not in spools:
+                spools[survey] = self._pulldown_spool(survey, bc_responses,
+                                                      external)
+            spool, headers = spools[survey]
+            for barcode, answers in sorted(viewitems(bc_responses)):
+                barcodes_seen.add(barcode)
+                self._write_pulldown_row(spool, barcode, headers, answers)
+
+    def _pulldown_environmental(self, barcodes, barcodes_seen, errors):
+        """Formats the environmental samples among barcodes
+
+        Returns
+        -------
+        list of str
+            The environmental barcodes, added to `barcodes_seen` if
+            formatted and to `errors` if not
+        """
+        sql = """SELECT barcode, environment_sampled
+                 FROM ag.ag_kit_barcodes
+                 WHERE environment_sampled IS NOT NULL
+                     AND environment_sampled != ''
+                     AND barcode IN %s"""
+        env_barcodes = self._con.execute_fetchall(sql, [tuple(barcodes)])
+        if len(env_barcodes) > 0:
+            env, err = self.format_environmental(env_barcodes)
+            barcodes_seen.update(env)
+            errors.update(err)
+        return [b[0] for b in env_barcodes]
+
+    def _read_spools(self, spools, block_size):
+        """Yields the survey spools, in survey order, closing them when done
+
+        Returns
+        -------
+        generator of (int, generator of str)
+            Survey ID and the blocks of its spool
+        """
+        try:
+            for survey in sorted(spools):
+                spool = spools[survey][0]
+                spool.seek(0)
+                yield survey, _read_blocks(spool, block_size)
+        finally:
+            for spool, _ in spools.values():
+                spool.close()
+
+    def pulldown_parallel(self, barcodes, blanks=None, full=False,
+                          workers=2, chunk_size=1000, block_size=65536):
+        """Pulls down AG metadata split over worker processes
+
+        Parameters
+        ----------
+        barcodes : list of str
+            Barcodes to pull metadata down for
+        blanks : list of str, optional
+            Names for the blanks to add. Default None
+            Blanks added to survey 1
+        full : bool, optional
+            If True do a full pulldown, otherwise do an EBI-cleaned pulldown.
+            Default False.
+        workers : int, optional
+            Number of worker processes. Default 2
+        chunk_size : int, optional
+            Number of barcodes each worker formats at a time. Default 1000
+        block_size : int, optional
+            Size in bytes of the blocks yielded for each survey. Default 64KB
+
+        Returns
+        -------
+        surveys : generator of (int, generator of str)
+            Survey ID and the utf-8 encoded blocks of its tab delimited qiita
+            sample template, in survey order
+        failures : dict
+            Barcodes unable to pull metadata down, in the form
+            {barcode: reason, ...}
+
+        Notes
+        -----
+        The barcodes are split in contiguous shards, one per worker, and each
+        worker pulls its shard down with `pulldown_iter` over its own
+        database connection to a temporary file per survey. The files are
+        joined in shard order, so rows are in barcode order like with
+        `pulldown_iter`. Each survey gets the sorted union of the columns
+        from all shards, filling columns a shard does not have with
+        Unspecified. Failures are the same as with `pulldown_iter`.
+        """
+        shards = shard_barcodes(barcodes, workers)
+        tmp_dir = mkdtemp(prefix='pulldown_')
+        try:
+            pool = Pool(len(shards) or 1, _init_pulldown_worker,
+                        (self.config, ))
+            try:
+                parts = pool.map(_pulldown_shard, [
+                    (shard, full, chunk_size, join(tmp_dir, str(i)))
+                    for i, shard in enumerate(shards)])
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        except BaseException:
+            rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        failures = {}
+        headers = defaultdict(set)
+        for files, shard_failures in parts:
+            failures.update(shard_failures)
+            for survey, fp in viewitems(files):
+                with open(fp, 'rb') as f:
+                    headers[survey].update(self._pulldown_headers(f))
+
+        def read_parts():
+            try:
+                for survey in sorted(headers):
+                    survey_headers = sorted(headers[survey])
+                    yield survey, self._join_pulldowns(
+                        [files[survey] for files, _ in parts
+                         if survey in files], survey_headers,
+                        blanks if survey == 1 else None, block_size)
+            finally:
+                rmtree(tmp_dir, ignore_errors=True)
+
+        return read_parts(), failures
+
+    def pulldown_fingerprints(self, barcodes):
+        """Fingerprints of everything pulled down for each barcode
+
+        Parameters
+        ----------
+        barcodes : iterable of str
+            Barcodes to fingerprint, some possibly with appended info
+
+        Returns
+        -------
+        dict of str
+            {barcode: fingerprint, ...}, only for AG barcodes
 
-    def _convert_header(self, survey, header):
-        return converter.camel_to_snake('_'.join(
-            [survey.replace(' ', '_'), header])).upper()
+        Notes
+        -----
+        A fingerprint changes whenever the pulldown of the barcode could: its
+        kit, login and consent, survey answers, external survey pulldowns,
+        geocoded zipcode, EBI country name or duplicate consents. Barcodes
+        with appended info made from the same barcode replace it in the
+        survey results, so their fingerprints also depend on which of them
+        are pulled down together.
+        """
+        by_base = group_barcodes_by_base(barcodes)
+        if not by_base:
+            return {}
 
-    def pulldown(self, barcodes, blanks=None, external=None,  # noqa
-                 full=False):
-        """Pulls down AG metadata for given barcodes
+        sql = """SELECT akb.barcode, md5(concat_ws('|',
+                     akb::text, k::text, l::text, als::text,
+                     (SELECT string_agg(sa::text, '|' ORDER BY sa::text)
+                      FROM ag.survey_answers sa
+                      WHERE sa.survey_id = akb.survey_id),
+                     (SELECT string_agg(sao::text, '|' ORDER BY sao::text)
+                      FROM ag.survey_answers_other sao
+                      WHERE sao.survey_id = akb.survey_id),
+                     (SELECT string_agg(
+                         concat_ws(':', external_survey_id, pulldown_date),
+                         '|' ORDER BY external_survey_id, pulldown_date)
+                      FROM ag.external_survey_answers esa
+                      WHERE esa.survey_id = akb.survey_id),
+                     (SELECT string_agg(z::text, '|' ORDER BY z::text)
+                      FROM ag.survey_answers_other sao
+                      JOIN ag.zipcodes z ON UPPER(z.zipcode) =
+                         UPPER(btrim(sao.response::varchar, %s))
+                      WHERE sao.survey_id = akb.survey_id
+                         AND z.country = l.country),
+                     (SELECT EBI FROM ag.iso_country_lookup icl
+                      WHERE icl.country = l.country),
+                     (SELECT string_agg(m.participant_name, '|'
+                                        ORDER BY m.participant_name)
+                      FROM ag.duplicate_consents dc
+                      JOIN ag.ag_login_surveys m
+                         ON m.ag_login_id = dc.ag_login_id
+                         AND m.survey_id = dc.main_survey_id
+                      WHERE dc.duplicate_survey_id = akb.survey_id)))
+                 FROM ag.ag_kit_barcodes akb
+                 JOIN ag.ag_kit k USING (ag_kit_id)
+                 JOIN ag.ag_login l ON l.ag_login_id = k.ag_login_id
+                 LEFT JOIN ag.ag_login_surveys als
+                    ON als.survey_id = akb.survey_id
+                    AND als.ag_login_id = k.ag_login_id
+                 WHERE akb.barcode IN %s"""
+        # characters get_surveys strips from the json STRING answers
+        strip = '"\'[]_,\t\r\n\\/ '
+        fingerprints = {}
+        for base, fingerprint in self._con.execute_iter(
+                sql, [strip, tuple(by_base)], tuples=True):
+            group = by_base[base]
+            if len(group) > 1:
+                fingerprint = ' '.join([fingerprint] + group)
+            fingerprints.update((barcode, fingerprint) for barcode in group)
+        return fingerprints
+
+    def pulldown_incremental(self, barcodes, state_dir, blanks=None,
+                             full=False, workers=1, chunk_size=1000,
+                             block_size=65536):
+        """Pulls down AG metadata, formatting only barcodes changed since the
+        last pulldown kept in a state directory
 
         Parameters
         ----------
         barcodes : list of str
             Barcodes to pull metadata down for
+        state_dir : str
+            Directory keeping the last pulldown and the fingerprints of its
+            barcodes. Updated to hold this pulldown
         blanks : list of str, optional
             Names for the blanks to add. Default None
             Blanks added to survey 1
-        external : list of str, optional
-            External surveys to add to the pulldown, default None
         full : bool, optional
             If True do a full pulldown, otherwise do an EBI-cleaned pulldown.
             Default False.
+        workers : int, optional
+            Number of worker processes pulling down the changed barcodes, see
+            `pulldown_parallel`. Default 1, pull down in this process
+        chunk_size : int, optional
+            Number of barcodes formatted at a time. Default 1000
+        block_size : int, optional
+            Size in bytes of the blocks yielded for each survey. Default 64KB
 
         Returns
         -------
-        metadata : dict of str
-            Tab delimited qiita sample template, keyed to survey ID it came
-            from
+        surveys : generator of (int, generator of str)
+            Survey ID and the utf-8 encoded blocks of its tab delimited qiita
+            sample template, in survey order
         failures : dict
             Barcodes unable to pull metadata down, in the form
             {barcode: reason, ...}
+
+        Notes
+        -----
+        Only barcodes whose `pulldown_fingerprints` changed, or that were not
+        pulled down last time, are pulled down again. Their rows are merged
+        in barcode order with the rows of the other barcodes kept from the
+        last pulldown, under the sorted union of the columns of both, same
+        as `pulldown_parallel`. Barcodes not asked for are dropped. Ages
+        depend on the current month, and the last pulldown is not reused if
+        it was in another month or with another `full`, so the first
+        pulldown of every month formats all barcodes.
+
+        The blocks are read from the state directory, so they have to be
+        read before pulling down to it again.
         """
-        all_results = {}
-        errors = {}
-        all_survey_info = self.get_surveys(barcodes)
-        if len(all_survey_info) > 0:
-            all_results, errors = self.format_survey_data(all_survey_info,
-                                                          external, full)
+        state_fp = join(state_dir, 'pulldown_state.json')
+        now = datetime.now()
+        run = {'full': full, 'month': now.strftime('%Y-%m')}
+        state = self._load_pulldown_state(state_fp, run)
+
+        fingerprints = self.pulldown_fingerprints(barcodes)
+        last_fingerprints = state['fingerprints']
+        dirty = sorted(b for b in set(barcodes) if b not in fingerprints or
+                       last_fingerprints.get(b) != fingerprints[b])
+        clean = set(barcodes).difference(dirty)
+        failures = {b: reason for b, reason in viewitems(state['failures'])
+                    if b in clean}
+
+        run_id = now.strftime('%Y%m%d%H%M%S%f')
+        tmp_dir = mkdtemp(prefix='pulldown_', dir=state_dir)
+        try:
+            new_files = {}
+            if dirty:
+                new_files, dirty_failures = self._write_pulldown(
+                    dirty, tmp_dir, full, workers, chunk_size, block_size)
+                failures.update(dirty_failures)
+            files = self._merge_pulldown_files(
+                state_dir, state['files'], clean, new_files, tmp_dir, run_id)
+        finally:
+            rmtree(tmp_dir, ignore_errors=True)
+
+        self._save_pulldown_state(
+            state_fp, {'run': run, 'fingerprints': fingerprints,
+                       'failures': failures, 'files': files})
+        for name in set(state['files'].values()).difference(files.values()):
+            remove(join(state_dir, name))
+
+        return self._read_pulldown_files(state_dir, files, blanks,
+                                         block_size), failures
+
+    def _load_pulldown_state(self, state_fp, run):
+        """Loads the state of the last incremental pulldown
+
+        An empty state if there was none, or it was for another run
+        """
+        state = {'run': run, 'fingerprints': {}, 'failures': {}, 'files': {}}
+        if exists(state_fp):
+            with open(state_fp) as f:
+                last = json.load(f)
+            if last['run'] == run:
+                state = last
+                state['files'] = {int(survey): name for survey, name in
+                                  viewitems(last['files'])}
+        return state
+
+    def _save_pulldown_state(self, state_fp, state):
+        """Saves the state of an incremental pulldown"""
+        # the new state replaces the last one at once, so an interrupted
+        # pulldown leaves the last one usable
+        with open(state_fp + '.tmp', 'w') as f:
+            json.dump(state, f)
+        rename(state_fp + '.tmp', state_fp)
+
+    def _write_pulldown(self, barcodes, out_dir, full, workers, chunk_size,
+                        block_size):
+        """Pulls down barcodes to one file per survey in a directory
 
-        # Do the pulldown for the environmental samples
-        sql = """SELECT barcode, environment_sampled
-                 FROM ag.ag_kit_barcodes
-                 WHERE environment_sampled IS NOT NULL
-                     AND environment_sampled != ''
-                     AND barcode IN %s"""
-        env_barcodes = self._con.execute_fetchall(sql, [tuple(barcodes)])
-        barcodes.extend([b[0] for b in env_barcodes])
+        Returns
+        -------
+        files : dict
+            Path of the file written for each survey, keyed by survey ID
+        failures : dict
+            Barcodes unable to pull metadata down, {barcode: reason, ...}
+        """
+        if workers > 1:
+            surveys, failures = self.pulldown_parallel(
+                barcodes, full=full, workers=workers, chunk_size=chunk_size,
+                block_size=block_size)
+        else:
+            surveys, failures = self.pulldown_iter(
+                barcodes, full=full, chunk_size=chunk_size,
+                block_size=block_size)
+        files = {}
+        for survey, blocks in surveys:
+            files[survey] = join(out_dir, 'survey_%s_md.txt' % survey)
+            with open(files[survey], 'wb') as f:
+                f.writelines(blocks)
+        return files, failures
+
+    def _merge_pulldown_files(self, state_dir, last_files, clean, new_files,
+                              tmp_dir, run_id):
+        """Merges the last pulldown's rows for clean barcodes with new ones
+
+        Returns
+        -------
+        dict
+            Name of the merged file moved to `state_dir`, keyed by survey ID.
+            Surveys without any rows left are not included
+        """
+        files = {}
+        for survey in sorted(set(last_files).union(new_files)):
+            last_fp = None
+            if survey in last_files:
+                last_fp = join(state_dir, last_files[survey])
+            name = 'survey_%s_md.%s.txt' % (survey, run_id)
+            if self._merge_pulldowns(last_fp, clean, new_files.get(survey),
+                                     join(tmp_dir, name)):
+                files[survey] = name
+        for name in files.values():
+            rename(join(tmp_dir, name), join(state_dir, name))
+        return files
+
+    def _read_pulldown_files(self, state_dir, files, blanks, block_size):
+        """Yields survey ID and blocks of each pulldown file, in order"""
+        for survey in sorted(files):
+            fp = join(state_dir, files[survey])
+            with open(fp, 'rb') as f:
+                headers = self._pulldown_headers(f)
+            yield survey, self._join_pulldowns(
+                [fp], headers, blanks if survey == 1 else None, block_size)
+
+    def _pulldown_headers(self, f):
+        """Reads the column headers, without sample_name, of a pulldown file"""
+        return f.readline().decode('utf-8').rstrip('\n').split('\t')[1:]
+
+    def _join_pulldowns(self, fps, headers, blanks, block_size):
+        """Joins pulldown files of a survey, using the given column headers
+
+        Parameters
+        ----------
+        fps : list of str
+            The pulldown files, in the order their rows are joined
+        headers : list of str
+            Sorted column headers, without sample_name
+        blanks : list of str or None
+            Names for the blanks to add at the end
+        block_size : int
+            Size in bytes of the blocks yielded for files already using the
+            headers
+
+        Returns
+        -------
+        generator of str
+            utf-8 encoded blocks of the joined file
+        """
+        yield '\t'.join(['sample_name'] + headers).encode('utf-8')
+        for fp in fps:
+            with open(fp, 'rb') as f:
+                file_headers = self._pulldown_headers(f)
+                if file_headers == headers:
+                    # rows start after the newline ending the header line
+                    yield b'\n'
+                    for block in iter(lambda: f.read(block_size), b''):
+                        yield block
+                    continue
+                for _, line in self._pulldown_rows(f, file_headers, headers):
+                    yield line
+        if blanks:
+            yield self._pulldown_blanks(blanks, headers)
+
+    def _pulldown_rows(self, f, file_headers, headers):
+        """Rows of a pulldown file, using the given column headers
+
+        Parameters
+        ----------
+        f : file
+            The pulldown file, read past the header line
+        file_headers : list of str
+            Column headers of the file, without sample_name
+        headers : list of str
+            Column headers to use, without sample_name. Columns the file does
+            not have are filled with Unspecified
+
+        Returns
+        -------
+        generator of (str, str)
+            The sample name and utf-8 encoded row, starting with a newline
+        """
+        index = {h: i for i, h in enumerate(file_headers, 1)}
+        columns = [index.get(h) for h in headers]
+        for line in f:
+            row = line.decode('utf-8').rstrip('\n').split('\t')
+            yield row[0], ('\n' + '\t'.join(
+                [row[0]] + [row[i] if i is not None else 'Unspecified'
+                            for i in columns])).encode('utf-8')
+
+    def _merge_pulldowns(self, last_fp, keep, new_fp, out_fp):
+        """Merges rows kept from the last pulldown file of a survey with new
+        ones
+
+        Parameters
+        ----------
+        last_fp : str or None
+            The last pulldown file of the survey, if any
+        keep : set of str
+            Samples to keep the rows of from the last pulldown file
+        new_fp : str or None
+            The new pulldown file of the survey, if any
+        out_fp : str
+            Where to write the merged file, with the sorted union of the
+            columns of both files
+
+        Returns
+        -------
+        bool
+            Whether the merged file has any rows. If not it is not written
+        """
+        handles = [open(fp, 'rb') for fp in (last_fp, new_fp)
+                   if fp is not None]
+        try:
+            file_headers = [self._pulldown_headers(f) for f in handles]
+            headers = sorted(set().union(*file_headers))
+            rows = [self._pulldown_rows(f, h, headers)
+                    for f, h in zip(handles, file_headers)]
+            if last_fp is not None:
+                rows[0] = (row for row in rows[0] if row[0] in keep)
+            # both files are in sample order and share no samples
+            merged = merge(*rows)
+            first = next(merged, None)
+            if first is None:
+                return False
+            with open(out_fp, 'wb') as f:
+                f.write('\t'.join(['sample_name'] + headers).encode('utf-8'))
+                f.write(first[1])
+                f.writelines(line for _, line in merged)
+        finally:
+            for f in handles:
+                f.close()
+        return True
+
+    def _pulldown_spool(self, survey, bc_responses, external):
+        """Starts the pulldown file for a survey
+
+        Parameters
+        ----------
+        survey : int
+            Survey ID
+        bc_responses : dict of dict
+            The first formatted barcodes for the survey, in the form
+            {barcode: {shortname: response, ...}, ...}
+        external : list of str
+            External surveys added to the pulldown
 
-        # Set up sql for getting all survey question shortnames
+        Returns
+        -------
+        spool : SpooledTemporaryFile
+            The file, with the header line written
+        headers : list of str
+            The sorted column headers, without sample_name
+        """
         header_sql = """SELECT DISTINCT question_shortname
                         FROM ag.survey_question
                         JOIN ag.group_questions USING (survey_question_id)
@@ -1103,61 +1785,47 @@ class KniminAccess(object):
                                 USING (external_survey_id)
                             WHERE external_survey = %s"""
 
-        # keep track of which barcodes were seen so we know which weren't
-        barcodes_seen = set()
-        metadata = {}
-        for survey, bc_responses in all_results.items():
-            if not bc_responses:
-                continue
-            # Get the headers for the survey, then union with ones added during
-            # pulldown formatting
-            headers = set(x[0] for x in
-                          self._con.execute_fetchall(header_sql, [survey]))
-            headers = headers.union(bc_responses.values()[0])
-            # Add external survey headers to the human survey answers
-            if survey == 1 and external is not None:
-                for ext in external:
-                    # get all external survey headers and format them
-                    ext_headers = self._con.execute_fetchall(
-                        ext_survey_sql, [ext])
-                    headers.union(self._convert_header(ext, h[0])
-                                  for h in ext_headers)
-            # Remove the ebi prohibited columns
-            headers = headers.difference(ebi_remove)
-            headers = sorted(headers)
-            survey_md = [''.join(['sample_name\t', '\t'.join(headers)])]
-
-            for barcode, shortnames_answers in sorted(bc_responses.items()):
-                barcodes_seen.add(barcode)
-                oa_hold = [barcode]
-                for h in headers:
-                    # Take care of retired questions not having an answer
-                    answer = shortnames_answers.get(h, 'Unspecified')
-                    # Convert everything to utf-8 unicode for standardization
-                    converted = self._unicode_convert(answer)
-                    oa_hold.append(converted)
-                survey_md.append('\t'.join(oa_hold))
-            if survey == 1 and blanks:
-                # only add blanks to human survey sample data
-                for blank in blanks:
-                    blanks_copy = copy(blanks_values)
-                    blanks_copy['ANONYMIZED_NAME'] = blank
-                    blanks_copy['HOST_SUBJECT_ID'] = blank
-                    survey_md.append(
-                        '\t'.join([blank] + [blanks_copy[h]
-                                             for h in headers]))
-            metadata[survey] = '\n'.join(survey_md).encode('utf-8')
-
-        if len(env_barcodes) > 0:
-            all_results['env'], err = self.format_environmental(env_barcodes)
-            for b in all_results['env']:
-                barcodes_seen.add(b)
-            errors.update(err)
-
-        failures = set(barcodes) - barcodes_seen
-        failures = self._explain_pulldown_failures(failures)
-        failures.update(errors)
-        return metadata, failures
+        # Get the headers for the survey, then union with ones added during
+        # pulldown formatting
+        headers = set(x[0] for x in
+                      self._con.execute_fetchall(header_sql, [survey]))
+        headers = headers.union(next(iter(bc_responses.values())))
+        # Add external survey headers to the human survey answers, since
+        # the first chunk may not hold any barcode with external answers
+        if survey == 1 and external is not None:
+            for ext in external:
+                # get all external survey headers and format them
+                ext_headers = self._con.execute_fetchall(
+                    ext_survey_sql, [ext])
+                headers = headers.union(self._convert_header(ext, h[0])
+                                        for h in ext_headers)
+        # Remove the ebi prohibited columns
+        headers = sorted(headers.difference(ebi_remove))
+
+        spool = SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        spool.write('\t'.join(['sample_name'] + headers).encode('utf-8'))
+        return spool, headers
+
+    def _pulldown_blanks(self, blanks, headers):
+        """The human survey pulldown rows for blanks, utf-8 encoded"""
+        rows = []
+        for blank in blanks:
+            blanks_copy = copy(blanks_values)
+            blanks_copy['ANONYMIZED_NAME'] = blank
+            blanks_copy['HOST_SUBJECT_ID'] = blank
+            rows.append('\n' + '\t'.join(
+                [blank] + [blanks_copy[h] for h in headers]))
+        return ''.join(rows).encode('utf-8')
+
+    def _write_pulldown_row(self, spool, barcode, headers, answers):
+        """Writes one sample to a survey pulldown file"""
+        row = [barcode]
+        for h in headers:
+            # Take care of retired questions not having an answer
+            answer = answers.get(h, 'Unspecified')
+            # Convert everything to utf-8 unicode for standardization
+            row.append(self._unicode_convert(answer))
+        spool.write(('\n' + '\t'.join(row)).encode('utf-8'))
 
     def _unicode_convert(self, value):
         """Convert given value to unicode string"""
@@ -1387,30 +2055,58 @@ class KniminAccess(object):
         barcodes : list of str
             Barcodes attached to the kit
         """
-        barcodes = self.get_unassigned_barcodes(num_barcodes)
-        # assign barcodes to projects for the kit
-        sql = """SELECT DISTINCT project_id FROM barcodes.project_barcode
-                 JOIN ag.ag_kit_barcodes USING (barcode)
-                 WHERE ag_kit_id = %s"""
-        proj_ids = [x[0] for x in self._con.execute_fetchall(sql, [ag_kit_id])]
-        barcode_project_insert = """INSERT INTO project_barcode
-                                    (barcode, project_id)
-                                    VALUES (%s, %s)"""
-        project_inserts = []
-        for barcode in barcodes:
-            for project in proj_ids:
-                project_inserts.append((barcode, project))
-        self._con.executemany(barcode_project_insert, project_inserts)
-
-        # Add barcodes to the kit
-        sql = """INSERT  INTO ag_kit_barcodes
-                (ag_kit_id, barcode, sample_barcode_file)
-                VALUES (%s, %s, %s || '.jpg')"""
-        barcode_info = [[ag_kit_id, b, b] for b in barcodes]
-        self._con.executemany(sql, barcode_info)
-        return barcodes
+        # the new barcodes go to the projects of the kit's barcodes
+        projects_sql = """SELECT DISTINCT project_id
+                          FROM barcodes.project_barcode
+                          JOIN ag.ag_kit_barcodes USING (barcode)
+                          WHERE ag_kit_id = %(ag_kit_id)s"""
+        return self._allocate_barcodes(num_barcodes, projects_sql,
+                                       {'ag_kit_id': ag_kit_id},
+                                       ag_kit_id=ag_kit_id)
+
+    def _hash_passwords(self, passwords, progress=None):
+        """Hashes new passwords, each with its own salt
+
+        Parameters
+        ----------
+        passwords : list of str
+            Plaintext passwords
+        progress : callable, optional
+            Called as progress(hashed, total) as passwords are hashed
+
+        Returns
+        -------
+        list of str
+            Hashed passwords, in the order given
 
-    def create_ag_kits(self, swabs_kits, tag=None, projects=None):
+        Notes
+        -----
+        bcrypt is slow on purpose, so with `config.hash_workers` above one
+        the passwords are hashed in that many threads. bcrypt releases the
+        GIL while hashing, and unlike worker processes threads are safe to
+        start from the background job threads this runs in.
+        """
+        total = len(passwords)
+        workers = min(self.config.hash_workers, total)
+        hashed = []
+        if workers <= 1:
+            outputs = (self._hash_password(p) for p in passwords)
+            executor = None
+        else:
+            executor = ThreadPoolExecutor(workers)
+            outputs = executor.map(self._hash_password, passwords)
+        try:
+            for output in outputs:
+                hashed.append(output)
+                if progress is not None:
+                    progress(len(hashed), total)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return hashed
+
+    def create_ag_kits(self, swabs_kits, tag=None, projects=None,
+                       progress=None):
         """ Creates american gut handout kits on the database
 
         Parameters
@@ -1422,59 +2118,129 @@ class KniminAccess(object):
             Tag to add to kit IDs. Default None
         projects : list of str, optional
             Subprojects to attach to, if given. Default None.
+        progress : callable, optional
+            Called as progress(kits done, total kits) as the kits are made,
+            e.g. by a `JobTracker` job
 
         Returns
         -------
         list of namedtuples
             The new kit information, in the form
             [(kit_id, password, verification_code, (barcode, barcode,...)),...]
-        """
-        # make sure we have enough barcodes
-        total_swabs = sum(s * k for s, k in swabs_kits)
-        barcodes = self.get_unassigned_barcodes(total_swabs)
 
+        Notes
+        -----
+        Passwords are hashed with `_hash_passwords`, and the kits and their
+        barcodes inserted with `_insert_ag_kits`.
+        """
         # Assign barcodes to AG and any other subprojects
+        total_swabs = sum(s * k for s, k in swabs_kits)
         if projects is None:
             projects = ["American Gut Project"]
         else:
             if "American Gut Project" not in projects:
                 projects.append("American Gut Project")
-        self.assign_barcodes(total_swabs, projects)
+        barcodes = self.assign_barcodes(total_swabs, projects)
 
-        kits = []
-        kit_barcode_inserts = []
-        kit_inserts = []
-        start = 0
         KitTuple = namedtuple('AGKit', ['kit_id', 'password',
                               'verification_code', 'barcodes'])
-        # build the kits information and the sql insert information
+        # build the kits information, the kit IDs are reserved on insert
+        passwords = []
+        verification_codes = []
+        kit_barcodes = []
+        start = 0
         for num_swabs, num_kits in swabs_kits:
-            kit_ids = make_valid_kit_ids(num_kits, self.get_used_kit_ids(),
-                                         tag=tag)
             for i in range(num_kits):
-                ver_code = make_verification_code()
-                password = make_passwd()
-                kit_bcs = tuple(barcodes[start:start + num_swabs])
+                passwords.append(make_passwd())
+                verification_codes.append(make_verification_code())
+                kit_barcodes.append(tuple(barcodes[start:start + num_swabs]))
                 start += num_swabs
-                kits.append(KitTuple(kit_ids[i], password, ver_code, kit_bcs))
-                kit_inserts.append((kit_ids[i],
-                                    self._hash_password(password),
-                                    ver_code, num_swabs))
-                for barcode in kit_bcs:
-                    kit_barcode_inserts.append((kit_ids[i], barcode, barcode))
-
-        # Insert kits, followed by barcodes attached to the kits
-        kit_sql = """INSERT INTO ag_handout_kits
-                     (kit_id, password, verification_code, swabs_per_kit)
-                     VALUES (%s, %s, %s, %s)"""
-        kit_barcode_sql = """INSERT INTO ag_handout_barcodes
-                             (kit_id, barcode, sample_barcode_file)
-                             VALUES(%s, %s, %s || '.jpg')"""
-
-        self._con.executemany(kit_sql, kit_inserts)
-        self._con.executemany(kit_barcode_sql, kit_barcode_inserts)
+        hashed = self._hash_passwords(passwords, progress)
 
-        return kits
+        kit_ids = self._insert_ag_kits(hashed, verification_codes,
+                                       kit_barcodes, tag)
+        self._dashboard.invalidate('ag_stats')
+        return [KitTuple(*kit) for kit in zip(kit_ids, passwords,
+                                              verification_codes,
+                                              kit_barcodes)]
+
+    def _insert_ag_kits(self, hashed, verification_codes, kit_barcodes,
+                        tag=None, max_tries=10):
+        """Inserts handout kits under new random kit IDs
+
+        Parameters
+        ----------
+        hashed : list of str
+            Hashed kit passwords
+        verification_codes : list of str
+            Kit verification codes
+        kit_barcodes : list of tuple of str
+            Barcodes of each kit
+        tag : str, optional
+            Tag to add to kit IDs. Default None
+        max_tries : int, optional
+            Rounds in a row that may insert no kit before giving up.
+            Default 10
+
+        Returns
+        -------
+        list of str
+            The kit IDs, in the order given
+
+        Raises
+        ------
+        ValueError
+            No unused kit IDs were found in `max_tries` rounds
+
+        Notes
+        -----
+        Random kit IDs are drawn for the kits and inserted with ON CONFLICT
+        DO NOTHING, so the unique kit ID reserves it even against another
+        admin creating kits at the same time. The kits whose ID was taken
+        draw again, which is O(k) work for k kits as long as the ID space
+        is far from full, instead of loading all used kit IDs. ON CONFLICT
+        needs PostgreSQL 9.5, and the unique index on kit_id made by
+        knimin/db/patches/0001_handout_kit_id_unique.sql.
+        """
+        sql = """WITH kits AS (
+                    INSERT INTO ag_handout_kits
+                        (kit_id, password, verification_code, swabs_per_kit)
+                    SELECT * FROM unnest(%s::varchar[], %s::varchar[],
+                                         %s::varchar[], %s::integer[])
+                        AS k(kit_id)
+                    WHERE NOT EXISTS (SELECT 1 FROM ag_kit
+                                      WHERE supplied_kit_id = k.kit_id)
+                    ON CONFLICT (kit_id) DO NOTHING
+                    RETURNING kit_id),
+                 barcodes AS (
+                    INSERT INTO ag_handout_barcodes
+                        (kit_id, barcode, sample_barcode_file)
+                    SELECT kit_id, barcode, barcode || '.jpg'
+                    FROM unnest(%s::varchar[], %s::varchar[])
+                        AS b(kit_id, barcode)
+                    JOIN kits USING (kit_id))
+                 SELECT kit_id FROM kits"""
+        kit_ids = [None] * len(hashed)
+        pending = list(range(len(hashed)))
+        tries = 0
+        while pending:
+            if tries == max_tries:
+                raise ValueError("Could not find unused kit IDs for %d kits"
+                                 % len(pending))
+            candidates = make_valid_kit_ids(len(pending), set(), tag=tag)
+            inserted = set(i[0] for i in self._con.execute_fetchall(sql, [
+                candidates, [hashed[i] for i in pending],
+                [verification_codes[i] for i in pending],
+                [len(kit_barcodes[i]) for i in pending],
+                [kit_id for kit_id, i in zip(candidates, pending)
+                 for _ in kit_barcodes[i]],
+                [barcode for i in pending for barcode in kit_barcodes[i]]]))
+            for kit_id, i in zip(candidates, pending):
+                if kit_id in inserted:
+                    kit_ids[i] = kit_id
+            pending = [i for i in pending if kit_ids[i] is None]
+            tries = 0 if inserted else tries + 1
+        return kit_ids
 
     def get_used_kit_ids(self):
         """Grab in use kit IDs, return set of them
@@ -1483,7 +2249,7 @@ class KniminAccess(object):
                  UNION
                  SELECT kit_id from ag_handout_kits"""
 
-        return set(i[0] for i in self._con.execute_fetchall(sql))
+        return set(i[0] for i in self._con.execute_iter(sql, tuples=True))
 
     def create_project(self, name):
         if name.strip() == '':
@@ -1496,6 +2262,7 @@ class KniminAccess(object):
         sql = """INSERT INTO project (project_id, project)
                  SELECT max(project_id)+1, %s FROM project"""
         self._con.execute(sql, [name])
+        self._dashboard.invalidate('project_summary')
 
     def get_unassigned_barcodes(self, n=None):
         """Returns unassigned barcodes
@@ -1517,17 +2284,21 @@ class KniminAccess(object):
 
         Notes
         -----
-        Barcodes are returned in ascending order
+        Barcodes are returned in ascending order. Unassigned barcodes are in
+        no project and have no assigned date. `_allocate_barcodes` stamps the
+        assigned date as it takes barcodes, so barcodes it is taking are no
+        longer counted here even before their projects are visible.
         """
         sql_args = None
         sql = """SELECT DISTINCT barcode FROM barcodes.barcode
                  LEFT JOIN barcodes.project_barcode pb USING (barcode)
-                 WHERE pb.barcode IS NULL
+                 WHERE pb.barcode IS NULL AND assigned_on IS NULL
                  ORDER BY barcode ASC"""
         if n is not None:
             sql += " LIMIT %s"
             sql_args = [n]
-        barcodes = [x[0] for x in self._con.execute_fetchall(sql, sql_args)]
+        barcodes = [x[0] for x in
+                    self._con.execute_iter(sql, sql_args, tuples=True)]
         if len(barcodes) < n:
             raise ValueError("Not enough barcodes! %d asked for, %d remaining"
                              % (n, len(barcodes)))
@@ -1561,27 +2332,108 @@ class KniminAccess(object):
             raise ValueError("Project(s) given don't exist in database: %s"
                              % ', '.join(not_exist))
 
-        # Get unassigned barcode list and make sure we have enough barcodes
-        barcodes = self.get_unassigned_barcodes(num_barcodes)
-
-        # Assign barcodes to the project(s)
-        sql = "SELECT project_id from project WHERE project in %s"
-        proj_ids = [x[0] for x in
-                    self._con.execute_fetchall(sql, [tuple(projects)])]
-
-        barcode_project_insert = """INSERT INTO project_barcode
-                                    (barcode, project_id)
-                                    VALUES (%s, %s)"""
-        project_inserts = []
-        for barcode in barcodes:
-            for project in proj_ids:
-                project_inserts.append((barcode, project))
-        self._con.executemany(barcode_project_insert, project_inserts)
-        # Set assign date for the barcodes
-        sql = """UPDATE barcodes.barcode
-                 SET assigned_on = NOW() WHERE barcode IN %s"""
-        self._con.execute(sql, [tuple(barcodes)])
-        return barcodes
+        projects_sql = """SELECT project_id FROM barcodes.project
+                          WHERE project IN %(projects)s"""
+        return self._allocate_barcodes(num_barcodes, projects_sql,
+                                       {'projects': tuple(projects)})
+
+    def _allocate_barcodes(self, num_barcodes, projects_sql, sql_args,
+                           ag_kit_id=None, max_tries=10):
+        """Takes unassigned barcodes and assigns them to projects
+
+        Parameters
+        ----------
+        num_barcodes : int
+            Number of barcodes to assign
+        projects_sql : str
+            Query of the project IDs to assign the barcodes to, with named
+            arguments
+        sql_args : dict
+            Arguments of `projects_sql`
+        ag_kit_id : str, optional
+            Kit to also attach the barcodes to. Default None
+        max_tries : int, optional
+            Times to try while enough barcodes are unassigned but locked by
+            concurrent allocations. Default 10
+
+        Returns
+        -------
+        list of str
+            The barcodes assigned, in ascending order
+
+        Raises
+        ------
+        ValueError
+            num_barcodes is not positive
+            Not enough unassigned barcodes for num_barcodes
+            Concurrent allocations held the barcodes for all `max_tries`
+
+        Notes
+        -----
+        The barcodes are taken, stamped and linked to the projects and kit
+        in one statement. Rows locked by a concurrent allocation are
+        skipped rather than waited for (FOR UPDATE SKIP LOCKED, PostgreSQL
+        9.5 or later), so two allocations never hand out the same barcode.
+        Nothing is assigned unless all the barcodes asked for are free.
+
+        Skipped rows can leave too few barcodes for this allocation while
+        enough are unassigned, e.g. while a concurrent allocation that
+        will fail holds them. The allocation is then tried again once the
+        other has had time to finish, so it only fails for lack of barcodes.
+        """
+        if num_barcodes < 1:
+            raise ValueError("Number of barcodes must be positive, %d given"
+                             % num_barcodes)
+        kit_sql = ''
+        if ag_kit_id is not None:
+            kit_sql = """,
+                 kit_links AS (
+                    INSERT INTO ag.ag_kit_barcodes
+                        (ag_kit_id, barcode, sample_barcode_file)
+                    SELECT %(ag_kit_id)s, barcode, barcode || '.jpg'
+                    FROM assigned)"""
+        # assigned_on is checked on the locked row itself, since a barcode
+        # assigned after this statement started still looks free in
+        # project_barcode
+        sql = """WITH free AS (
+                    SELECT barcode FROM barcodes.barcode b
+                    WHERE assigned_on IS NULL
+                        AND NOT EXISTS (
+                            SELECT 1 FROM barcodes.project_barcode pb
+                            WHERE pb.barcode = b.barcode)
+                    ORDER BY barcode ASC
+                    LIMIT %(num_barcodes)s
+                    FOR UPDATE SKIP LOCKED),
+                 enough AS (
+                    SELECT barcode FROM free
+                    WHERE (SELECT count(*) FROM free) = %(num_barcodes)s),
+                 assigned AS (
+                    UPDATE barcodes.barcode b SET assigned_on = NOW()
+                    FROM enough WHERE b.barcode = enough.barcode
+                    RETURNING b.barcode),
+                 projects AS ({0}),
+                 project_links AS (
+                    INSERT INTO barcodes.project_barcode (barcode, project_id)
+                    SELECT barcode, project_id FROM assigned, projects){1}
+                 SELECT barcode FROM assigned ORDER BY barcode""".format(
+            projects_sql, kit_sql)
+        sql_args = dict(sql_args, num_barcodes=num_barcodes,
+                        ag_kit_id=ag_kit_id)
+        for tries in range(1, max_tries + 1):
+            barcodes = [x[0] for x in
+                        self._con.execute_fetchall(sql, sql_args)]
+            if barcodes:
+                self._dashboard.invalidate('project_summary')
+                return barcodes
+            remaining = len(self.get_unassigned_barcodes())
+            if remaining < num_barcodes:
+                raise ValueError("Not enough barcodes! %d asked for, %d "
+                                 "remaining" % (num_barcodes, remaining))
+            # the barcodes are held by concurrent allocations
+            sleep(0.05 * tries)
+        raise ValueError("Could not allocate %d barcodes, the %d remaining "
+                         "are held by other allocations"
+                         % (num_barcodes, remaining))
 
     def create_barcodes(self, num_barcodes):
         """Creates new barcodes
@@ -1640,6 +2492,46 @@ class KniminAccess(object):
             sql_args.append(limit)
         return self._con.execute_fetchall(select_sql, sql_args)
 
+    def project_summary(self):
+        """Barcode counts of every project
+
+        Returns
+        -------
+        list of dict
+            For each project, by name, its `project` name and its number of
+            `barcodes`, and of those `received`, `consented` (associated
+            with a survey), `sequenced` (on a sequencing plate) and with
+            `results_ready`. Kept in memory, callers must not modify them
+
+        Notes
+        -----
+        Refreshed in the background every few minutes, and right away when
+        barcodes are assigned to projects through labadmin.
+        """
+        return self._dashboard.get('project_summary')
+
+    def _load_project_summary(self):
+        """Project barcode counts, cached as 'project_summary'"""
+        sql = """SELECT project,
+                    count(DISTINCT barcode) AS barcodes,
+                    count(DISTINCT barcode) FILTER (
+                        WHERE b.scan_date IS NOT NULL) AS received,
+                    count(DISTINCT barcode) FILTER (
+                        WHERE akb.survey_id IS NOT NULL) AS consented,
+                    count(DISTINCT barcode) FILTER (
+                        WHERE pl.barcode IS NOT NULL) AS sequenced,
+                    count(DISTINCT barcode) FILTER (
+                        WHERE akb.results_ready = 'Y') AS results_ready
+                 FROM barcodes.project
+                 LEFT JOIN barcodes.project_barcode USING (project_id)
+                 LEFT JOIN barcodes.barcode b USING (barcode)
+                 LEFT JOIN ag.ag_kit_barcodes akb USING (barcode)
+                 LEFT JOIN (SELECT DISTINCT barcode FROM plate_barcode) pl
+                    USING (barcode)
+                 GROUP BY project
+                 ORDER BY project"""
+        return self._con.execute_fetchdict(sql)
+
     def add_external_survey(self, survey, description, url):
         """Adds a new external survey to the database
 
@@ -1852,18 +2744,14 @@ class KniminAccess(object):
                                 barcode])
 
     def AGGetBarcodeMetadata(self, barcode):
-        results = self._con.execute_proc_return_cursor(
+        rows = self._con.execute_proc_fetchall(
             'ag_get_barcode_metadata', [barcode])
-        rows = results.fetchall()
-        results.close()
 
         return [dict(row) for row in rows]
 
     def AGGetBarcodeMetadataAnimal(self, barcode):
-        results = self._con.execute_proc_return_cursor(
+        rows = self._con.execute_proc_fetchall(
             'ag_get_barcode_md_animal', [barcode])
-        rows = results.fetchall()
-        results.close()
 
         return [dict(row) for row in rows]
 
@@ -1889,13 +2777,29 @@ class KniminAccess(object):
         If the tuple contains nothing but the zipcode and None for all other
         fields, no geocode was found. Zipcode/country combination added as
         'cannot_geocode'
+
+        If a gazetteer is configured, the zipcode is looked up in it without
+        calling the geocoding API, and only has an elevation if an elevation
+        model is configured too.
         """
         # Catch sending None or empty string for these
         if not zipcode or not country:
             return Location(zipcode, None, None, None,
                             None, None, None, country)
 
-        info = geocode('%s %s' % (zipcode, country))
+        gazetteer = self._get_gazetteer()
+        if gazetteer is not None:
+            # offline, zipcodes not in the gazetteer are not geocoded
+            info = gazetteer.lookup(zipcode, country)
+            if info is None:
+                info = Location(zipcode, None, None, None,
+                                None, None, None, country)
+            elif self._elevation is not None:
+                info = info._replace(elev=self._elevation.elevation(
+                    info.lat, info.long))
+        else:
+            info = geocode('%s %s' % (zipcode, country), self._geocode_cache,
+                           self._elevation)
         cannot_geocode = False
         # Clean the zipcode so it is same case and setup, since international
         # people can enter lowercased zipcodes or missing spaces, and google
@@ -1904,9 +2808,11 @@ class KniminAccess(object):
         clean_zipcode = str(zipcode).lower().replace(' ', '').split('-')[0]
         if not info.lat:
             cannot_geocode = True
-        # Use startswith because UK zipcodes can be 2, 3, or 6 characters
-        elif (info.country != country or
-              not clean_postcode.startswith(clean_zipcode)):
+        # Use startswith because UK zipcodes can be 2, 3, or 6 characters,
+        # and the gazetteer gives back the outward code of full UK ones
+        elif (info.country != country or not (
+                clean_postcode.startswith(clean_zipcode) or
+                clean_zipcode.startswith(clean_postcode))):
             # countries and zipcodes dont match, so blank out info
             info = Location(zipcode, None, None, None,
                             None, None, None, country)
@@ -1918,6 +2824,8 @@ class KniminAccess(object):
         self._con.execute(sql, [zipcode, info.lat, info.long, info.elev,
                                 info.city, info.state, country,
                                 cannot_geocode])
+        self._refs.invalidate('zipcodes')
+        self._refs.invalidate('zipcodes_full')
         return info
 
     def addGeocodingInfo(self, limit=None, retry=False):
@@ -1930,6 +2838,13 @@ class KniminAccess(object):
         is set to 'y' in the ag_login table, and it will not be tried again
         on subsequent calls to this function.  Pass retry=True to retry all
         (or maximum of limit) previously failed geocodings.
+
+        Logins are geocoded concurrently within the API quota, using the
+        geocoding settings of the configuration, and written back at once.
+        Logins with the same address share one lookup, and addresses in the
+        geocoding cache, including ones not found until their entry expires,
+        are not looked up again. If the API limit is exceeded, logins not
+        geocoded by then are left for the next call.
         """
 
         # clear previous geocoding attempts if retry is True
@@ -1943,114 +2858,163 @@ class KniminAccess(object):
                         SELECT ag_login_id FROM ag_login
                         WHERE cannot_geocode = 'y')"""
             self._con.execute(sql)
+            self._dashboard.invalidate('geocode_stats')
 
         # get logins that have not been geocoded yet
         sql = """SELECT city, state, zip, country,
                         cast(ag_login_id as varchar(100))
                  FROM ag_login
                  WHERE elevation is NULL AND cannot_geocode is NULL"""
-        logins = self._con.execute_fetchall(sql)
-
-        row_counter = 0
-        sql_args = []
-        for city, state, zipcode, country, ag_login_id in logins:
-            row_counter += 1
-            if limit is not None and row_counter > limit:
-                break
-
-            # Attempt to geocode
-            address = '{0} {1} {2} {3}'.format(city, state, zipcode, country)
-            try:
-                info = geocode(address)
+        sql_args = None
+        if limit is not None:
+            sql += " LIMIT %s"
+            sql_args = [limit]
+        addresses = {
+            ag_login_id: '{0} {1} {2} {3}'.format(city, state, zipcode,
+                                                  country)
+            for city, state, zipcode, country, ag_login_id in
+            self._con.execute_iter(sql, sql_args, tuples=True)}
+
+        # each distinct address is geocoded once, stopping early if the API
+        # limit is exceeded
+        geocoder = BatchGeocoder(
+            self.config.geocoding_url, self.config.geocoding_rate,
+            self.config.geocoding_workers,
+            self.config.geocoding_elevation_batch, self._geocode_cache,
+            self._elevation)
+        try:
+            locations = geocoder.geocode(addresses.values())
+        finally:
+            geocoder.close()
+
+        ids, lats, longs, elevs, cannot = [], [], [], [], []
+        for ag_login_id, address in viewitems(addresses):
+            if address not in locations:
+                # not geocoded, left for the next call
+                continue
+            info = locations[address]
+            ids.append(ag_login_id)
+            if info is None:
+                # geocoding failed, set to could not geocode
+                lats.append(None)
+                longs.append(None)
+                elevs.append(None)
+                cannot.append('y')
+            else:
                 # empty string to indicate geocode was successful
-                sql_args.append([info.lat, info.long, info.elev,
-                                 '', ag_login_id])
-            except GoogleAPILimitExceeded:
-                # limit exceeded so no use trying to keep geocoding
-                break
-            except:
-                # Catch ANY other error and set to could not geocode
-                sql_args.append([None, None, None, 'y', ag_login_id])
+                lats.append(info.lat)
+                longs.append(info.long)
+                elevs.append(info.elev)
+                cannot.append('')
+        if not ids:
+            return
 
-        sql = """UPDATE  ag_login
-                 SET latitude = %s,
-                     longitude = %s,
-                     elevation = %s,
-                 cannot_geocode = %s
-                 WHERE ag_login_id = %s"""
-        self._con.executemany(sql, sql_args)
+        # all logins updated in one statement
+        sql = """UPDATE ag_login
+                 SET latitude = v.latitude,
+                     longitude = v.longitude,
+                     elevation = v.elevation,
+                     cannot_geocode = v.cannot_geocode
+                 FROM unnest(%s::varchar[], %s::float8[], %s::float8[],
+                             %s::float8[], %s::varchar[])
+                    AS v(ag_login_id, latitude, longitude, elevation,
+                         cannot_geocode)
+                 WHERE cast(ag_login.ag_login_id as varchar(100)) =
+                    v.ag_login_id"""
+        self._con.execute(sql, [ids, lats, longs, elevs, cannot])
+        self._dashboard.invalidate('geocode_stats')
 
     def getGeocodeStats(self):
-        stat_queries = [
-            ("Total Rows",
-             "select count(*) from ag_login"),
-            ("Cannot Geocode",
-             "select count(*) from ag_login where cannot_geocode = 'y'"),
-            ("Null Latitude Field",
-             "select count(*) from ag_login where latitude is null"),
-            ("Null Elevation Field",
-             "select count(*) from ag_login where elevation is null")
-        ]
-        results = []
-        for name, sql in stat_queries:
-            total = self._con.execute_fetchone(sql)[0]
-            results.append((name, total))
-        return results
+        """Counts of logins geocoded or not
+
+        Returns
+        -------
+        list of tuple
+            (statistic, count), kept in memory and refreshed in the
+            background every few minutes
+        """
+        return self._dashboard.get('geocode_stats')
+
+    def _load_geocode_stats(self):
+        """Geocoding statistics, cached as 'geocode_stats'"""
+        sql = """SELECT count(*),
+                        count(*) FILTER (WHERE cannot_geocode = 'y'),
+                        count(*) FILTER (WHERE latitude IS NULL),
+                        count(*) FILTER (WHERE elevation IS NULL)
+                 FROM ag_login"""
+        counts = self._con.execute_fetchone(sql)
+        return list(zip(["Total Rows", "Cannot Geocode",
+                         "Null Latitude Field", "Null Elevation Field"],
+                        counts))
 
     def getAGStats(self):
-        # returned tuple consists of:
-        # site_sampled, sample_date, sample_time, participant_name,
-        # environment_sampled, notes
-        stats_list = [
-            ('Total handout kits',
-             'SELECT count(*) FROM ag.ag_handout_kits'),
-            ('Total handout barcodes',
-             'SELECT count(*) FROM ag.ag_handout_barcodes'),
-            ('Total consented participants',
-             'SELECT count(*) FROM ag.ag_consent'),
-            ('Total registered kits',
-             'SELECT count(*) FROM ag.ag_kit'),
-            ('Total registered barcodes',
-             'SELECT count(*) FROM ag.ag_kit_barcodes'),
-            ('Total barcodes with results',
-             """SELECT count(*) FROM ag.ag_kit_barcodes
-             WHERE results_ready='Y'"""),
-            ('Average age of participants',
-             """SELECT AVG(AGE((yr.response || '-' ||
-                CASE mo.response
-                    WHEN 'January' THEN '1'
-                    WHEN 'February' THEN '2'
-                    WHEN 'March' THEN '3'
-                    WHEN 'April' THEN '4'
-                    WHEN 'May' THEN '5'
-                    WHEN 'June' THEN '6'
-                    WHEN 'July' THEN '7'
-                    WHEN 'August' THEN '8'
-                    WHEN 'September' THEN '9'
-                    WHEN 'October' THEN '10'
-                    WHEN 'November' THEN '11'
-                    WHEN 'December' THEN '12'
-                  END || '-1')::date
-                )) FROM
-              (SELECT response, survey_id
-               FROM ag.survey_answers
-               WHERE survey_question_id = 112) AS yr
-              JOIN
-              (SELECT response, survey_id
-               FROM ag.survey_answers
-               WHERE survey_question_id = 111) AS mo USING (survey_id)
-               WHERE yr.response != 'Unspecified'
-               AND mo.response != 'Unspecified'"""),
-            ('Total male participants',
-             """SELECT count(*) FROM ag.survey_answers
-                WHERE survey_question_id=107 AND response='Male'"""),
-            ('Total female participants',
-             """SELECT count(*) FROM ag.survey_answers
-                WHERE survey_question_id=107 AND response='Female'""")
-            ]
+        """Counts of kits, barcodes and participants for the stats page
+
+        Returns
+        -------
+        list of tuple
+            (statistic, value), kept in memory and refreshed in the
+            background every few minutes
+        """
+        return self._dashboard.get('ag_stats')
+
+    def _load_ag_stats(self):
+        """American Gut statistics, cached as 'ag_stats'
+
+        Notes
+        -----
+        All statistics come from one query, reading the survey answers
+        needed once.
+        """
+        sql = """WITH answers AS (
+                    SELECT survey_id, survey_question_id, response
+                    FROM ag.survey_answers
+                    WHERE survey_question_id IN (107, 111, 112)),
+                 births AS (
+                    SELECT yr.response AS year, mo.response AS month
+                    FROM answers yr
+                    JOIN answers mo USING (survey_id)
+                    WHERE yr.survey_question_id = 112
+                        AND mo.survey_question_id = 111
+                        AND yr.response != 'Unspecified'
+                        AND mo.response != 'Unspecified')
+                 SELECT (SELECT count(*) FROM ag.ag_handout_kits),
+                        (SELECT count(*) FROM ag.ag_handout_barcodes),
+                        (SELECT count(*) FROM ag.ag_consent),
+                        (SELECT count(*) FROM ag.ag_kit),
+                        kb.total, kb.results,
+                        (SELECT AVG(AGE((year || '-' ||
+                            CASE month
+                                WHEN 'January' THEN '1'
+                                WHEN 'February' THEN '2'
+                                WHEN 'March' THEN '3'
+                                WHEN 'April' THEN '4'
+                                WHEN 'May' THEN '5'
+                                WHEN 'June' THEN '6'
+                                WHEN 'July' THEN '7'
+                                WHEN 'August' THEN '8'
+                                WHEN 'September' THEN '9'
+                                WHEN 'October' THEN '10'
+                                WHEN 'November' THEN '11'
+                                WHEN 'December' THEN '12'
+                            END || '-1')::date)) FROM births),
+                        (SELECT count(*) FROM answers
+                         WHERE survey_question_id = 107
+                            AND response = 'Male'),
+                        (SELECT count(*) FROM answers
+                         WHERE survey_question_id = 107
+                            AND response = 'Female')
+                 FROM (SELECT count(*) AS total,
+                              count(*) FILTER (WHERE results_ready = 'Y')
+                                AS results
+                       FROM ag.ag_kit_barcodes) AS kb"""
+        labels = ['Total handout kits', 'Total handout barcodes',
+                  'Total consented participants', 'Total registered kits',
+                  'Total registered barcodes', 'Total barcodes with results',
+                  'Average age of participants', 'Total male participants',
+                  'Total female participants']
         stats = []
-        for label, sql in stats_list:
-            res = self._con.execute_fetchone(sql)[0]
+        for label, res in zip(labels, self._con.execute_fetchone(sql)):
             if type(res) == timedelta:
                 res = str(res.days/365) + " years"
             stats.append((label, res))
@@ -2098,6 +3062,90 @@ class KniminAccess(object):
         res = self._con.execute_fetchone(sql, [barcode])
         return res[0] if res else None
 
+    def search(self, term, limit=50):
+        """Searches logins, kits, barcodes and handout kits at once
+
+        Parameters
+        ----------
+        term : str
+            Text to search for
+        limit : int or None, optional
+            Maximum number of matches to return, None for all. Default 50
+
+        Returns
+        -------
+        list of dict
+            The matches, best first, each with its `type`, one of login,
+            kit, barcode or handout, its `id`, the `ag_login_id` it belongs
+            to, None for handout kits, and its `rank`, from 0 to 1
+
+        Notes
+        -----
+        Matches the same columns as search_participant_info, search_kits,
+        search_barcodes and search_handout_kits, ranked by the trigram
+        similarity of the best matching column to the term. Needs the
+        pg_trgm extension and the search indexes, created by
+        knimin/db/patches/0002_search_indexes.sql. Barcode matches on the
+        name of a participant without samples have no `id`.
+        """
+        sql = """SELECT type, id, ag_login_id, rank FROM (
+                    SELECT 'login' AS type,
+                        cast(ag_login_id as varchar(100)) AS id,
+                        cast(ag_login_id as varchar(100)) AS ag_login_id,
+                        greatest(similarity(lower(email), %(term)s),
+                                 similarity(lower(name), %(term)s),
+                                 similarity(lower(address), %(term)s))
+                            AS rank
+                    FROM ag.ag_login
+                    WHERE lower(email) LIKE %(liketerm)s
+                        OR lower(name) LIKE %(liketerm)s
+                        OR lower(address) LIKE %(liketerm)s
+                    UNION ALL
+                    SELECT 'kit', supplied_kit_id,
+                        cast(ag_login_id as varchar(100)),
+                        CASE WHEN lower(kit_verification_code) = %(term)s
+                            THEN 1
+                            ELSE greatest(
+                                similarity(lower(supplied_kit_id), %(term)s),
+                                similarity(lower(kit_password), %(term)s),
+                                similarity(cast(ag_kit_id as varchar(100)),
+                                           %(term)s))
+                        END
+                    FROM ag.ag_kit
+                    WHERE lower(supplied_kit_id) LIKE %(liketerm)s
+                        OR lower(kit_password) LIKE %(liketerm)s
+                        OR lower(kit_verification_code) = %(term)s
+                        OR cast(ag_kit_id as varchar(100)) LIKE %(liketerm)s
+                    UNION ALL
+                    SELECT DISTINCT 'barcode', barcode,
+                        cast(ag_login_id as varchar(100)),
+                        greatest(similarity(barcode, %(term)s),
+                                 similarity(lower(participant_name),
+                                            %(term)s),
+                                 similarity(lower(notes), %(term)s))
+                    FROM ag.ag_kit
+                    INNER JOIN ag.ag_kit_barcodes USING (ag_kit_id)
+                    FULL OUTER JOIN ag.ag_login_surveys
+                        USING (survey_id, ag_login_id)
+                    WHERE barcode LIKE %(liketerm)s
+                        OR lower(participant_name) LIKE %(liketerm)s
+                        OR lower(notes) LIKE %(liketerm)s
+                    UNION ALL
+                    SELECT 'handout', kit_id, NULL,
+                        max(greatest(similarity(kit_id, %(case_term)s),
+                                     similarity(barcode, %(case_term)s)))
+                    FROM ag.ag_handout_kits
+                    JOIN ag.ag_handout_barcodes USING (kit_id)
+                    WHERE kit_id LIKE %(case_liketerm)s
+                        OR barcode LIKE %(case_liketerm)s
+                    GROUP BY kit_id) AS matches
+                 ORDER BY rank DESC, type, id
+                 LIMIT %(limit)s"""
+        return self._con.execute_fetchdict(sql, {
+            'term': term.lower(), 'liketerm': '%' + term.lower() + '%',
+            'case_term': term, 'case_liketerm': '%' + term + '%',
+            'limit': limit})
+
     def search_participant_info(self, term):
         sql = """SELECT cast(ag_login_id as varchar(100)) as ag_login_id
                  FROM ag_login al
@@ -2210,6 +3258,138 @@ class KniminAccess(object):
                    self._con.execute_fetchall(sql, [ag_kit_id])]
         return results
 
+    def load_search_results(self, ag_login_ids):
+        """Loads everything the AG search shows for logins
+
+        Parameters
+        ----------
+        ag_login_ids : list of str
+            Logins to load
+
+        Returns
+        -------
+        list of dict
+            For each login, in the order given, its `login_info`, the names
+            of its `humans` and `animals` and its kits under `kit`. Each kit
+            has its barcodes under `barcode_info`, as {barcode: {'ag_info':
+            ..., 'barcode_info': ..., 'plate': [...]}, ...}
+
+        Notes
+        -----
+        Each part is loaded for all the logins in one query, instead of
+        calling get_login_info, getHumanParticipants and the others per
+        login, kit and barcode.
+        """
+        if not ag_login_ids:
+            return []
+        args = [tuple(ag_login_ids)]
+        results = {login: {'login_info': [], 'humans': [], 'animals': [],
+                           'kit': []}
+                   for login in ag_login_ids}
+
+        self._load_search_logins(results, args)
+        kits = self._load_search_kits(results, args)
+        barcodes = self._load_search_barcodes(kits, args)
+        self._load_search_barcode_details(barcodes, args)
+        return [results[login] for login in ag_login_ids]
+
+    def _load_search_logins(self, results, args):
+        """Adds the login info and participant names to search results"""
+        sql = """SELECT cast(ag_login_id as varchar(100)) as login,
+                        ag_login_id, email, name, address, city, state, zip,
+                        country
+                 FROM ag_login
+                 WHERE ag_login_id IN %s"""
+        for row in self._con.execute_fetchdict(sql, args):
+            results[row.pop('login')]['login_info'].append(row)
+
+        sql = """SELECT DISTINCT
+                    cast(ag_login_id as varchar(100)) as ag_login_id,
+                    ags.survey_id, participant_name
+                 FROM ag.ag_login_surveys
+                 JOIN ag.survey_answers USING (survey_id)
+                 JOIN ag.group_questions gq USING (survey_question_id)
+                 JOIN ag.surveys ags USING (survey_group)
+                 WHERE ag_login_id IN %s AND ags.survey_id IN (1, 2)
+                 ORDER BY participant_name"""
+        participants = {1: 'humans', 2: 'animals'}
+        for login, survey_id, name in self._con.execute_fetchall(sql, args):
+            results[login][participants[survey_id]].append(name)
+
+    def _load_search_kits(self, results, args):
+        """Adds the kits to search results
+
+        Returns
+        -------
+        dict
+            The kits added, keyed by kit ID
+        """
+        sql = """SELECT cast(ag_kit_id as varchar(100)) as ag_kit_id,
+                        cast(ag_login_id as varchar(100)) as ag_login_id,
+                        supplied_kit_id, kit_password, swabs_per_kit,
+                        kit_verification_code, kit_verified
+                 FROM ag_kit
+                 WHERE ag_login_id IN %s"""
+        kits = {}
+        for kit in self._con.execute_fetchdict(sql, args):
+            kit['barcode_info'] = {}
+            kits[kit['ag_kit_id']] = kit
+            results[kit['ag_login_id']]['kit'].append(kit)
+        return kits
+
+    def _load_search_barcodes(self, kits, args):
+        """Adds the barcodes to the kits of search results
+
+        Returns
+        -------
+        dict
+            The barcodes added, keyed by barcode
+        """
+        sql = """SELECT DISTINCT cast(ag_kit_barcode_id as varchar(100)) as
+                         ag_kit_barcode_id, cast(ag_kit_id as varchar(100)) as
+                         ag_kit_id, barcode, sample_date, sample_time,
+                         site_sampled, environment_sampled, participant_name,
+                         notes, results_ready, withdrawn, refunded
+                 FROM    ag_kit_barcodes
+                 FULL OUTER JOIN ag_login_surveys USING (survey_id)
+                 WHERE   ag_kit_id IN (SELECT ag_kit_id FROM ag_kit
+                                       WHERE ag_login_id IN %s)"""
+        barcodes = {}
+        for row in self._con.execute_fetchdict(sql, args):
+            # kits and barcodes added while loading are left out
+            if row['ag_kit_id'] not in kits:
+                continue
+            barcodes[row['barcode']] = {'ag_info': row, 'barcode_info': {},
+                                        'plate': []}
+            kits[row['ag_kit_id']]['barcode_info'][row['barcode']] = \
+                barcodes[row['barcode']]
+        return barcodes
+
+    def _load_search_barcode_details(self, barcodes, args):
+        """Adds the barcode info and plates to barcodes of search results"""
+        login_barcodes = """SELECT barcode FROM ag_kit_barcodes
+                            JOIN ag_kit USING (ag_kit_id)
+                            WHERE ag_login_id IN %s"""
+        sql = """SELECT barcode, create_date_time, status, scan_date,
+                        sample_postmark_date, biomass_remaining,
+                        sequencing_status, obsolete
+                 FROM barcode
+                 WHERE barcode IN ({0})""".format(login_barcodes)
+        for row in self._con.execute_fetchdict(sql, args):
+            barcode = row.pop('barcode')
+            if barcode in barcodes:
+                barcodes[barcode]['barcode_info'] = row
+
+        sql = """SELECT pb.barcode, p.plate, p.sequence_date
+                 FROM plate p
+                 INNER JOIN plate_barcode pb
+                 ON pb.plate_id = p.plate_id
+                 WHERE pb.barcode IN ({0})""".format(login_barcodes)
+        for row in self._con.execute_fetchdict(sql, args):
+            barcode = row.pop('barcode')
+            if barcode in barcodes:
+                barcodes[barcode]['plate'].append(row)
+
     def get_barcodes_with_results(self):
         """Returns list of all barcodes with results ready (PDFs available)
 
@@ -2303,8 +3483,7 @@ class KniminAccess(object):
                  FROM ag_login al
                  INNER JOIN ag_kit USING (ag_login_id)
                  ORDER BY lower(email), supplied_kit_id"""
-        rows = self._con.execute_fetchall(sql)
-        return [dict(row) for row in rows]
+        return [dict(row) for row in self._con.execute_iter(sql)]
 
     def getAnimalParticipants(self, ag_login_id):
         sql = """SELECT DISTINCT participant_name from ag.ag_login_surveys
@@ -2381,6 +3560,7 @@ class KniminAccess(object):
                        SELECT project_id
                        FROM barcodes.project WHERE project IN %s)"""
             self._con.execute(sql, [barcode, tuple(rem_projects)])
+        self._dashboard.invalidate('project_summary')
 
     def getProjectNames(self):
         """Returns a list of project names
@@ -2414,3 +3594,42 @@ class KniminAccess(object):
                  SET results_ready = NULL
                  WHERE barcode IN %s"""
         self._con.execute(sql, [tuple(barcodes)])
+
+
+# worker process state for KniminAccess.pulldown_parallel, each worker has
+# its own KniminAccess and with it its own database connections
+_pulldown_db = None
+
+
+def _read_blocks(f, block_size):
+    """Yields the blocks of a file until its end"""
+    for block in iter(lambda: f.read(block_size), b''):
+        yield block
+
+
+def _init_pulldown_worker(config):
+    global _pulldown_db
+    _pulldown_db = KniminAccess(config)
+
+
+def _pulldown_shard(args):
+    """Pulls down a shard of barcodes to a file per survey in a directory
+
+    Returns
+    -------
+    files : dict
+        {survey: file path, ...}
+    failures : dict
+        Barcodes unable to pull metadata down, in the form
+        {barcode: reason, ...}
+    """
+    barcodes, full, chunk_size, out_dir = args
+    mkdir(out_dir)
+    surveys, failures = _pulldown_db.pulldown_iter(
+        barcodes, full=full, chunk_size=chunk_size)
+    files = {}
+    for survey, blocks in surveys:
+        files[survey] = join(out_dir, 'survey_%s_md.txt' % survey)
+        with open(files[survey], 'wb') as f:
+            f.writelines(blocks)
+    return files, failures
@@ -0,0 +1,105 @@
+"""Offline elevations from a digital elevation model
+
+Elevation providers have an `elevation(lat, long)` method returning the
+elevation in meters, or None if it is not known. `geocode` and
+`BatchGeocoder` look elevations up with a provider if given one, instead of
+calling the elevation API.
+"""
+from math import floor
+from os.path import exists, getsize, join
+from threading import Lock
+
+import numpy as np
+
+# samples without data in SRTM tiles
+VOID = -32768
+
+
+def hgt_name(lat, long):
+    """Name of the SRTM .hgt tile covering a point, e.g. N32W118.hgt"""
+    lat = int(floor(lat))
+    long = int(floor(long))
+    return '%s%02d%s%03d.hgt' % ('S' if lat < 0 else 'N', abs(lat),
+                                 'W' if long < 0 else 'E', abs(long))
+
+
+class HGTElevation(object):
+    """Elevations interpolated from SRTM .hgt tiles
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the tiles, named as `hgt_name`
+
+    Notes
+    -----
+    A tile covers one degree square with big endian 16 bit samples in rows
+    from north to south, sharing its edges with the tiles around it. Tiles
+    of 1201 (3 arc-second) and 3601 (1 arc-second) samples a side are both
+    read. Tiles are memory mapped the first time a point in them is looked
+    up, so only the pages around the points asked for are read from disk.
+
+    The elevation is interpolated bilinearly from the four samples around
+    the point, leaving out voids. Points in missing tiles, e.g. over the
+    sea, or only surrounded by voids have no elevation.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._tiles = {}
+        self._lock = Lock()
+
+    def _tile(self, name):
+        """The memory mapped tile, None if there is no such tile"""
+        with self._lock:
+            if name not in self._tiles:
+                fp = join(self.directory, name)
+                tile = None
+                if exists(fp):
+                    size = int(round((getsize(fp) // 2) ** 0.5))
+                    if size * size * 2 != getsize(fp):
+                        raise ValueError('%s is not a square tile' % fp)
+                    tile = np.memmap(fp, dtype='>i2', mode='r',
+                                     shape=(size, size))
+                self._tiles[name] = tile
+            return self._tiles[name]
+
+    def elevation(self, lat, long):
+        """Elevation of a point
+
+        Parameters
+        ----------
+        lat, long : float
+            The point
+
+        Returns
+        -------
+        float or None
+            Elevation in meters, None if not known
+        """
+        tile = self._tile(hgt_name(lat, long))
+        if tile is None:
+            return None
+        last = tile.shape[0] - 1
+        row = (floor(lat) + 1 - lat) * last
+        col = (long - floor(long)) * last
+        # the last row and column are only reached on the tile edge
+        row0 = min(int(row), last - 1)
+        col0 = min(int(col), last - 1)
+        dr = row - row0
+        dc = col - col0
+        samples = tile[row0:row0 + 2, col0:col0 + 2].astype(float)
+        weights = np.array([[(1 - dr) * (1 - dc), (1 - dr) * dc],
+                            [dr * (1 - dc), dr * dc]])
+        valid = samples != VOID
+        if not valid.any():
+            return None
+        total = weights[valid].sum()
+        if not total:
+            # on a void sample, with the samples weighted zero around it
+            return float(samples[valid].mean())
+        return float((samples * weights)[valid].sum() / total)
+
+    def close(self):
+        """Unmaps the tiles read"""
+        with self._lock:
+            self._tiles.clear()
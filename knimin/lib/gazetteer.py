@@ -0,0 +1,246 @@
+"""Offline postal code gazetteer
+
+Loads a GeoNames postal code dump (http://download.geonames.org/export/zip/)
+so zipcodes can be geocoded without calling a geocoding API.
+"""
+import codecs
+
+import numpy as np
+
+from knimin.lib.geocoder import Location
+
+# columns of the GeoNames postal code dump
+_COUNTRY, _POSTAL, _PLACE, _STATE_NAME, _STATE_CODE = 0, 1, 2, 3, 4
+_LAT, _LONG = 9, 10
+
+
+def normalize_zipcode(zipcode):
+    """Upper cased zipcode without whitespace"""
+    return ''.join(zipcode.upper().split())
+
+
+def _to_xyz(lat, long):
+    """Points on the unit sphere, so nearest in 3D is nearest on earth"""
+    lat = np.radians(lat)
+    long = np.radians(long)
+    return np.column_stack([np.cos(lat) * np.cos(long),
+                            np.cos(lat) * np.sin(long), np.sin(lat)])
+
+
+def load_country_codes(fp):
+    """Maps country names and codes to ISO 3166 alpha-2 codes
+
+    Parameters
+    ----------
+    fp : str
+        GeoNames countryInfo.txt file
+
+    Returns
+    -------
+    dict of str
+        {lower cased name, alpha-2 or alpha-3 code: alpha-2 code, ...}
+    """
+    codes = {}
+    with codecs.open(fp, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            iso, iso3, _, _, name = line.split('\t')[:5]
+            for key in (iso, iso3, name):
+                codes[key.lower()] = iso
+    return codes
+
+
+class Gazetteer(object):
+    """Postal codes with their location, looked up without the network
+
+    Parameters
+    ----------
+    countries : list of str
+        ISO 3166 alpha-2 country code of each postal code
+    postcodes : list of str
+        The postal codes
+    places : list of str
+        Place name of each postal code
+    states : list of str
+        State, or first level administrative division, of each postal code
+    lats, longs : array_like of float
+        Latitude and longitude of each postal code
+    country_codes : dict of str, optional
+        Country names and codes the lookups are made with, mapped to their
+        alpha-2 code, see `load_country_codes`. Default None, look up by
+        alpha-2 code only
+    leaf_size : int, optional
+        Most postal codes in a KD-tree leaf. Default 16
+
+    Notes
+    -----
+    Postal codes are kept in arrays ordered as the leaves of a KD-tree over
+    their points on the unit sphere, so `lookup` is a hash lookup on
+    country and postal code and `nearest` only checks the leaves near the
+    point asked for. Only the first row of a repeated country and postal
+    code is kept.
+    """
+    def __init__(self, countries, postcodes, places, states, lats, longs,
+                 country_codes=None, leaf_size=16):
+        self.leaf_size = leaf_size
+        self._country_codes = country_codes if country_codes else {}
+        index = {}
+        for i, key in enumerate(zip(countries,
+                                    map(normalize_zipcode, postcodes))):
+            index.setdefault(key, i)
+        keep = np.array(sorted(index.values()), dtype=int)
+        lats = np.asarray(lats, dtype=float)[keep]
+        longs = np.asarray(longs, dtype=float)[keep]
+
+        xyz = _to_xyz(lats, longs)
+        order = self._build(xyz)
+        rows = keep[order]
+        self._xyz = xyz[order]
+        self._lats = lats[order]
+        self._longs = longs[order]
+        self._countries = [countries[i] for i in rows]
+        self._postcodes = [postcodes[i] for i in rows]
+        self._places = [places[i] for i in rows]
+        self._states = [states[i] for i in rows]
+        self._index = {key: i for i, key in enumerate(
+            zip(self._countries, map(normalize_zipcode, self._postcodes)))}
+
+    @classmethod
+    def load(cls, fp, countries_fp=None, leaf_size=16):
+        """Loads a GeoNames postal code dump
+
+        Parameters
+        ----------
+        fp : str
+            Tab separated GeoNames postal code file, e.g. allCountries.txt
+        countries_fp : str, optional
+            GeoNames countryInfo.txt, to look up by country name. Default
+            None, look up by alpha-2 code only
+        leaf_size : int, optional
+            Most postal codes in a KD-tree leaf. Default 16
+
+        Returns
+        -------
+        Gazetteer
+        """
+        columns = ([], [], [], [], [], [])
+        with codecs.open(fp, encoding='utf-8') as f:
+            for line in f:
+                row = line.rstrip('\r\n').split('\t')
+                if len(row) <= _LONG or not row[_LAT] or not row[_LONG]:
+                    continue
+                # the state code when it is a name like CA, otherwise the
+                # state name, same as Google's short names
+                state = row[_STATE_CODE] if row[_STATE_CODE].isalpha() \
+                    else row[_STATE_NAME]
+                for column, value in zip(columns, (
+                        row[_COUNTRY], row[_POSTAL], row[_PLACE],
+                        state or None, float(row[_LAT]),
+                        float(row[_LONG]))):
+                    column.append(value)
+        country_codes = None
+        if countries_fp is not None:
+            country_codes = load_country_codes(countries_fp)
+        return cls(*columns, country_codes=country_codes,
+                   leaf_size=leaf_size)
+
+    def __len__(self):
+        return len(self._postcodes)
+
+    def _build(self, xyz):
+        """Orders points as the leaves of a KD-tree
+
+        Each node covers a range of the order, split in half at its middle
+        on the axis of its depth, so the tree only stores the split value of
+        each node, in heap order with the root at 1.
+        """
+        order = np.arange(len(xyz))
+        self._splits = np.zeros(2 * len(xyz) // self.leaf_size + 2)
+        stack = [(1, 0, len(xyz), 0)]
+        while stack:
+            node, lo, hi, depth = stack.pop()
+            if hi - lo <= self.leaf_size:
+                continue
+            mid = (lo + hi) // 2
+            segment = order[lo:hi]
+            part = np.argpartition(xyz[segment, depth % 3], mid - lo)
+            order[lo:hi] = segment[part]
+            self._splits[node] = xyz[order[mid], depth % 3]
+            stack.append((2 * node, lo, mid, depth + 1))
+            stack.append((2 * node + 1, mid, hi, depth + 1))
+        return order
+
+    def _location(self, i, zipcode, country):
+        return Location(zipcode, float(self._lats[i]), float(self._longs[i]),
+                        None, self._places[i], self._states[i],
+                        self._postcodes[i], country)
+
+    def lookup(self, zipcode, country):
+        """Location of a zipcode
+
+        Parameters
+        ----------
+        zipcode : str
+            The zipcode, in any case and spacing. US ZIP+4 codes and full UK
+            postcodes are also looked up by their first part
+        country : str
+            Alpha-2 code, or any name or code in the country codes
+
+        Returns
+        -------
+        Location or None
+            The location, without elevation and with the zipcode and
+            country as given, None if the zipcode is not known
+        """
+        if not zipcode or not country:
+            return None
+        code = self._country_codes.get(country.lower(), country.upper())
+        candidates = [normalize_zipcode(zipcode),
+                      normalize_zipcode(zipcode.split('-')[0])]
+        if zipcode.split():
+            candidates.append(normalize_zipcode(zipcode.split()[0]))
+        for candidate in candidates:
+            i = self._index.get((code, candidate))
+            if i is not None:
+                return self._location(i, zipcode, country)
+        return None
+
+    def nearest(self, lat, long):
+        """Location of the postal code nearest to a point
+
+        Parameters
+        ----------
+        lat, long : float
+            The point
+
+        Returns
+        -------
+        Location or None
+            The location, without elevation, of the nearest postal code.
+            None if the gazetteer is empty
+        """
+        if not len(self):
+            return None
+        point = _to_xyz(lat, long)[0]
+        best = [np.inf, -1]
+
+        def search(node, lo, hi, depth):
+            if hi - lo <= self.leaf_size:
+                dist = ((self._xyz[lo:hi] - point) ** 2).sum(axis=1)
+                i = dist.argmin()
+                if dist[i] < best[0]:
+                    best[:] = [dist[i], lo + i]
+                return
+            mid = (lo + hi) // 2
+            diff = point[depth % 3] - self._splits[node]
+            near, far = ((2 * node, lo, mid), (2 * node + 1, mid, hi)) \
+                if diff < 0 else ((2 * node + 1, mid, hi), (2 * node, lo, mid))
+            search(near[0], near[1], near[2], depth + 1)
+            # the other half can only be nearer if the split plane is
+            if diff * diff < best[0]:
+                search(far[0], far[1], far[2], depth + 1)
+
+        search(1, 0, len(self), 0)
+        i = best[1]
+        return self._location(i, self._postcodes[i], self._countries[i])
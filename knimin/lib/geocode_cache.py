@@ -0,0 +1,171 @@
+from json import dumps, loads
+from threading import Lock
+from time import time
+import re
+import sqlite3
+
+from knimin.lib.geocoder import Location
+
+
+def normalize_address(address):
+    """Normalizes an address so ways of writing it share a cache key
+
+    Parameters
+    ----------
+    address : str
+        Address as sent to the geocoding API
+
+    Returns
+    -------
+    unicode
+        The address lower cased, with punctuation dropped and whitespace
+        collapsed to single spaces
+    """
+    if isinstance(address, str):
+        address = address.decode('utf-8', 'replace')
+    return ' '.join(re.sub(r'[^\w\s]', ' ', address.lower(),
+                           flags=re.UNICODE).split())
+
+
+class GeocodeCache(object):
+    """Thread-safe geocoding results kept on disk between runs
+
+    Parameters
+    ----------
+    fp : str
+        Path of the sqlite database holding the cache, created if missing
+    max_entries : int, optional
+        Number of addresses kept. Once more are stored, the least recently
+        used ones are evicted. Default 100000
+    negative_ttl : float, optional
+        Seconds an address the API did not find is kept, so it is asked
+        for again once it may be known. Default 30 days
+
+    Notes
+    -----
+    Addresses are keyed by `normalize_address`. Addresses found are kept
+    until evicted. Errors are not cached, so the next lookup asks the API
+    again.
+    """
+    def __init__(self, fp, max_entries=100000, negative_ttl=30 * 86400):
+        self.fp = fp
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self._lock = Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._conn = sqlite3.connect(fp, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS geocode (
+                                      address TEXT PRIMARY KEY,
+                                      location TEXT NOT NULL,
+                                      found INTEGER NOT NULL,
+                                      stored REAL NOT NULL,
+                                      used REAL NOT NULL)""")
+            self._conn.execute("""CREATE INDEX IF NOT EXISTS geocode_used
+                                  ON geocode (used)""")
+
+    def get_many(self, addresses):
+        """Gets the cached locations of addresses
+
+        Parameters
+        ----------
+        addresses : iterable of str
+            Addresses to look up
+
+        Returns
+        -------
+        dict of Location
+            {address: Location, ...} for the addresses cached, with the
+            address as given as the Location input
+        """
+        keys = {}
+        for address in addresses:
+            keys.setdefault(normalize_address(address), []).append(address)
+        if not keys:
+            return {}
+        now = time()
+        expired = now - self.negative_ttl
+        results = {}
+        found_keys = []
+        with self._lock:
+            key_list = list(keys)
+            # stay below the sqlite limit on query parameters
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                sql = """SELECT address, location, found, stored
+                         FROM geocode
+                         WHERE address IN (%s)""" % ','.join('?' * len(chunk))
+                for key, location, found, stored in self._conn.execute(
+                        sql, chunk):
+                    if not found and stored < expired:
+                        continue
+                    found_keys.append(key)
+                    location = loads(location)
+                    for address in keys[key]:
+                        results[address] = Location(address, *location[1:])
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE geocode SET used = ? WHERE address = ?",
+                    [(now, key) for key in found_keys])
+            self._stats['hits'] += len(found_keys)
+            self._stats['misses'] += len(keys) - len(found_keys)
+        return results
+
+    def get(self, address):
+        """Gets the cached location of an address, None if not cached"""
+        return self.get_many([address]).get(address)
+
+    def set_many(self, locations):
+        """Stores locations of addresses
+
+        Parameters
+        ----------
+        locations : dict
+            {address: Location, ...}. Addresses with None, e.g. geocoding
+            failed with an error, are not stored
+        """
+        now = time()
+        rows = [(normalize_address(address), dumps(list(location)),
+                 int(location.lat is not None), now, now)
+                for address, location in locations.items()
+                if location is not None]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """INSERT OR REPLACE INTO geocode
+                   (address, location, found, stored, used)
+                   VALUES (?, ?, ?, ?, ?)""", rows)
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM geocode").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    """DELETE FROM geocode WHERE address IN (
+                           SELECT address FROM geocode
+                           ORDER BY used LIMIT ?)""",
+                    [count - self.max_entries])
+                self._stats['evictions'] += count - self.max_entries
+
+    def set(self, address, location):
+        """Stores the location of an address"""
+        self.set_many({address: location})
+
+    def stats(self):
+        """Usage statistics of the cache
+
+        Returns
+        -------
+        dict
+            Counters of `hits`, `misses` and `evictions` since creation and
+            the number of `entries` stored
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = self._conn.execute(
+                "SELECT COUNT(*) FROM geocode").fetchone()[0]
+        return stats
+
+    def close(self):
+        """Closes the cache database"""
+        with self._lock:
+            self._conn.close()
@@ -1,7 +1,13 @@
 from collections import namedtuple
+from functools import partial
 from json import loads
+from threading import Event, Lock
+from urllib import urlencode
 import requests
-from time import sleep
+from requests.adapters import HTTPAdapter
+from time import sleep, time
+
+from concurrent.futures import ThreadPoolExecutor
 
 
 class GoogleAPILimitExceeded(Exception):
@@ -19,12 +25,24 @@ Location = namedtuple('Location', ['input', 'lat', 'long', 'elev', 'city',
                       'state', 'postcode', 'country'])
 
 
-def _call_wrapper(url):  # noqa
-    """Encapsulate all checks for API calls"""
+GOOGLE_URL = 'https://maps.googleapis.com'
+GEOCODE_PATH = '/maps/api/geocode/json'
+ELEVATION_PATH = '/maps/api/elevation/json'
+
+
+def _call_wrapper(url, session=None, acquire=None):  # noqa
+    """Encapsulate all checks for API calls
+
+    `acquire`, if given, is called before every request, retries included,
+    e.g. a `TokenBucket.acquire` keeping them within the API quota.
+    """
+    get = requests.get if session is None else session.get
     # allow 4 retries do we sleep longer than a second if all loops happen
     stat_err_count = 0
     for retry in range(4):
-        req = requests.get(url)
+        if acquire is not None:
+            acquire()
+        req = get(url)
         if req.status_code != 200:
             stat_err_count += 1
             if stat_err_count == 3:
@@ -54,13 +72,8 @@ def _call_wrapper(url):  # noqa
     return geo['results']
 
 
-def geocode(address):
-    geo_url = 'https://maps.googleapis.com' + \
-        '/maps/api/geocode/json?address=%s'
-    elev_url = 'https://maps.googleapis.com' + \
-        '/maps/api/elevation/json?locations=%s'
-
-    geo = _call_wrapper(geo_url % address)
+def _parse_geocode(address, geo):
+    """Location of the first geocoding result, without elevation"""
     if not geo:
         return Location(address, None, None, None, None, None, None, None)
     # Get the actual lat and long readings
@@ -85,7 +98,227 @@ def geocode(address):
             country = geo_dict['long_name']
         elif geotype == "postal_code" or geotype == "postal_code_prefix":
             postcode = geo_dict['long_name']
-    geo2 = _call_wrapper(elev_url % "%f,%f" % (lat, lng))
-    elev = float(geo2[0]['elevation'])
+    return Location(address, lat, lng, None, city, state, postcode, country)
+
+
+def geocode(address, cache=None, elevation=None):
+    """Geocodes an address, looking it up in `cache` first if given
+
+    The elevation is looked up with the `elevation` provider if given, see
+    `knimin.lib.elevation`, otherwise with the elevation API.
+    """
+    geo_url = GOOGLE_URL + GEOCODE_PATH + '?address=%s'
+    elev_url = GOOGLE_URL + ELEVATION_PATH + '?locations=%s'
+
+    if cache is not None:
+        info = cache.get(address)
+        if info is not None:
+            return info
+
+    info = _parse_geocode(address, _call_wrapper(geo_url % address))
+    if info.lat is not None and elevation is not None:
+        info = info._replace(elev=elevation.elevation(info.lat, info.long))
+    elif info.lat is not None:
+        geo2 = _call_wrapper(elev_url % "%f,%f" % (info.lat, info.long))
+        info = info._replace(elev=float(geo2[0]['elevation']))
+    if cache is not None:
+        cache.set(address, info)
+    return info
+
+
+class TokenBucket(object):
+    """Rate limiter shared between threads
+
+    Parameters
+    ----------
+    rate : float
+        Tokens handed out per second
+    capacity : float, optional
+        Tokens that can be handed out at once after being idle. Default 1
+
+    Notes
+    -----
+    Each `acquire` takes a token, waiting until one is available. Tokens
+    are handed out in the order they are asked for.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = time()
+        self._lock = Lock()
+
+    def acquire(self):
+        """Takes a token, waiting until one is available"""
+        with self._lock:
+            now = time()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # the token is reserved now, waiting is done outside the lock
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            sleep(wait)
+
+
+class BatchGeocoder(object):
+    """Geocodes many addresses concurrently within the API quota
+
+    Parameters
+    ----------
+    url : str, optional
+        Base URL of the geocoding and elevation APIs. Default Google's
+    rate : float, optional
+        Maximum requests per second sent to the APIs. Default 50, the
+        Google APIs quota
+    workers : int, optional
+        Number of requests in flight at once. Default 8
+    elevation_batch : int, optional
+        Number of locations looked up per elevation request. Default 50
+    cache : GeocodeCache, optional
+        Cache addresses are looked up in before asking the APIs, and results
+        stored in. Default None, always ask the APIs
+    elevation : elevation provider, optional
+        Provider elevations are looked up with instead of the elevation API,
+        see `knimin.lib.elevation`. Default None, ask the API
+
+    Notes
+    -----
+    All requests share a keep-alive session and a `TokenBucket`, so
+    `workers` only hides the latency of the requests and the API quota is
+    kept whatever their number.
+    """
+    def __init__(self, url=GOOGLE_URL, rate=50, workers=8,
+                 elevation_batch=50, cache=None, elevation=None):
+        self.url = url.rstrip('/')
+        self.cache = cache
+        self.elevation = elevation
+        self.workers = workers
+        self.elevation_batch = elevation_batch
+        self._bucket = TokenBucket(rate)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _call(self, path, **params):
+        params = {k: v.encode('utf-8') if isinstance(v, unicode) else v
+                  for k, v in params.items()}
+        return _call_wrapper('%s%s?%s' % (self.url, path, urlencode(params)),
+                             self._session, self._bucket.acquire)
+
+    def geocode(self, addresses):
+        """Geocodes addresses, each distinct address once
+
+        Parameters
+        ----------
+        addresses : iterable of str
+            Addresses to geocode
+
+        Returns
+        -------
+        dict
+            {address: Location, ...}. The Location is None if geocoding the
+            address failed with an error, and has None for everything but
+            the address if it was not found. Addresses left out were not
+            geocoded since the API limit was exceeded
+        """
+        addresses = set(addresses)
+        cached = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(addresses)
+            addresses.difference_update(cached)
+        results = self._geocode(addresses)
+        if self.cache is not None:
+            self.cache.set_many(results)
+        results.update(cached)
+        return results
+
+    def _geocode(self, addresses):
+        """Geocodes distinct addresses with the APIs, see `geocode`"""
+        # each API has its own quota
+        geocode_stop = Event()
+        elevation_stop = Event()
+        results = {}
+        with ThreadPoolExecutor(self.workers) as executor:
+            found = []
+            for address, info in executor.map(
+                    partial(self._locate, stop=geocode_stop),
+                    sorted(addresses)):
+                if info is False:
+                    continue
+                if info is None or info.lat is None:
+                    results[address] = info
+                else:
+                    found.append(info)
+            for elevated in executor.map(
+                    partial(self._elevate, stop=elevation_stop),
+                    self._batches(found)):
+                results.update(elevated)
+        return results
+
+    def _batches(self, found):
+        """Splits found locations into batches for the elevation API"""
+        return [found[i:i + self.elevation_batch]
+                for i in range(0, len(found), self.elevation_batch)]
+
+    def _locate(self, address, stop):
+        """Geocodes an address with the geocoding API
+
+        Returns
+        -------
+        tuple of (str, Location)
+            The address and its Location. The Location is None if geocoding
+            failed with an error, and False if the API limit was exceeded,
+            which sets `stop` so no more requests are sent
+        """
+        if stop.is_set():
+            return address, False
+        try:
+            return address, _parse_geocode(
+                address, self._call(GEOCODE_PATH, address=address))
+        except GoogleAPILimitExceeded:
+            stop.set()
+            return address, False
+        except Exception:
+            return address, None
+
+    def _elevate(self, batch, stop):
+        """Adds elevations to a batch of found locations
+
+        Returns
+        -------
+        list of (str, Location)
+            The address and elevated Location of each location in the batch.
+            The Location is None if looking up its elevation failed with an
+            error. Empty if the API limit was exceeded, which sets `stop` so
+            no more requests are sent
+        """
+        if self.elevation is not None:
+            return [(info.input, info._replace(
+                elev=self.elevation.elevation(info.lat, info.long)))
+                for info in batch]
+        if stop.is_set():
+            return []
+        try:
+            elevations = self._call(ELEVATION_PATH, locations='|'.join(
+                '%f,%f' % (info.lat, info.long) for info in batch))
+            if len(elevations) != len(batch):
+                raise ValueError('Expected %d elevations, got %d'
+                                 % (len(batch), len(elevations)))
+        except GoogleAPILimitExceeded:
+            stop.set()
+            return []
+        except Exception:
+            if len(batch) == 1:
+                return [(batch[0].input, None)]
+            # find the locations failing by looking them up one by one
+            return [res for info in batch
+                    for res in self._elevate([info], stop)]
+        return [(info.input, info._replace(elev=float(e['elevation'])))
+                for info, e in zip(batch, elevations)]
 
-    return Location(address, lat, lng, elev, city, state, postcode, country)
+    def close(self):
+        """Closes the connections kept alive"""
+        self._session.close()
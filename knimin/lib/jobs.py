@@ -0,0 +1,119 @@
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobTracker(object):
+    """Runs long tasks in the background and keeps track of their progress
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Maximum number of jobs running at the same time, the others wait
+        their turn. Default 2
+    ttl : float, optional
+        Seconds a finished job is kept for its status to be asked for.
+        Default 3600
+
+    Notes
+    -----
+    A job is a function taking a `progress` keyword argument, which it calls
+    as ``progress(done, total)`` as it goes. Handlers submit the job and
+    return its ID right away, and clients poll `status` until the job is
+    done::
+
+        job_id = jobs.submit(self.current_user, db.create_ag_kits, kits)
+    """
+    def __init__(self, max_workers=2, ttl=3600):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._lock = Lock()
+        # {job ID: status dict}
+        self._jobs = {}
+
+    def submit(self, owner, func, *args, **kwargs):
+        """Queues a job
+
+        Parameters
+        ----------
+        owner : str
+            User the job belongs to, the only one allowed to see it
+        func : callable
+            The job, called with `args`, `kwargs` and a `progress` callback
+        args, kwargs
+            Arguments passed to the job
+
+        Returns
+        -------
+        str
+            The job ID
+        """
+        job_id = uuid4().hex
+        with self._lock:
+            self._expire()
+            self._jobs[job_id] = {'owner': owner, 'status': 'queued',
+                                  'done': 0, 'total': None, 'result': None,
+                                  'error': None, 'finished': None}
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        def progress(done, total):
+            with self._lock:
+                self._jobs[job_id].update({'done': done, 'total': total})
+
+        with self._lock:
+            self._jobs[job_id]['status'] = 'running'
+        try:
+            result = func(*args, progress=progress, **kwargs)
+        except Exception as e:
+            update = {'status': 'failed', 'error': str(e)}
+        else:
+            update = {'status': 'done', 'result': result}
+        update['finished'] = time()
+        with self._lock:
+            self._jobs[job_id].update(update)
+
+    def _expire(self):
+        """Drops jobs finished longer than the TTL ago, lock must be held"""
+        expired = time() - self.ttl
+        for job_id, job in list(self._jobs.items()):
+            if job['finished'] is not None and job['finished'] < expired:
+                del self._jobs[job_id]
+
+    def status(self, job_id, owner, collect=False):
+        """Status of a job
+
+        Parameters
+        ----------
+        job_id : str
+            The job ID
+        owner : str
+            User asking for the job
+        collect : bool, optional
+            If True, a finished job is dropped once its status is returned,
+            so a result holding secrets is only handed out once. Default
+            False, keep it for the TTL
+
+        Returns
+        -------
+        dict or None
+            `status`, one of queued, running, done or failed, the `done` and
+            `total` last reported, the `result` once done and the `error`
+            message if failed. None if there is no such job for the owner
+        """
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None or job['owner'] != owner:
+                return None
+            if collect and job['finished'] is not None:
+                del self._jobs[job_id]
+            return {k: v for k, v in job.items()
+                    if k not in ('owner', 'finished')}
+
+    def shutdown(self, wait=True):
+        """Stops running jobs once the ones queued are done"""
+        self._executor.shutdown(wait)
@@ -1,5 +1,8 @@
 # http://stackoverflow.com/a/19722365
+import struct
 import zipfile
+import zlib
+from time import localtime
 
 try:
     from cStringIO import StringIO
@@ -60,6 +63,121 @@ class InMemoryZip(object):
         self.in_memory_zip.close()
         return self.in_memory_data.getvalue()
 
+
+class StreamingZip(object):
+    """Builds a zip file as a stream of bytes, one member at a time
+
+    Members are deflated as their contents come in and the sizes and CRC are
+    written after the data, so nothing needs to be held in memory or seeked
+    back to. The central directory is written by `close`.
+
+    Notes
+    -----
+    ZIP64 is not supported, so members and the whole archive must stay under
+    4GB.
+
+    Examples
+    --------
+    >>> zipper = StreamingZip()
+    >>> data = b''.join(zipper.add('test.txt', [b'Another ', b'test']))
+    >>> data += zipper.close()
+    """
+    _local_header = struct.Struct('<4s5H3L2H')
+    _data_descriptor = struct.Struct('<4s3L')
+    _central_header = struct.Struct('<4s6H3L5H2L')
+    _end_record = struct.Struct('<4s4H2LH')
+    # sizes and CRC come in the data descriptor after the member data
+    _flags = 0x08
+    _version = 20
+    _limit = 0xFFFFFFFF
+
+    def __init__(self, compresslevel=6):
+        self.compresslevel = compresslevel
+        self._offset = 0
+        self._members = []
+
+    def add(self, filename_in_zip, chunks):
+        """Adds a member to the zip file
+
+        Parameters
+        ----------
+        filename_in_zip : str
+            Filename of the member in the zip file.
+        chunks : iterable of str
+            Contents of the member, as binary strings.
+
+        Yields
+        ------
+        str
+            Binary content of the zip file for this member
+        """
+        if isinstance(filename_in_zip, bytes):
+            name = filename_in_zip
+        else:
+            name = filename_in_zip.encode('utf-8')
+        now = localtime()
+        dostime = now.tm_hour << 11 | now.tm_min << 5 | now.tm_sec // 2
+        dosdate = (now.tm_year - 1980) << 9 | now.tm_mon << 5 | now.tm_mday
+        header_offset = self._offset
+
+        yield self._emit(self._local_header.pack(
+            b'PK\x03\x04', self._version, self._flags, zipfile.ZIP_DEFLATED,
+            dostime, dosdate, 0, 0, 0, len(name), 0) + name)
+
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        crc = 0
+        size = 0
+        compressed_size = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                compressed_size += len(data)
+                yield self._emit(data)
+        data = compressor.flush()
+        compressed_size += len(data)
+        if size > self._limit or compressed_size > self._limit:
+            raise ValueError("%s is too large for a zip file without ZIP64"
+                             % filename_in_zip)
+        crc &= 0xFFFFFFFF
+        yield self._emit(data + self._data_descriptor.pack(
+            b'PK\x07\x08', crc, compressed_size, size))
+
+        self._members.append((name, dostime, dosdate, crc, compressed_size,
+                              size, header_offset))
+
+    def close(self):
+        """Finishes the zip file
+
+        Returns
+        -------
+        str
+            Binary content of the central directory, ending the zip file
+        """
+        start = self._offset
+        directory = []
+        for (name, dostime, dosdate, crc, compressed_size, size,
+                header_offset) in self._members:
+            directory.append(self._central_header.pack(
+                b'PK\x01\x02', self._version, self._version, self._flags,
+                zipfile.ZIP_DEFLATED, dostime, dosdate, crc, compressed_size,
+                size, len(name), 0, 0, 0, 0, 0, header_offset))
+            directory.append(name)
+        directory = b''.join(directory)
+        count = len(self._members)
+        return self._emit(directory + self._end_record.pack(
+            b'PK\x05\x06', 0, 0, count, count, len(directory), start, 0))
+
+    def _emit(self, data):
+        self._offset += len(data)
+        if self._offset > self._limit:
+            raise ValueError("Zip file too large without ZIP64")
+        return data
+
+
 if __name__ == "__main__":
     # Run a test
     imz = InMemoryZip()
@@ -0,0 +1,137 @@
+"""Minimal PDF writer
+
+Writes documents of vector graphics and text in the standard Helvetica font,
+page content streams built by the caller, without any external tools.
+"""
+from StringIO import StringIO
+import zlib
+
+# Helvetica widths of the printable ASCII characters, in 1/1000 of the font
+# size, from the Adobe font metrics of the standard fonts
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333,
+    278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278,
+    584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278,
+    500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944,
+    667, 667, 611, 278, 278, 278, 469, 556, 333, 556, 556, 500, 556, 556,
+    278, 556, 556, 222, 222, 500, 222, 833, 556, 556, 556, 556, 333, 500,
+    278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584]
+
+
+def text_width(text, size):
+    """Width of text set in Helvetica
+
+    Parameters
+    ----------
+    text : str
+        Printable ASCII text
+    size : float
+        Font size
+
+    Returns
+    -------
+    float
+        The width, in the units of the font size
+    """
+    return sum(_HELVETICA_WIDTHS[ord(c) - 32] for c in text) * size / 1000.
+
+
+def pdf_string(text):
+    """Text as a PDF literal string, e.g. (text)"""
+    return '(%s)' % text.replace('\\', '\\\\').replace(
+        '(', '\\(').replace(')', '\\)')
+
+
+def compress_page(content):
+    """Compresses a page content stream, to add it to a `PDFDocument`
+
+    Pages can be compressed in other processes, and only the compressed
+    streams sent back to the document.
+    """
+    if isinstance(content, unicode):
+        content = content.encode('cp1252')
+    return zlib.compress(content)
+
+
+class PDFDocument(object):
+    """A document of pages all the same size
+
+    Parameters
+    ----------
+    width, height : float
+        Page size in points, 1/72 inch
+
+    Notes
+    -----
+    Page content streams are in the PDF page description language, and can
+    use Helvetica as the font resource /F1. They are compressed as they are
+    added, so only the compressed pages are kept in memory.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._pages = []
+
+    def __len__(self):
+        return len(self._pages)
+
+    def add_page(self, content, compressed=False):
+        """Adds a page
+
+        Parameters
+        ----------
+        content : str
+            The page content stream
+        compressed : bool, optional
+            Whether the content stream is already compressed, see
+            `compress_page`. Default False
+        """
+        self._pages.append(content if compressed else compress_page(content))
+
+    def write(self, f):
+        """Writes the document
+
+        Parameters
+        ----------
+        f : file-like
+            Binary file to write the document to
+        """
+        offsets = []
+        pos = [0]
+
+        def emit(data):
+            f.write(data)
+            pos[0] += len(data)
+
+        def obj(body):
+            offsets.append(pos[0])
+            emit('%d 0 obj\n%s\nendobj\n' % (len(offsets), body))
+
+        emit('%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        # catalog, page tree and font, then each page and its contents
+        kids = ' '.join('%d 0 R' % (4 + 2 * i)
+                        for i in range(len(self._pages)))
+        obj('<< /Type /Catalog /Pages 2 0 R >>')
+        obj('<< /Type /Pages /Kids [%s] /Count %d >>'
+            % (kids, len(self._pages)))
+        obj('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            '/Encoding /WinAnsiEncoding >>')
+        for i, stream in enumerate(self._pages):
+            obj('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %g %g] '
+                '/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+                % (self.width, self.height, 5 + 2 * i))
+            obj('<< /Length %d /Filter /FlateDecode >>\nstream\n%s\n'
+                'endstream' % (len(stream), stream))
+
+        xref = pos[0]
+        emit('xref\n0 %d\n0000000000 65535 f \n' % (len(offsets) + 1))
+        for offset in offsets:
+            emit('%010d 00000 n \n' % offset)
+        emit('trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+             % (len(offsets) + 1, xref))
+
+    def tostring(self):
+        """The document as a string"""
+        f = StringIO()
+        self.write(f)
+        return f.getvalue()
@@ -0,0 +1,186 @@
+from threading import Lock, Thread
+from time import time
+
+
+class ReferenceCache(object):
+    """Thread-safe cache of reference tables shared by every request
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds a loaded value is kept before it is loaded again, no matter
+        what its version says. Default 3600
+    check_after : float, optional
+        Seconds a loaded value is trusted before its version is checked
+        again. Default 10
+    refresh_after : float, optional
+        Seconds after which a loaded value is loaded again in the
+        background, while the loaded one is still returned. Default None,
+        only load when asked for
+
+    Notes
+    -----
+    Each table is registered with a function that loads it and, optionally,
+    a function returning a cheap version for it, e.g. row count or
+    modification counters. Once `check_after` seconds passed, the version is
+    checked on the next `get` and the table only loaded again if it changed.
+    Code changing a table should call `invalidate` so the change is seen
+    right away.
+
+    With `refresh_after`, values are always returned from memory until the
+    TTL expires, e.g. for expensive statistics that may be a bit old.
+
+    Values are shared, so callers must not modify them.
+    """
+    def __init__(self, ttl=3600, check_after=10, refresh_after=None):
+        self.ttl = ttl
+        self.check_after = check_after
+        self.refresh_after = refresh_after
+        self._lock = Lock()
+        # {name: (load function, version function)}
+        self._sources = {}
+        # {name: Lock}, so a table is loaded by one thread at a time
+        self._load_locks = {}
+        # {name: (value, version, time loaded, time version checked)}
+        self._entries = {}
+        # {name: times invalidated}, so background loads started before an
+        # invalidation do not store stale values
+        self._generations = {}
+        # names being loaded in the background
+        self._refreshing = set()
+        self._stats = {'hits': 0, 'loads': 0, 'version_checks': 0,
+                       'invalidations': 0, 'refreshes': 0}
+
+    def register(self, name, load_func, version_func=None):
+        """Adds a table to the cache
+
+        Parameters
+        ----------
+        name : str
+            Name to get the table by
+        load_func : callable
+            Called without arguments, returns the value to cache
+        version_func : callable, optional
+            Called without arguments, returns a value that changes whenever
+            the table does. Default None, only reload once the TTL expires
+        """
+        with self._lock:
+            self._sources[name] = (load_func, version_func)
+            self._load_locks[name] = Lock()
+            self._entries.pop(name, None)
+
+    def get(self, name):
+        """Gets a cached table, loading it if needed
+
+        Parameters
+        ----------
+        name : str
+            Name the table was registered with
+
+        Returns
+        -------
+        object
+            The value returned by the table's load function
+
+        Raises
+        ------
+        KeyError
+            No table registered with the name
+        """
+        load_func, version_func = self._sources[name]
+        with self._load_locks[name]:
+            now = time()
+            entry = self._entries.get(name)
+            if entry is not None:
+                value, version, loaded, checked = entry
+                if now - loaded < self.ttl:
+                    if now - checked < self.check_after or \
+                            version_func is None:
+                        self._count('hits')
+                        if self.refresh_after is not None and \
+                                now - loaded >= self.refresh_after:
+                            self._refresh_later(name)
+                        return value
+                    else:
+                        self._count('version_checks')
+                        if version_func() == version:
+                            self._entries[name] = (value, version, loaded,
+                                                   now)
+                            self._count('hits')
+                            return value
+
+            # get the version first, so changes made while loading are seen
+            # on the next check
+            version = version_func() if version_func is not None else None
+            value = load_func()
+            self._count('loads')
+            self._entries[name] = (value, version, now, now)
+            return value
+
+    def _refresh_later(self, name):
+        """Loads a table again in a background thread, unless already"""
+        with self._lock:
+            if name in self._refreshing:
+                return
+            self._refreshing.add(name)
+            generation = self._generations.get(name, 0)
+        thread = Thread(target=self._refresh, args=(name, generation))
+        thread.daemon = True
+        thread.start()
+
+    def _refresh(self, name, generation):
+        """Loads a table and stores it if not invalidated meanwhile"""
+        load_func, version_func = self._sources[name]
+        try:
+            version = version_func() if version_func is not None else None
+            value = load_func()
+            with self._load_locks[name]:
+                if self._generations.get(name, 0) == generation:
+                    now = time()
+                    self._entries[name] = (value, version, now, now)
+                    self._count('refreshes')
+        finally:
+            with self._lock:
+                self._refreshing.discard(name)
+
+    def invalidate(self, name=None):
+        """Drops cached tables so they are loaded again on next use
+
+        Parameters
+        ----------
+        name : str, optional
+            Table to drop. Default None, drop all of them
+
+        Raises
+        ------
+        KeyError
+            No table registered with the name
+        """
+        names = list(self._sources) if name is None else [name]
+        for name in names:
+            # wait for loads in progress, or they would store stale values
+            with self._load_locks[name]:
+                self._entries.pop(name, None)
+                with self._lock:
+                    self._generations[name] = \
+                        self._generations.get(name, 0) + 1
+        self._count('invalidations')
+
+    def stats(self):
+        """Usage statistics for the cache
+
+        Returns
+        -------
+        dict
+            Counters of `hits`, `loads`, `version_checks`, `invalidations`
+            and background `refreshes`, plus the names of the tables
+            currently `cached`
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = sorted(self._entries)
+        return stats
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
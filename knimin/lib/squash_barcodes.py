@@ -1,20 +1,39 @@
 #!/usr/bin/env python
 
-"""take barcodes and dump to a single multipage pdf
+"""take barcodes and dump to a single multipage pdf"""
 
-requires GPL Ghostscript 9.05
-"""
-
-from PIL import Image
-from os import path, mkdir
+from multiprocessing import Pool
 from os.path import join, dirname, realpath
-from math import ceil
-from random import choice
-from shutil import rmtree
-from subprocess import Popen, PIPE
-from shlex import split as cmd_split
 
-from knimin.lib.code128 import code128_image
+from knimin.lib.code128 import code128_image, code128_widths
+from knimin.lib.pdf import PDFDocument, compress_page, pdf_string, text_width
+
+# assuming N * 8.5in x 11in, laid out in pixels at 150 dpi
+PAGE_WIDTH = 1275
+PAGE_HEIGHT = 1650
+DPI = 150
+
+# padding set empirically for
+# Electronic Imaging Materials
+# Part #80402
+START_LEFT = 18
+START_UPPER = 59
+HORIZ_GAP = 23
+VERT_GAP = 17
+BOX_WIDTH = 300
+BOX_HEIGHT = 150
+COLUMNS = 4
+LABELS_PER_PAGE = 36
+
+# barcodes are 202x100px, centered in their box, with the bars 2px a module
+# above 25px of text
+BARCODE_WIDTH = 202
+BARCODE_HEIGHT = 100
+SHIFT_RIGHT = 49
+SHIFT_DOWN = 25
+THICKNESS = 2
+TEXT_HEIGHT = 25
+FONT_SIZE = 20
 
 
 def get_image(barcodes):
@@ -24,90 +43,87 @@ def get_image(barcodes):
                             show_text=True, quiet_zone=False)
 
 
-def build_barcodes_pdf(barcodes):
-    # 36 barcodes per page
-    pages = int(ceil(len(barcodes) / 36.0))
-
-    # assuming N * 8.5in x 11in
-    PAGE_WIDTH = 1275
-    PAGE_HEIGHT = 1650
-
-    # create blank pdfs
-    blanks = [Image.new('RGB', (PAGE_WIDTH, PAGE_HEIGHT), (255, 255, 255))
-              for i in range(pages)]
-
-    # padding set empirically for
-    # Electronic Imaging Materials
-    # Part #80402
-    START_LEFT = 18
-    START_UPPER = 59
-    HORIZ_GAP = 23
-    VERT_GAP = 17
-    BOX_WIDTH = 300
-    BOX_HEIGHT = 150
-
-    # center barcode, assuming barcode images are 300x150px
-    # will adjust per image if 202x100px
-    SHIFT_RIGHT = 0
-    SHIFT_DOWN = 0
-
-    # set starting points
-    cur_left = START_LEFT
-    cur_upper = START_UPPER
-    page = -1
-    idx = 0
-    for i in get_image(barcodes):
-        # if we have 36 barcodes we have filled a page
-        if idx % 36 == 0:
-            page += 1
-            cur_upper = START_UPPER
-            cur_left = START_LEFT
-
-        # verify the barcode is the expected size, shift accordingly
-        width, height = i.size
-        if i.size == (202, 100):
-            SHIFT_RIGHT = 49
-            SHIFT_DOWN = 25
-        elif i.size == (300, 150):
-            SHIFT_RIGHT = 0
-            SHIFT_DOWN = 0
-        else:
-            tmp = "image %s is an unsupported size"
-            raise AttributeError(tmp % i.shape)
-
-        # shift to new row
-        if cur_left + width > PAGE_WIDTH:
-            cur_left = START_LEFT
-            cur_upper = cur_upper + HORIZ_GAP + BOX_HEIGHT
-
-        # paste into the image
-        blanks[page].paste(i, (cur_left + SHIFT_RIGHT, cur_upper + SHIFT_DOWN))
-
-        # shift right
-        cur_left += BOX_WIDTH + VERT_GAP
-
-        idx += 1
-
-    # write out each page
-    tmpdir = "tmp_%s" % ''.join([choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
-                                 for i in range(5)])
-    while path.exists(tmpdir):
-        tmpdir = "tmp_%s" % ''.join([choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
-                                     for i in range(5)])
-    mkdir(tmpdir)
-
-    temp_pages = "squash_barcode_page_%d.pdf"
-    for page, blank in enumerate(blanks):
-        blank.save(path.join(tmpdir, temp_pages % page), quality=100)
-
-    match_pages = ' '.join([path.join(tmpdir, "squash_barcode_page_%d.pdf" % i)
-                            for i in range(len(blanks))])
-
-    # magically squash all the pages
-    cmd = cmd_split('gs -r150 -q -sPAPERSIZE=a4 -dNOPAUSE -dBATCH' +
-                    ' -sDEVICE=pdfwrite -sOutputFile=- %s' % match_pages)
-    p = Popen(cmd, stdout=PIPE)
-    output, _ = p.communicate()
-    rmtree(tmpdir)
-    # return PDF text
-    return output
+def _label(barcode, left, upper):
+    """Drawing operators of a barcode label, in pixels"""
+    widths = code128_widths(barcode, THICKNESS)
+    x = left + SHIFT_RIGHT + (BARCODE_WIDTH - sum(widths)) // 2
+    ops = []
+    # bars and spaces alternate, bar first
+    for i, w in enumerate(widths):
+        if i % 2 == 0:
+            ops.append('%d %d %d %d re' % (x, upper + SHIFT_DOWN, w,
+                                           BARCODE_HEIGHT - TEXT_HEIGHT + 1))
+        x += w
+    ops.append('f')
+    # y is flipped back for the text, so it is not drawn upside down
+    text_left = left + SHIFT_RIGHT + \
+        (BARCODE_WIDTH - text_width(barcode, FONT_SIZE)) / 2.
+    text_base = upper + SHIFT_DOWN + BARCODE_HEIGHT - 3
+    ops.append('BT /F1 %d Tf 1 0 0 -1 %.2f %d Tm %s Tj ET'
+               % (FONT_SIZE, text_left, text_base, pdf_string(barcode)))
+    return '\n'.join(ops)
+
+
+def _page(barcodes):
+    """Content stream of a page of up to 36 labels"""
+    scale = 72. / DPI
+    # pixels from the top left corner, as the labels are laid out
+    ops = ['%g 0 0 %g 0 %g cm' % (scale, -scale, PAGE_HEIGHT * scale)]
+    for idx, barcode in enumerate(barcodes):
+        row, col = divmod(idx, COLUMNS)
+        ops.append(_label(barcode, START_LEFT + col * (BOX_WIDTH + VERT_GAP),
+                          START_UPPER + row * (HORIZ_GAP + BOX_HEIGHT)))
+    return '\n'.join(ops)
+
+
+def _compressed_page(barcodes):
+    """Compressed content stream of a page, made in a worker process"""
+    return compress_page(_page(barcodes))
+
+
+def build_barcodes_pdf(barcodes, workers=1):
+    """Lays out barcode labels, 36 a page, as a PDF
+
+    Parameters
+    ----------
+    barcodes : list of str
+        The barcodes, printed in order
+    workers : int, optional
+        Number of processes pages are made in. Default 1, make them in this
+        process. Only use more from the command line: forking from the
+        threads of the web server copies their open database connections
+
+    Returns
+    -------
+    str
+        The PDF document
+
+    Notes
+    -----
+    Bars are drawn as filled rectangles and barcodes as text, so pages are
+    vector graphics printed sharp at any resolution. Pages do not depend on
+    each other, so with more than one worker each is laid out and compressed
+    in a worker process, and the document is assembled from the compressed
+    pages in order as they come back.
+    """
+    scale = 72. / DPI
+    doc = PDFDocument(PAGE_WIDTH * scale, PAGE_HEIGHT * scale)
+    pages = [barcodes[start:start + LABELS_PER_PAGE]
+             for start in range(0, len(barcodes), LABELS_PER_PAGE)]
+    workers = min(workers, len(pages))
+    if workers > 1:
+        pool = Pool(workers)
+        try:
+            for stream in pool.imap(_compressed_page, pages,
+                                    max(1, len(pages) // (4 * workers))):
+                doc.add_page(stream, compressed=True)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        for page in pages:
+            doc.add_page(_page(page))
+    return doc.tostring()
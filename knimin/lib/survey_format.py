@@ -0,0 +1,559 @@
+"""Formatting of human survey answers for the metadata pulldown
+
+Two ways of formatting the same thing: `format_human_barcode` works on one
+barcode's answers at a time, `format_human_frame` on all of them at once with
+pandas. The frame only formats barcodes it knows `format_human_barcode` would
+format without errors, and leaves the rest for it, so both give the same
+metadata and errors.
+"""
+from __future__ import unicode_literals
+from datetime import datetime, date, time
+from hashlib import sha512
+from itertools import compress, izip
+from operator import itemgetter
+from re import sub
+
+import numpy as np
+import pandas as pd
+
+from knimin.lib.constants import (md_lookup, month_int_lookup,
+                                  month_str_lookup, regions_by_state,
+                                  season_lookup)
+from knimin.lib.util import (categorize_age, categorize_etoh, categorize_bmi,
+                             correct_age, correct_bmi)
+
+_crohns = {"Ileal Crohn's Disease", "Colonic Crohn's Disease",
+           "Ileal and Colonic Crohn's Disease"}
+
+# answers format_human_barcode needs, failing with KeyError without them
+_answers = ['HEIGHT_CM', 'WEIGHT_KG', 'HEIGHT_UNITS', 'WEIGHT_UNITS',
+            'BIRTH_MONTH', 'BIRTH_YEAR', 'GENDER', 'ZIP_CODE',
+            'ALCOHOL_FREQUENCY', 'DIABETES', 'IBD', 'ANTIBIOTIC_HISTORY']
+_details = ['site_sampled', 'country', 'survey_id', 'sample_date',
+            'sample_time', 'participant_name', 'ag_login_id']
+# rows and details from the database have str keys, looking them up with
+# unicode ones means decoding on every comparison
+_answer_keys = frozenset(str(k) for k in _answers)
+_detail_keys = frozenset(str(k) for k in _details)
+_get_answers = itemgetter(*[str(k) for k in _answers])
+_get_details = itemgetter(*[str(k) for k in _details])
+_ibd_key = str('IBD_DIAGNOSIS_REFINED')
+_text_types = frozenset([str, unicode])
+_missing = object()
+
+# columns format_human_barcode sets the same for every barcode
+_invariant = {'HEIGHT_UNITS': 'centimeters', 'WEIGHT_UNITS': 'kilograms',
+              'HOST_TAXID': 9606, 'SCIENTIFIC_NAME': 'Homo sapiens',
+              'TITLE': 'American Gut Project', 'ASSIGNED_FROM_GEO': 'Yes',
+              'ENV_BIOME': 'dense settlement biome',
+              'ENV_FEATURE': 'human-associated habitat',
+              'DNA_EXTRACTED': 'Yes', 'PHYSICAL_SPECIMEN_REMAINING': 'Yes',
+              'PHYSICAL_SPECIMEN_LOCATION': 'UCSDMI',
+              'HOST_COMMON_NAME': 'human'}
+
+
+def _months_between_dates(d1, d2):
+    """Calculate the number of months between two dates
+
+    Parameters
+    ----------
+    d1 : datetime
+        First date
+    d2 : datetime
+        Second date
+
+    Raises
+    ------
+    ValueError
+        if the first date is greater than the second date
+
+    Notes
+    -----
+    - Assumes the first date d1 is not greater than the second date d2
+    - Ignores the day (uses only year and month)
+    """
+    if d1 > d2:
+        raise ValueError("First date must not be greater than the second")
+
+    # Calculate the number of 12-month periods between the years
+    return (d2.year - d1.year) * 12 + (d2.month - d1.month)
+
+
+def format_human_barcode(barcode, row, bc_info, dupes_lookup, geocode,
+                         now=None):
+    """Formats the human survey answers for one barcode, in place
+
+    Parameters
+    ----------
+    barcode : str
+        The barcode
+    row : dict
+        The barcode's survey answers, {shortname: response, ...}
+    bc_info : dict
+        The barcode's sample, kit and login details
+    dupes_lookup : dict
+        Participant names for duplicate consents, keyed by survey ID
+    geocode : callable
+        Called as geocode(row, zipcode, country) to add the location columns
+    now : datetime, optional
+        Date ages are calculated at. Default now
+
+    Raises
+    ------
+    Exception
+        Any error formatting the answers
+    """
+    _convert_measurements(row)
+    row['AGE_YEARS'] = _age_years(row, now)
+
+    # GENDER to SEX
+    sex = row['GENDER']
+    row['SEX'] = sex.lower() if sex is not None else 'Unspecified'
+
+    _add_sample_info(barcode, row, bc_info, dupes_lookup, geocode)
+    _add_categories(row, bc_info)
+
+    # make sure conversions are done
+    if row['WEIGHT_KG'] != 'Unspecified':
+        row['WEIGHT_KG'] = int(row['WEIGHT_KG'])
+    if row['HEIGHT_CM'] != 'Unspecified':
+        row['HEIGHT_CM'] = int(row['HEIGHT_CM'])
+    if row['BMI'] != 'Unspecified':
+        row['BMI'] = '%.2f' % row['BMI']
+
+
+def _convert_measurements(row):
+    """Converts height and weight to centimeters and kilograms, adds BMI"""
+    # convert numeric fields
+    for field in ('HEIGHT_CM', 'WEIGHT_KG'):
+        row[field] = sub('[^0-9.]', '', row[field])
+        if row[field]:
+            row[field] = float(row[field])
+        else:
+            row[field] = 'Unspecified'
+
+    # Correct height units
+    if row['HEIGHT_UNITS'] == 'inches' and \
+            isinstance(row['HEIGHT_CM'], float):
+        row['HEIGHT_CM'] = 2.54*row['HEIGHT_CM']
+    row['HEIGHT_UNITS'] = 'centimeters'
+
+    # Correct weight units
+    if row['WEIGHT_UNITS'] == 'pounds' and \
+            isinstance(row['WEIGHT_KG'], float):
+        row['WEIGHT_KG'] = row['WEIGHT_KG']/2.20462
+    row['WEIGHT_UNITS'] = 'kilograms'
+
+    if all([isinstance(row['WEIGHT_KG'], float),
+            row['WEIGHT_KG'] != 0.0,
+            isinstance(row['HEIGHT_CM'], float),
+            row['HEIGHT_CM'] != 0.0]):
+        row['BMI'] = row['WEIGHT_KG'] / (row['HEIGHT_CM']/100)**2
+    else:
+        row['BMI'] = 'Unspecified'
+
+
+def _age_years(row, now=None):
+    """Age in years (int) from the birth month and year, at now"""
+    if row['BIRTH_MONTH'] == 'Unspecified' or \
+            row['BIRTH_YEAR'] == 'Unspecified':
+        return 'Unspecified'
+    birthdate = datetime(int(row['BIRTH_YEAR']),
+                         int(month_int_lookup[row['BIRTH_MONTH']]), 1)
+    if now is None:
+        now = datetime.now()
+    return int(_months_between_dates(birthdate, now) / 12.0)
+
+
+def _add_sample_info(barcode, row, bc_info, dupes_lookup, geocode):
+    """Adds the invariant, location, sample and participant columns"""
+    row['ANONYMIZED_NAME'] = barcode
+    row.update(_invariant)
+
+    # Sample-dependent information
+    geocode(row, row['ZIP_CODE'].upper(), bc_info['country'])
+
+    row['SURVEY_ID'] = bc_info['survey_id']
+    row.update(md_lookup[bc_info['site_sampled']])
+    row['COLLECTION_DATE'] = bc_info['sample_date'].strftime('%m/%d/%Y')
+
+    if bc_info['sample_time']:
+        row['COLLECTION_TIME'] = bc_info['sample_time'].strftime('%H:%M')
+    else:
+        # If no time data, show unspecified and default to midnight
+        row['COLLECTION_TIME'] = 'Unspecified'
+        bc_info['sample_time'] = time(0, 0)
+
+    row['COLLECTION_TIMESTAMP'] = datetime.combine(
+        bc_info['sample_date'],
+        bc_info['sample_time']).strftime('%m/%d/%Y %H:%M')
+
+    participant_name = dupes_lookup.get(
+        row['SURVEY_ID'], bc_info['participant_name']).lower()
+
+    row['HOST_SUBJECT_ID'] = sha512(
+        bc_info['ag_login_id'] + participant_name).hexdigest()
+    row['PUBLIC'] = 'Yes'
+
+    # Convert finer grained IBD to coarser grained
+    ibd = row.get('IBD_DIAGNOSIS_REFINED', 'Unspecified')
+    if ibd in _crohns:
+        row['IBD_DIAGNOSIS'] = "Crohn's disease"
+    elif ibd == 'Ulcerative colitis':
+        row['IBD_DIAGNOSIS'] = 'Ulcerative colitis'
+
+
+def _add_categories(row, bc_info):
+    """Adds the categorization, region and subset columns"""
+    row['ALCOHOL_CONSUMPTION'] = categorize_etoh(row['ALCOHOL_FREQUENCY'])
+    row['BMI_CAT'] = categorize_bmi(row['BMI'])
+    row['BMI_CORRECTED'] = correct_bmi(row['BMI'])
+    row['COLLECTION_SEASON'] = season_lookup[bc_info['sample_date'].month]
+    state = row['STATE']
+    try:
+        row['CENSUS_REGION'] = regions_by_state[state]['Census_1']
+        row['ECONOMIC_REGION'] = regions_by_state[state]['Economic']
+    except KeyError:
+        row['CENSUS_REGION'] = 'Unspecified'
+        row['ECONOMIC_REGION'] = 'Unspecified'
+    row['SUBSET_AGE'] = 19 < row['AGE_YEARS'] < 70 and \
+        not row['AGE_YEARS'] == 'Unspecified'
+    row['SUBSET_DIABETES'] = \
+        row['DIABETES'] == 'I do not have this condition'
+    row['SUBSET_IBD'] = row['IBD'] == 'I do not have this condition'
+    row['SUBSET_ANTIBIOTIC_HISTORY'] = \
+        (row['ANTIBIOTIC_HISTORY'] ==
+         'I have not taken antibiotics in the past year.')
+    row['SUBSET_BMI'] = 18.5 <= row['BMI'] < 30 and \
+        not row['BMI'] == 'Unspecified'
+    row['SUBSET_HEALTHY'] = all([row['SUBSET_AGE'],
+                                 row['SUBSET_DIABETES'],
+                                 row['SUBSET_IBD'],
+                                 row['SUBSET_ANTIBIOTIC_HISTORY'],
+                                 row['SUBSET_BMI']])
+    row['COLLECTION_MONTH'] = month_str_lookup.get(
+        bc_info['sample_date'].month, 'Unspecified')
+    row['AGE_CORRECTED'] = correct_age(
+        row['AGE_YEARS'], row['HEIGHT_CM'], row['WEIGHT_KG'],
+        row['ALCOHOL_CONSUMPTION'])
+    row['AGE_CAT'] = categorize_age(row['AGE_CORRECTED'])
+
+
+def _is_text(values):
+    """Bool array of whether each value is str or unicode"""
+    if set(map(type, values)) <= _text_types:
+        return np.ones(len(values), dtype=bool)
+    return np.array([isinstance(v, basestring) for v in values], dtype=bool)
+
+
+def _pick(getter, keys, records):
+    """getter(record) for each record, None for records missing keys"""
+    try:
+        return map(getter, records)
+    except KeyError:
+        return [getter(r) if r.viewkeys() >= keys else None
+                for r in records]
+
+
+def _measure(series):
+    """Numeric value of height or weight answers
+
+    Returns
+    -------
+    values : np.array of float
+        The value, NaN if unspecified
+    ok : np.array of bool
+        Whether float() can convert the answer without error
+    """
+    text = _is_text(series.values)
+    cleaned = series.where(text, '').str.replace('[^0-9.]', '')
+    empty = (cleaned == '').values
+    try:
+        values = cleaned.where(~empty).astype(float)
+        number = ~empty
+    except ValueError:
+        # some answers are only dots, find which
+        number = cleaned.str.match(r'(\d+\.?\d*|\.\d+)$').values.astype(bool)
+        values = cleaned.where(number).astype(float)
+    return values.values, text & (number | empty)
+
+
+def _bins(values, edges, labels):
+    """Labels values by the bins from categorize_age and categorize_bmi
+
+    Values below the first edge or from the last edge on, and NaN, are
+    Unspecified
+    """
+    with np.errstate(invalid='ignore'):
+        conds = [values < edges[0]]
+        conds.extend((values >= lo) & (values < hi)
+                     for lo, hi in zip(edges[:-1], edges[1:]))
+    return np.select(conds, ['Unspecified'] + labels,
+                     'Unspecified').tolist()
+
+
+def _host_subject_id(login, participant_name, survey_id, dupes_lookup):
+    try:
+        name = dupes_lookup.get(survey_id, participant_name).lower()
+        return sha512(login + name).hexdigest()
+    except Exception:
+        return None
+
+
+def _distinct(func, values):
+    """func(value) for each of the values, called once per distinct value"""
+    results = {v: func(v) for v in set(values)}
+    return [results[v] for v in values]
+
+
+def _ibd_diagnosis(value):
+    try:
+        if value != 'Unspecified':
+            if value in _crohns:
+                return "Crohn's disease"
+            elif value == 'Ulcerative colitis':
+                return 'Ulcerative colitis'
+    except Exception:
+        return _missing
+    return None
+
+
+def format_human_frame(rows, barcode_info, zip_lookup, country_lookup,
+                       dupes_lookup, now=None):
+    """Formats the human survey answers for many barcodes at once, in place
+
+    Parameters
+    ----------
+    rows : dict of dict
+        {barcode: {shortname: response, ...}, ...}
+    barcode_info : dict of dict
+        Sample, kit and login details, keyed by barcode without appended info
+    zip_lookup : dict of dict
+        {zipcode: {country: (latitude, longitude, elevation, state)}}
+    country_lookup : dict
+        EBI country names, keyed by country
+    dupes_lookup : dict
+        Participant names for duplicate consents, keyed by survey ID
+    now : datetime, optional
+        Date ages are calculated at. Default now
+
+    Returns
+    -------
+    list of str
+        Barcodes left unformatted, in the order of `rows`, for
+        `format_human_barcode` to format. These are the barcodes that need
+        geocoding or would fail formatting
+
+    Notes
+    -----
+    Formatted barcodes get the same columns and values as with
+    `format_human_barcode`. The columns are worked out for all barcodes at
+    once, and only written to the barcodes at the end.
+    """
+    if now is None:
+        now = datetime.now()
+    # barcodes without all the answers and details needed fail formatting
+    barcodes = list(rows)
+    records = [rows[b] for b in barcodes]
+    answers = _pick(_get_answers, _answer_keys, records)
+    details = _pick(_get_details, _detail_keys,
+                    [barcode_info.get(b[:9], {}) for b in barcodes])
+    found = [a is not None and d is not None
+             for a, d in izip(answers, details)]
+    if not any(found):
+        return barcodes
+    if not all(found):
+        barcodes = list(compress(barcodes, found))
+        records = list(compress(records, found))
+        answers = list(compress(answers, found))
+        details = list(compress(details, found))
+    answers = pd.DataFrame(dict(zip(_answers, zip(*answers))), dtype=object)
+    details = pd.DataFrame(dict(zip(_details, zip(*details))), dtype=object)
+
+    # height, weight and BMI
+    height, ok = _measure(answers['HEIGHT_CM'])
+    weight, good = _measure(answers['WEIGHT_KG'])
+    ok &= good
+    height = np.where((answers['HEIGHT_UNITS'] == 'inches').values,
+                      2.54 * height, height)
+    weight = np.where((answers['WEIGHT_UNITS'] == 'pounds').values,
+                      weight / 2.20462, weight)
+    has_bmi = ~np.isnan(height) & ~np.isnan(weight) & (height != 0) & \
+        (weight != 0)
+    with np.errstate(all='ignore'):
+        square = (height / 100) ** 2
+        bmi = np.where(has_bmi, weight / square, np.nan)
+    # python raises on overflow and division by zero, leave those to it
+    ok &= ~np.isinf(height) & ~np.isinf(weight)
+    ok &= ~has_bmi | (np.isfinite(square) & (square != 0) & np.isfinite(bmi))
+
+    # age
+    month = answers['BIRTH_MONTH']
+    year = answers['BIRTH_YEAR']
+    no_age = ((month == 'Unspecified') | (year == 'Unspecified')).values
+    month_num = month.where(_is_text(month.values)).map(
+        month_int_lookup).values.astype(float)
+    year_num = year.where(_is_text(year.values), '').str.match(
+        r'\d{1,4}$').values.astype(bool)
+    year_num = year.where(year_num).values.astype(float)
+    months = (now.year - year_num) * 12 + (now.month - month_num)
+    with np.errstate(invalid='ignore'):
+        has_age = ~no_age & (months >= 0) & (year_num >= 1)
+    ok &= no_age | has_age
+    age = np.where(has_age, months / 12.0, np.nan)
+
+    gender = answers['GENDER'].values
+    ok &= _is_text(gender) | np.array([g is None for g in gender],
+                                      dtype=bool)
+
+    # location, anything not already geocoded is left for geocoding
+    zipcode = answers['ZIP_CODE'].values
+    ok &= _is_text(zipcode)
+    geo = [zip_lookup.get(z.upper(), {}).get(c) if good else None
+           for z, c, good in izip(zipcode, details['country'].values, ok)]
+    ok &= np.array([g is not None and isinstance(g[3], basestring)
+                    for g in geo], dtype=bool)
+    ebi_country = details['country'].map(
+        lambda c: country_lookup.get(c, _missing)).values
+    ok &= _is_text(ebi_country)
+
+    site = details['site_sampled'].values
+    ok &= _is_text(site) & details['site_sampled'].isin(md_lookup).values
+    sample_date = details['sample_date'].values
+    ok &= np.array([isinstance(d, date) and d.year >= 1900
+                    for d in sample_date], dtype=bool)
+    sample_time = details['sample_time'].values
+    ok &= np.array([t is None or isinstance(t, time) for t in sample_time],
+                   dtype=bool)
+
+    etoh = answers['ALCOHOL_FREQUENCY'].values
+    ok &= np.array([isinstance(v, str) or v == 'Never' or v == 'Unspecified'
+                    for v in etoh], dtype=bool)
+
+    ibd = [_ibd_diagnosis(r.get(_ibd_key, 'Unspecified')) for r in records]
+    ok &= np.array([i is not _missing for i in ibd], dtype=bool)
+    host_ids = [_host_subject_id(login, name, survey, dupes_lookup)
+                if good else None for login, name, survey, good in izip(
+                    details['ag_login_id'].values,
+                    details['participant_name'].values,
+                    details['survey_id'].values, ok)]
+    ok &= np.array([h is not None for h in host_ids], dtype=bool)
+
+    if not ok.any():
+        return list(rows)
+
+    # only the barcodes formatting can be done for from here on
+    def kept(values):
+        return list(compress(values, ok))
+
+    barcodes = kept(barcodes)
+    records = kept(records)
+    height = height[ok]
+    weight = weight[ok]
+    bmi = bmi[ok]
+    years = np.trunc(age[ok])
+    geo = kept(geo)
+    state = [g[3] for g in geo]
+    country = ebi_country[ok].tolist()
+    sample_date = sample_date[ok]
+    sample_time = sample_time[ok]
+    etoh = etoh[ok]
+
+    alcohol = np.select([etoh == 'Never', etoh == 'Unspecified'],
+                        ['No', 'Unspecified'], 'Yes')
+
+    with np.errstate(invalid='ignore'):
+        subset_age = (years > 19) & (years < 70)
+        subset_bmi = (bmi >= 18.5) & (bmi < 30)
+    subset_diabetes = answers['DIABETES'].values[ok] == \
+        'I do not have this condition'
+    subset_ibd = answers['IBD'].values[ok] == 'I do not have this condition'
+    subset_antibiotic = answers['ANTIBIOTIC_HISTORY'].values[ok] == \
+        'I have not taken antibiotics in the past year.'
+    subset_healthy = subset_age & subset_diabetes & subset_ibd & \
+        subset_antibiotic & subset_bmi
+
+    # AGE_CORRECTED is the age in years as a float, with babies checked
+    # against height, weight and alcohol like correct_age does
+    with np.errstate(invalid='ignore'):
+        known = ~np.isnan(years) & ~np.isnan(height) & \
+            ~np.isnan(weight) & (alcohol != 'Unspecified')
+        adult = (years >= 3) & (years < 123)
+        baby = (years >= 0) & (years < 3) & ~(height > 91.4) & \
+            ~(weight > 16.3) & (alcohol == 'Never')
+    corrected = np.where(known & (adult | baby), years, np.nan)
+
+    # samples share dates and times, so format each of them once
+    collection_date, season, month_name = zip(*_distinct(
+        lambda d: (d.strftime('%m/%d/%Y'), season_lookup[d.month],
+                   month_str_lookup.get(d.month, 'Unspecified')),
+        sample_date))
+    clock = _distinct(lambda t: t.strftime('%H:%M') if t else None,
+                      sample_time)
+    regions = _distinct(lambda s: regions_by_state.get(
+        s, {'Census_1': 'Unspecified', 'Economic': 'Unspecified'}), state)
+    latitude, longitude, elevation = zip(*geo)[:3]
+
+    # columns in the order format_human_barcode sets them, the sample site
+    # ones are set in between and overwrite some of the invariant ones
+    first_keys, first_values = zip(*[
+        ('HEIGHT_CM', [int(h) if h == h else 'Unspecified'
+                       for h in height.tolist()]),
+        ('WEIGHT_KG', [int(w) if w == w else 'Unspecified'
+                       for w in weight.tolist()]),
+        ('BMI', ['%.2f' % b if b == b else 'Unspecified'
+                 for b in bmi.tolist()]),
+        ('AGE_YEARS', [int(y) if y == y else 'Unspecified'
+                       for y in years.tolist()]),
+        ('SEX', [g.lower() if g is not None else 'Unspecified'
+                 for g in gender[ok]]),
+        ('ANONYMIZED_NAME', barcodes),
+        ('LATITUDE', latitude),
+        ('LONGITUDE', longitude),
+        ('ELEVATION', elevation),
+        ('STATE', state),
+        ('COUNTRY', country),
+        ('GEO_LOC_NAME', [':'.join([c, s]) for c, s in zip(country, state)]),
+        ('SURVEY_ID', details['survey_id'].values[ok])])
+    last_keys, last_values = zip(*[
+        ('COLLECTION_DATE', collection_date),
+        ('COLLECTION_TIME', [c or 'Unspecified' for c in clock]),
+        ('COLLECTION_TIMESTAMP', ['%s %s' % (d, c or '00:00')
+                                  for d, c in zip(collection_date, clock)]),
+        ('HOST_SUBJECT_ID', kept(host_ids)),
+        ('ALCOHOL_CONSUMPTION', alcohol.tolist()),
+        ('BMI_CAT', _bins(bmi, [8, 18.5, 25, 30, 80],
+                          ['Underweight', 'Normal', 'Overweight', 'Obese'])),
+        ('BMI_CORRECTED', ['%.2f' % b if 8 <= b < 80 else 'Unspecified'
+                           for b in bmi.tolist()]),
+        ('COLLECTION_SEASON', season),
+        ('CENSUS_REGION', [r['Census_1'] for r in regions]),
+        ('ECONOMIC_REGION', [r['Economic'] for r in regions]),
+        ('SUBSET_AGE', subset_age.tolist()),
+        ('SUBSET_DIABETES', subset_diabetes.tolist()),
+        ('SUBSET_IBD', subset_ibd.tolist()),
+        ('SUBSET_ANTIBIOTIC_HISTORY', subset_antibiotic.tolist()),
+        ('SUBSET_BMI', subset_bmi.tolist()),
+        ('SUBSET_HEALTHY', subset_healthy.tolist()),
+        ('COLLECTION_MONTH', month_name),
+        ('AGE_CORRECTED', [y if y == y else 'Unspecified'
+                           for y in corrected.tolist()]),
+        ('AGE_CAT', _bins(corrected, [0, 3, 13, 20, 30, 40, 50, 60, 70, 123],
+                          ['baby', 'child', 'teen', '20s', '30s', '40s',
+                           '50s', '60s', '70+']))])
+
+    site = site[ok]
+    site_columns = {}
+    for name in set(site):
+        site_columns[name] = dict(md_lookup[name], PUBLIC='Yes')
+    for row, first, name, last, diagnosis in izip(
+            records, izip(*first_values), site, izip(*last_values),
+            kept(ibd)):
+        row.update(_invariant)
+        row.update(izip(first_keys, first))
+        row.update(site_columns[name])
+        row.update(izip(last_keys, last))
+        if diagnosis is not None:
+            row['IBD_DIAGNOSIS'] = diagnosis
+    formatted = set(barcodes)
+    return [b for b in rows if b not in formatted]
@@ -0,0 +1,70 @@
+from unittest import main
+from threading import current_thread
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from knimin.lib.async_access import AsyncKniminAccess
+
+
+class FakeAccess(object):
+    sites = ['Stool', 'Mouth']
+
+    def get_thread(self):
+        return current_thread().name
+
+    def add(self, a, b=0):
+        return a + b
+
+    def fail(self):
+        raise ValueError('Failed on purpose')
+
+    def _private(self):
+        pass
+
+
+class TestAsyncKniminAccess(AsyncTestCase):
+    def setUp(self):
+        super(TestAsyncKniminAccess, self).setUp()
+        self.async_db = AsyncKniminAccess(FakeAccess(), 2)
+
+    def tearDown(self):
+        self.async_db.shutdown()
+        super(TestAsyncKniminAccess, self).tearDown()
+
+    @gen_test
+    def test_method(self):
+        obs = yield self.async_db.add(1, b=2)
+        self.assertEqual(obs, 3)
+
+    @gen_test
+    def test_method_off_ioloop_thread(self):
+        obs = yield self.async_db.get_thread()
+        self.assertNotEqual(obs, current_thread().name)
+
+    @gen_test
+    def test_method_error(self):
+        with self.assertRaises(ValueError):
+            yield self.async_db.fail()
+
+    @gen_test
+    def test_multiple_methods(self):
+        obs = yield [self.async_db.add(1), self.async_db.add(2, 3)]
+        self.assertEqual(obs, [1, 5])
+
+    @gen_test
+    def test_run(self):
+        obs = yield self.async_db.run(sorted, [3, 1, 2])
+        self.assertEqual(obs, [1, 2, 3])
+
+    def test_attribute(self):
+        self.assertEqual(self.async_db.sites, ['Stool', 'Mouth'])
+
+    def test_private(self):
+        with self.assertRaises(AttributeError):
+            self.async_db._private
+        with self.assertRaises(AttributeError):
+            self.async_db.does_not_exist
+
+
+if __name__ == '__main__':
+    main()
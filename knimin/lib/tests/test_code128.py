@@ -2,7 +2,7 @@ from unittest import TestCase, main
 from os.path import join, dirname, realpath
 
 import knimin.lib
-from knimin.lib.code128 import code128_format, code128_image
+from knimin.lib.code128 import code128_format, code128_image, code128_widths
 
 
 class Code128Tests(TestCase):
@@ -47,6 +47,12 @@ class Code128Tests(TestCase):
         self.assertEqual(im.height, 100)
         self.assertEqual(im.width, 203)
 
+    def test_code128_widths(self):
+        # start C, 00, 00, 01, 23, code B, 4, checksum and stop
+        widths = code128_widths('000001234', 2)
+        self.assertEqual(widths[:6], [4, 2, 2, 4, 6, 4])
+        self.assertEqual(sum(widths), 2 * (11 * 8 + 13))
+
 
 if __name__ == '__main__':
     main()
@@ -26,6 +26,18 @@ class ConfigurationTests(TestCase):
         config = KniminConfig(self.config_fp)
         self.assertTrue(config.debug)
         self.assertEqual(config.base_data_dir, '/some/dir/path')
+        self.assertEqual(config.print_workers, 1)
+        self.assertEqual(config.hash_workers, 1)
+
+        self.config.seek(0)
+        self.config.truncate()
+        self.config.write(test_config.replace(
+            'BASE_LOG_DIR = /tmp\n',
+            'BASE_LOG_DIR = /tmp\nprint_workers = 4\nhash_workers = 3\n'))
+        self.config.flush()
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.print_workers, 4)
+        self.assertEqual(config.hash_workers, 3)
 
     def test_get_postgres(self):
         config = KniminConfig(self.config_fp)
@@ -34,6 +46,56 @@ class ConfigurationTests(TestCase):
         self.assertEqual(config.db_database, 'knimin')
         self.assertEqual(config.db_host, 'localhost')
         self.assertEqual(config.db_port, 5432)
+        self.assertEqual(config.db_pool_min, 1)
+        self.assertEqual(config.db_pool_max, 4)
+        self.assertEqual(config.db_pool_timeout, 30.0)
+
+    def test_get_postgres_pool(self):
+        self.config.seek(0)
+        self.config.truncate()
+        self.config.write(test_config.replace(
+            'port = 5432\n',
+            'port = 5432\npool_min = 2\npool_max = 8\npool_timeout = 2.5\n'))
+        self.config.flush()
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.db_pool_min, 2)
+        self.assertEqual(config.db_pool_max, 8)
+        self.assertEqual(config.db_pool_timeout, 2.5)
+
+    def test_get_geocoding(self):
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.geocoding_url, 'https://maps.googleapis.com')
+        self.assertEqual(config.geocoding_rate, 50.0)
+        self.assertEqual(config.geocoding_workers, 8)
+        self.assertEqual(config.geocoding_elevation_batch, 50)
+        self.assertEqual(config.geocoding_cache_fp, None)
+        self.assertEqual(config.geocoding_cache_size, 100000)
+        self.assertEqual(config.geocoding_negative_ttl, 30.0)
+        self.assertEqual(config.geocoding_gazetteer_fp, None)
+        self.assertEqual(config.geocoding_gazetteer_countries_fp, None)
+        self.assertEqual(config.geocoding_dem_dir, None)
+
+        self.config.seek(0)
+        self.config.truncate()
+        self.config.write(test_config + '\n[geocoding]\nurl = http://local\n'
+                          'rate = 20\nworkers = 4\nelevation_batch = 10\n'
+                          'cache_fp = /tmp/cache.db\ncache_size = 10\n'
+                          'negative_ttl = 1.5\ngazetteer_fp = /tmp/zip.txt\n'
+                          'gazetteer_countries_fp = /tmp/countries.txt\n'
+                          'dem_dir = /tmp/srtm\n')
+        self.config.flush()
+        config = KniminConfig(self.config_fp)
+        self.assertEqual(config.geocoding_url, 'http://local')
+        self.assertEqual(config.geocoding_rate, 20.0)
+        self.assertEqual(config.geocoding_workers, 4)
+        self.assertEqual(config.geocoding_elevation_batch, 10)
+        self.assertEqual(config.geocoding_cache_fp, '/tmp/cache.db')
+        self.assertEqual(config.geocoding_cache_size, 10)
+        self.assertEqual(config.geocoding_negative_ttl, 1.5)
+        self.assertEqual(config.geocoding_gazetteer_fp, '/tmp/zip.txt')
+        self.assertEqual(config.geocoding_gazetteer_countries_fp,
+                         '/tmp/countries.txt')
+        self.assertEqual(config.geocoding_dem_dir, '/tmp/srtm')
 
     def test_get_tornado(self):
         config = KniminConfig(self.config_fp)
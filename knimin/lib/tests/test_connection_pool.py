@@ -0,0 +1,122 @@
+from unittest import TestCase, main
+from threading import Thread
+
+from mock import Mock, MagicMock
+from psycopg2 import OperationalError
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_INTRANS)
+
+from knimin.lib.connection_pool import ConnectionPool, PoolExhaustedError
+
+
+def _make_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    conn.get_transaction_status.return_value = TRANSACTION_STATUS_IDLE
+    return conn
+
+
+class TestConnectionPool(TestCase):
+    def setUp(self):
+        self.connect = Mock(side_effect=_make_connection)
+
+    def test_init(self):
+        pool = ConnectionPool(self.connect, 2, 4)
+        self.assertEqual(self.connect.call_count, 2)
+        obs = pool.stats()
+        self.assertEqual(obs['open'], 2)
+        self.assertEqual(obs['idle'], 2)
+        self.assertEqual(obs['in_use'], 0)
+
+    def test_init_bad_size(self):
+        with self.assertRaises(ValueError):
+            ConnectionPool(self.connect, 3, 2)
+        with self.assertRaises(ValueError):
+            ConnectionPool(self.connect, 0, 0)
+
+    def test_reuse_connection(self):
+        pool = ConnectionPool(self.connect, 1, 2)
+        with pool.connection() as conn:
+            pass
+        with pool.connection() as conn2:
+            pass
+        self.assertIs(conn, conn2)
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(pool.stats()['checkouts'], 2)
+
+    def test_grows_to_max(self):
+        pool = ConnectionPool(self.connect, 1, 2, timeout=0.01)
+        conn1 = pool.getconn()
+        conn2 = pool.getconn()
+        self.assertIsNot(conn1, conn2)
+        self.assertEqual(pool.stats()['in_use'], 2)
+
+        with self.assertRaises(PoolExhaustedError):
+            pool.getconn()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+        pool.putconn(conn1)
+        self.assertIs(pool.getconn(), conn1)
+
+    def test_waits_for_connection(self):
+        pool = ConnectionPool(self.connect, 1, 1, timeout=5)
+        conn = pool.getconn()
+        obs = []
+        waiter = Thread(target=lambda: obs.append(pool.getconn()))
+        waiter.start()
+        pool.putconn(conn)
+        waiter.join()
+        self.assertEqual(obs, [conn])
+
+    def test_discards_closed_connection(self):
+        pool = ConnectionPool(self.connect, 1, 1)
+        with pool.connection() as conn:
+            conn.closed = 2
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+        with pool.connection() as conn2:
+            pass
+        self.assertIsNot(conn, conn2)
+        self.assertEqual(self.connect.call_count, 2)
+
+    def test_rollback_open_transaction(self):
+        pool = ConnectionPool(self.connect, 1, 1)
+        with pool.connection() as conn:
+            conn.get_transaction_status.return_value = \
+                TRANSACTION_STATUS_INTRANS
+        conn.rollback.assert_called_once_with()
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_health_check(self):
+        pool = ConnectionPool(self.connect, 1, 1, check_after=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        # ping fails, so the connection is replaced by a new one
+        conn.cursor.side_effect = OperationalError('server closed')
+        conn2 = pool.getconn()
+        self.assertIsNot(conn, conn2)
+        obs = pool.stats()
+        self.assertEqual(obs['failed_checks'], 1)
+        self.assertEqual(obs['in_use'], 1)
+
+    def test_connect_failure_frees_slot(self):
+        pool = ConnectionPool(self.connect, 0, 1, timeout=0.01)
+        self.connect.side_effect = OperationalError('no server')
+        with self.assertRaises(OperationalError):
+            pool.getconn()
+        self.connect.side_effect = _make_connection
+        self.assertEqual(pool.getconn().closed, 0)
+
+    def test_closeall(self):
+        pool = ConnectionPool(self.connect, 2, 2)
+        conns = [pool.getconn(), pool.getconn()]
+        for conn in conns:
+            pool.putconn(conn)
+        pool.closeall()
+        for conn in conns:
+            conn.close.assert_called_once_with()
+        self.assertEqual(pool.stats()['open'], 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,20 @@
 from unittest import TestCase, main
 from os.path import join, dirname, realpath
+from shutil import rmtree
+from tempfile import mkdtemp
 from six import StringIO
+from random import seed
+from copy import copy
+from threading import Thread
 import datetime
 
 import pandas as pd
+from mock import Mock, patch
 
 from knimin import db
+from knimin.lib.data_access import KniminAccess, SQLHandler
 from knimin.lib.constants import ebi_remove
+from knimin.lib.gazetteer import Gazetteer
 
 
 class TestDataAccess(TestCase):
@@ -88,6 +96,149 @@ class TestDataAccess(TestCase):
         self.assertTrue('VIOSCREEN' in survey)
         self.assertTrue('BLANK.01' in survey)
 
+    def test_pulldown_iter(self):
+        barcodes = ['000029429', '000018046', '000023299', '000023300',
+                    '000001124', '0000000']
+        exp, exp_fail = db.pulldown(list(barcodes), blanks=['BLANK.01'])
+        # small chunks must give the same files as a single pass
+        surveys, fail = db.pulldown_iter(list(barcodes), blanks=['BLANK.01'],
+                                         chunk_size=1, block_size=10)
+        obs = {}
+        for survey, blocks in surveys:
+            blocks = list(blocks)
+            self.assertTrue(all(len(b) <= 10 for b in blocks))
+            obs[survey] = b''.join(blocks)
+        self.assertEqual(obs, exp)
+        self.assertEqual(fail, exp_fail)
+        self.assertEqual(fail['0000000'], 'Not an AG barcode')
+
+    def test_read_spools(self):
+        spools = {2: (StringIO('cdef'), []), 1: (StringIO('ab'), [])}
+        # the blocks of each survey come from its own spool, even when the
+        # next survey is taken before reading them
+        surveys = db._read_spools(spools, 3)
+        first = next(surveys)
+        second = next(surveys)
+        self.assertEqual((first[0], list(first[1])), (1, ['ab']))
+        self.assertEqual((second[0], list(second[1])), (2, ['cde', 'f']))
+        self.assertEqual(list(surveys), [])
+        self.assertTrue(all(spool.closed for spool, _ in spools.values()))
+
+    def test_pulldown_parallel(self):
+        barcodes = ['000029429', '000018046', '000023299', '000023300',
+                    '000001124', '0000000']
+        exp, exp_fail = db.pulldown(list(barcodes), blanks=['BLANK.01'])
+        surveys, fail = db.pulldown_parallel(list(barcodes),
+                                             blanks=['BLANK.01'], workers=3)
+        obs = {survey: b''.join(blocks) for survey, blocks in surveys}
+        self.assertEqual(fail, exp_fail)
+        self.assertEqual(set(obs), set(exp))
+        for survey in exp:
+            exp_lines = exp[survey].decode('utf-8').split('\n')
+            obs_lines = obs[survey].decode('utf-8').split('\n')
+            exp_headers = exp_lines[0].split('\t')
+            obs_headers = obs_lines[0].split('\t')
+            # shards can add columns, all sorted after sample_name
+            self.assertEqual(obs_headers[0], 'sample_name')
+            self.assertEqual(obs_headers[1:], sorted(obs_headers[1:]))
+            self.assertTrue(set(exp_headers).issubset(obs_headers))
+            # same rows in the same order, with the same values
+            self.assertEqual([l.split('\t')[0] for l in obs_lines],
+                             [l.split('\t')[0] for l in exp_lines])
+            for exp_line, obs_line in zip(exp_lines[1:], obs_lines[1:]):
+                exp_row = dict(zip(exp_headers, exp_line.split('\t')))
+                obs_row = dict(zip(obs_headers, obs_line.split('\t')))
+                for header, value in obs_row.items():
+                    self.assertEqual(value, exp_row.get(header, value))
+
+    def test_pulldown_fingerprints(self):
+        obs = db.pulldown_fingerprints(['000029429', '000018046', '0000000'])
+        self.assertEqual(set(obs), {'000029429', '000018046'})
+        self.assertNotEqual(obs['000029429'], obs['000018046'])
+        self.assertEqual(db.pulldown_fingerprints(['000029429']),
+                         {'000029429': obs['000029429']})
+        # appended barcodes depend on the others pulled down with them
+        appended = db.pulldown_fingerprints(['000029429.a', '000029429.b'])
+        self.assertEqual(appended['000029429.a'], appended['000029429.b'])
+        self.assertNotEqual(appended['000029429.a'], obs['000029429'])
+
+    def test_pulldown_incremental(self):
+        barcodes = ['000029429', '000018046', '000023299', '000023300',
+                    '000001124', '0000000']
+        exp, exp_fail = db.pulldown(list(barcodes), blanks=['BLANK.01'])
+        state_dir = mkdtemp()
+        try:
+            # all barcodes pulled down the first time, none the second
+            for _ in range(2):
+                surveys, fail = db.pulldown_incremental(
+                    list(barcodes), state_dir, blanks=['BLANK.01'])
+                obs = {survey: b''.join(blocks) for survey, blocks in surveys}
+                self.assertEqual(obs, exp)
+                self.assertEqual(fail, exp_fail)
+
+            # barcodes no longer asked for are dropped
+            exp, exp_fail = db.pulldown(barcodes[1:])
+            surveys, fail = db.pulldown_incremental(barcodes[1:], state_dir)
+            obs = {survey: b''.join(blocks) for survey, blocks in surveys}
+            self.assertEqual(fail, exp_fail)
+            self.assertEqual(set(obs), set(exp))
+            for survey in exp:
+                self.assertEqual(
+                    [l.split('\t')[0] for l in obs[survey].split('\n')],
+                    [l.split('\t')[0] for l in exp[survey].split('\n')])
+        finally:
+            rmtree(state_dir)
+
+    def test_get_surveys(self):
+        obs = db.get_surveys(['000029429', '000018046', '000023299'])
+        self.assertEqual(set(obs[1]), {'000029429', '000018046', '000023299'})
+        answers = obs[1]['000029429']
+        # SINGLE, MULTIPLE and STRING answers all in one barcode dict
+        self.assertIn('ALCOHOL_FREQUENCY', answers)
+        self.assertIn(answers['ALLERGIC_TO_TREE_NUTS'], ('Yes', 'No'))
+        self.assertIn('ZIP_CODE', answers)
+
+    def test_get_surveys_appended_barcode(self):
+        obs = db.get_surveys(['000029429.a', '000029429.b'])
+        self.assertEqual(set(obs[1]), {'000029429.a', '000029429.b'})
+        self.assertEqual(obs[1]['000029429.a'], obs[1]['000029429.b'])
+
+    def test_execute_iter(self):
+        sql = """SELECT barcode FROM ag.ag_kit_barcodes
+                 WHERE barcode IN %s ORDER BY barcode"""
+        obs = [r[0] for r in db._con.execute_iter(
+            sql, [('000029429', '000018046', '0000000')], itersize=1)]
+        self.assertEqual(obs, ['000018046', '000029429'])
+
+    def test_execute_iter_error(self):
+        with self.assertRaises(ValueError):
+            list(db._con.execute_iter('SELECT * FROM not_a_table'))
+
+    def test_sql_handler_init_failure(self):
+        config = Mock(db_pool_min=2, db_pool_max=1, db_pool_timeout=None)
+        with self.assertRaises(ValueError):
+            SQLHandler(config)
+        # the half made handler is collected without the pool
+        SQLHandler.__new__(SQLHandler).__del__()
+
+    def test_execute_iter_tuples(self):
+        sql = """SELECT barcode, site_sampled FROM ag.ag_kit_barcodes
+                 WHERE barcode IN %s ORDER BY barcode"""
+        obs = list(db._con.execute_iter(
+            sql, [('000029429', '000018046')], tuples=True))
+        self.assertEqual([type(r) for r in obs], [tuple, tuple])
+        self.assertEqual([r[0] for r in obs], ['000018046', '000029429'])
+
+    def test_pulldown_reference_cache(self):
+        barcodes = ['000029429', '000018046']
+        db._refs.invalidate()
+        exp, _ = db.pulldown(list(barcodes))
+        loads = db._refs.stats()['loads']
+        obs, _ = db.pulldown(list(barcodes))
+        # reference tables are not loaded again
+        self.assertEqual(db._refs.stats()['loads'], loads)
+        self.assertEqual(obs, exp)
+
     def test_check_consent(self):
         consent, fail = db.check_consent(['000027561', '000001124', '0000000'])
         self.assertEqual(consent, ['000027561'])
@@ -147,6 +298,100 @@ class TestDataAccess(TestCase):
         obs = db.get_access_levels_user('test')
         self.assertEqual(obs, [])
 
+    def test_has_access(self):
+        self.assertFalse(db.has_access('test', ['Search']))
+        db.alter_access_levels('test', [6])
+        try:
+            # the change is seen right away
+            self.assertTrue(db.has_access('test', ['Search']))
+            self.assertTrue(db.has_access('test', ['Barcodes', 'Search']))
+            self.assertFalse(db.has_access('test', ['Barcodes']))
+            self.assertFalse(db.has_access('does not exist', ['Search']))
+            with self.assertRaisesRegexp(ValueError,
+                                         'Unknown access level bad'):
+                db.has_access('test', ['Search', 'bad'])
+
+            # answered from the cache
+            loads = db._permissions.stats()['loads']
+            db.has_access('test', ['Search'])
+            self.assertEqual(db._permissions.stats()['loads'], loads)
+        finally:
+            db.alter_access_levels('test', [])
+        self.assertFalse(db.has_access('test', ['Search']))
+
+    def test_is_user(self):
+        self.assertTrue(db.is_user('test'))
+        self.assertFalse(db.is_user('does not exist'))
+
+    def test_getAGStats(self):
+        db._dashboard.invalidate()
+        obs = dict(db.getAGStats())
+        sql = "SELECT count(*) FROM ag.ag_kit_barcodes WHERE results_ready='Y'"
+        self.assertEqual(obs['Total barcodes with results'],
+                         db._con.execute_fetchone(sql)[0])
+        sql = """SELECT count(*) FROM ag.survey_answers
+                 WHERE survey_question_id=107 AND response='Male'"""
+        self.assertEqual(obs['Total male participants'],
+                         db._con.execute_fetchone(sql)[0])
+        self.assertTrue(obs['Average age of participants'].endswith(
+            ' years'))
+        self.assertEqual(len(obs), 9)
+
+        # served from memory
+        loads = db._dashboard.stats()['loads']
+        self.assertEqual(dict(db.getAGStats()), obs)
+        self.assertEqual(db._dashboard.stats()['loads'], loads)
+
+    def test_getGeocodeStats(self):
+        db._dashboard.invalidate()
+        obs = db.getGeocodeStats()
+        sql = "SELECT count(*) FROM ag.ag_login WHERE latitude IS NULL"
+        self.assertEqual(obs[0][0], 'Total Rows')
+        self.assertEqual(obs[2], ('Null Latitude Field',
+                                  db._con.execute_fetchone(sql)[0]))
+
+    def test_get_geocode_zipcode_outward_code(self):
+        # the gazetteer only knows the outward code of full UK postcodes
+        tmp_dir = mkdtemp()
+        postcodes_fp = join(tmp_dir, 'postcodes.txt')
+        with open(postcodes_fp, 'w') as f:
+            f.write('GB\tSW1A\tLondon\tEngland\tENG\t\t\t\t\t'
+                    '51.5\t-0.1167\t4\n')
+        countries_fp = join(tmp_dir, 'countries.txt')
+        with open(countries_fp, 'w') as f:
+            f.write('GB\tGBR\t826\tUK\tUnited Kingdom\tLondon\n')
+        gazetteer = Gazetteer.load(postcodes_fp, countries_fp)
+        try:
+            with patch.object(db, '_get_gazetteer', return_value=gazetteer):
+                obs = db.get_geocode_zipcode('SW1A 1AA', 'United Kingdom')
+            self.assertEqual((obs.lat, obs.long), (51.5, -0.1167))
+            self.assertEqual(obs.postcode, 'SW1A')
+            sql = """SELECT cannot_geocode FROM ag.zipcodes
+                     WHERE zipcode = 'SW1A 1AA'"""
+            self.assertFalse(db._con.execute_fetchone(sql)[0])
+        finally:
+            db._con.execute(
+                "DELETE FROM ag.zipcodes WHERE zipcode = 'SW1A 1AA'")
+            rmtree(tmp_dir)
+
+    def test_project_summary(self):
+        obs = db.project_summary()
+        self.assertEqual(sorted(p['project'] for p in obs),
+                         sorted(db.getProjectNames()))
+        for proj in obs:
+            self.assertEqual(
+                proj['barcodes'],
+                len(db.get_barcodes_for_projects([proj['project']])))
+            self.assertLessEqual(proj['results_ready'], proj['barcodes'])
+
+        # assigning barcodes is seen right away
+        counts = {p['project']: p['barcodes'] for p in obs}
+        db.create_barcodes(2)
+        db.assign_barcodes(2, ['PROJECT2'])
+        obs = {p['project']: p['barcodes'] for p in db.project_summary()}
+        counts['PROJECT2'] += 2
+        self.assertEqual(obs, counts)
+
     def test_get_users(self):
         obs = db.get_users()
         exp = ['test']
@@ -240,6 +485,229 @@ class TestDataAccess(TestCase):
         res = db.getAnimalParticipants(i)
         self.assertEqual(res, [])
 
+    def test_hash_passwords(self):
+        passwords = ['12345678', '87654321', '12345678']
+        for workers in (1, 2):
+            db.config.hash_workers = workers
+            try:
+                progress = []
+                obs = db._hash_passwords(
+                    passwords, lambda *args: progress.append(args))
+            finally:
+                db.config.hash_workers = 1
+            self.assertEqual(len(obs), 3)
+            # each with its own salt, and checked like the other passwords
+            self.assertNotEqual(obs[0], obs[2])
+            for password, hashed in zip(passwords, obs):
+                self.assertEqual(db._hash_password(password, hashed), hashed)
+            self.assertEqual(progress[-1], (3, 3))
+
+    def test_assign_barcodes(self):
+        db.create_barcodes(3)
+        obs = db.assign_barcodes(3, ['PROJECT2', 'PROJECT5'])
+        self.assertEqual(len(obs), 3)
+        self.assertEqual(obs, sorted(obs))
+        self.assertFalse(set(obs) & set(db.get_unassigned_barcodes()))
+        sql = """SELECT project, count(*) FROM barcodes.project_barcode
+                 JOIN barcodes.project USING (project_id)
+                 WHERE barcode IN %s GROUP BY project ORDER BY project"""
+        self.assertEqual(
+            [list(row) for row in db._con.execute_fetchall(
+                sql, [tuple(obs)])],
+            [['PROJECT2', 3], ['PROJECT5', 3]])
+
+    def test_assign_barcodes_not_enough(self):
+        new = db.create_barcodes(2)
+        remaining = len(db.get_unassigned_barcodes())
+        with self.assertRaisesRegexp(ValueError, 'Not enough barcodes! '
+                                     '%d asked for, %d remaining'
+                                     % (remaining + 1, remaining)):
+            db.assign_barcodes(remaining + 1, ['PROJECT2'])
+        # nothing was assigned
+        self.assertTrue(set(new).issubset(db.get_unassigned_barcodes()))
+
+        with self.assertRaisesRegexp(ValueError,
+                                     'Number of barcodes must be positive'):
+            db.assign_barcodes(0, ['PROJECT2'])
+
+    def test_assign_barcodes_concurrent(self):
+        # enough connections for all threads to allocate at the same time
+        config = copy(db.config)
+        config.db_pool_max = 8
+        access = KniminAccess(config)
+        db.create_barcodes(8 * 25)
+        results = []
+        errors = []
+
+        def assign():
+            try:
+                for i in range(5):
+                    results.extend(access.assign_barcodes(5, ['PROJECT2']))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=assign) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 200)
+        self.assertEqual(len(set(results)), 200)
+        sql = """SELECT count(*) FROM barcodes.project_barcode
+                 WHERE barcode IN %s"""
+        self.assertEqual(
+            db._con.execute_fetchone(sql, [tuple(results)])[0], 200)
+
+    def test_assign_barcodes_held(self):
+        # barcodes locked by an allocation that fails are assigned once it
+        # is done, instead of failing for lack of barcodes
+        config = copy(db.config)
+        config.db_pool_max = 4
+        access = KniminAccess(config)
+        db.create_barcodes(10)
+        too_many = len(db.get_unassigned_barcodes()) + 100
+        results = []
+        errors = []
+        shortages = []
+
+        def assign():
+            try:
+                for i in range(5):
+                    results.extend(access.assign_barcodes(1, ['PROJECT2']))
+            except Exception as e:
+                errors.append(e)
+
+        def hold():
+            for i in range(20):
+                try:
+                    access.assign_barcodes(too_many, ['PROJECT2'])
+                except ValueError as e:
+                    shortages.append(e)
+
+        threads = [Thread(target=f) for f in (hold, hold, assign, assign)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(results)), 10)
+        self.assertEqual(len(shortages), 40)
+
+    def test_get_unassigned_barcodes_assigned_on(self):
+        # a barcode with an assigned date is taken even without a project
+        barcode = db.create_barcodes(1)[0]
+        self.assertIn(barcode, db.get_unassigned_barcodes())
+        db._con.execute("""UPDATE barcodes.barcode SET assigned_on = NOW()
+                           WHERE barcode = %s""", [barcode])
+        self.assertNotIn(barcode, db.get_unassigned_barcodes())
+
+    def test_add_barcodes_to_kit(self):
+        ag_kit_id = '0060a301-e5c0-6a4e-e050-8a800c5d49b7'
+        db.create_barcodes(2)
+        obs = db.add_barcodes_to_kit(ag_kit_id, 2)
+        self.assertEqual(len(obs), 2)
+        sql = """SELECT barcode, sample_barcode_file FROM ag.ag_kit_barcodes
+                 WHERE ag_kit_id = %s AND barcode IN %s ORDER BY barcode"""
+        self.assertEqual(
+            [list(row) for row in db._con.execute_fetchall(
+                sql, [ag_kit_id, tuple(obs)])],
+            [[b, b + '.jpg'] for b in obs])
+        # the new barcodes are in the same projects as the kit's others
+        sql = """SELECT DISTINCT project_id FROM barcodes.project_barcode
+                 JOIN ag.ag_kit_barcodes USING (barcode)
+                 WHERE ag_kit_id = %s AND barcode {} %s"""
+        old = db._con.execute_fetchall(sql.format('NOT IN'),
+                                       [ag_kit_id, tuple(obs)])
+        new = db._con.execute_fetchall(sql.format('IN'),
+                                       [ag_kit_id, tuple(obs)])
+        self.assertEqual(sorted(x[0] for x in old),
+                         sorted(x[0] for x in new))
+
+    def test_create_ag_kits(self):
+        progress = []
+        kits = db.create_ag_kits([(1, 2), (3, 1)], tag='tst',
+                                 progress=lambda *args: progress.append(args))
+        self.assertEqual([len(kit.barcodes) for kit in kits], [1, 1, 3])
+        self.assertEqual(progress[-1], (3, 3))
+        sql = """SELECT kit_id, verification_code, swabs_per_kit, barcode,
+                        sample_barcode_file
+                 FROM ag.ag_handout_kits
+                 JOIN ag.ag_handout_barcodes USING (kit_id)
+                 WHERE kit_id IN %s
+                 ORDER BY barcode"""
+        obs = db._con.execute_fetchall(sql, [tuple(k.kit_id for k in kits)])
+        exp = [[kit.kit_id, kit.verification_code, len(kit.barcodes),
+                barcode, barcode + '.jpg']
+               for kit in kits for barcode in kit.barcodes]
+        self.assertEqual([list(row) for row in obs], sorted(
+            exp, key=lambda row: row[3]))
+
+    def test_insert_ag_kits_taken_id(self):
+        # the first kit ID drawn after seeding is already in use
+        seed(42)
+        taken = db._insert_ag_kits(['x'], ['1234'], [()], tag='tst')[0]
+        seed(42)
+        obs = db._insert_ag_kits(['x', 'y'], ['1234', '5678'],
+                                 [(), ()], tag='tst')
+        self.assertNotIn(taken, obs)
+        self.assertEqual(len(set(obs)), 2)
+        sql = """SELECT kit_id, password FROM ag.ag_handout_kits
+                 WHERE kit_id IN %s ORDER BY password"""
+        self.assertEqual(
+            [list(row) for row in db._con.execute_fetchall(
+                sql, [tuple(obs)])],
+            [[obs[0], 'x'], [obs[1], 'y']])
+
+    def test_load_search_results(self):
+        logins = db.search_kits('tst_')[:5] + [
+            '00000000-0000-0000-0000-000000000000']
+        obs = db.load_search_results(logins)
+        self.assertEqual(len(obs), len(logins))
+        for login, result in zip(logins, obs):
+            self.assertEqual(result['login_info'], db.get_login_info(login))
+            self.assertEqual(sorted(result['humans']),
+                             sorted(db.getHumanParticipants(login)))
+            self.assertEqual(sorted(result['animals']),
+                             sorted(db.getAnimalParticipants(login)))
+            kits = db.get_kit_info_by_login(login)
+            self.assertEqual([dict(kit, barcode_info={}) for kit in kits],
+                             [dict(kit, barcode_info={})
+                              for kit in result['kit']])
+            for kit in result['kit']:
+                exp = db.get_barcode_info_by_kit_id(kit['ag_kit_id'])
+                self.assertEqual(sorted(kit['barcode_info']),
+                                 sorted(b['barcode'] for b in exp))
+                for barcode, info in kit['barcode_info'].items():
+                    self.assertEqual(info['barcode_info'],
+                                     db.get_barcode_details(barcode))
+                    self.assertEqual(info['plate'],
+                                     db.get_plate_for_barcode(barcode))
+        # unknown logins have nothing
+        self.assertEqual(obs[-1], {'login_info': [], 'humans': [],
+                                   'animals': [], 'kit': []})
+        self.assertEqual(db.load_search_results([]), [])
+
+    def test_search(self):
+        obs = db.search('tst_zpdIN', limit=None)
+        self.assertEqual(obs[0]['type'], 'kit')
+        self.assertEqual(obs[0]['id'], 'tst_zpdIN')
+        self.assertAlmostEqual(obs[0]['rank'], 1)
+        self.assertEqual([r['rank'] for r in obs],
+                         sorted((r['rank'] for r in obs), reverse=True))
+        self.assertIn(obs[0]['ag_login_id'], db.search_kits('tst_zpdIN'))
+
+        # the same logins as the separate searches
+        term = 'tst_'
+        obs = db.search(term, limit=None)
+        logins = {r['ag_login_id'] for r in obs if r['type'] != 'handout'}
+        self.assertEqual(logins, set(db.search_participant_info(term)) |
+                         set(db.search_kits(term)) |
+                         set(db.search_barcodes(term)))
+        self.assertEqual({r['id'] for r in obs if r['type'] == 'handout'},
+                         {r['kit_id'] for r in db.search_handout_kits(term)})
+        self.assertEqual(db.search(term, limit=3), obs[:3])
+
     def test_get_ag_barcode_details(self):
         obs = db.get_ag_barcode_details(['000018046'])
         exp = {'000018046': {
@@ -0,0 +1,60 @@
+from unittest import TestCase, main
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy as np
+
+from knimin.lib.elevation import HGTElevation, VOID, hgt_name
+
+
+class TestHGTElevation(TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        # elevation rises 10 m a sample to the east and 1 m to the south
+        rows, cols = np.mgrid[0:11, 0:11]
+        tile = (cols * 10 + rows).astype('>i2')
+        tile.tofile(join(self.dir, 'N32W118.hgt'))
+        tile[5, 5] = VOID
+        tile[0:2, 0:2] = VOID
+        tile.tofile(join(self.dir, 'S01E010.hgt'))
+        self.elevation = HGTElevation(self.dir)
+
+    def tearDown(self):
+        self.elevation.close()
+        rmtree(self.dir)
+
+    def test_hgt_name(self):
+        self.assertEqual(hgt_name(32.8, -117.2), 'N32W118.hgt')
+        self.assertEqual(hgt_name(-0.5, 10.5), 'S01E010.hgt')
+        self.assertEqual(hgt_name(0.0, 0.0), 'N00E000.hgt')
+
+    def test_elevation(self):
+        # on the samples, the north edge is in the tile to the north
+        self.assertAlmostEqual(self.elevation.elevation(32.0, -118.0), 10.0)
+        self.assertAlmostEqual(self.elevation.elevation(32.7, -117.3), 73.0)
+        self.assertEqual(self.elevation.elevation(33.0, -118.0), None)
+        # between them, interpolated on both axes
+        self.assertAlmostEqual(self.elevation.elevation(32.85, -117.75),
+                               26.5)
+        self.assertAlmostEqual(self.elevation.elevation(32.5, -117.5), 55.0)
+
+    def test_elevation_voids(self):
+        # voids are left out of the interpolation
+        self.assertAlmostEqual(self.elevation.elevation(-0.45, 10.55), 61.0)
+        # on a void, the samples around it are averaged
+        self.assertAlmostEqual(self.elevation.elevation(-0.5, 10.5),
+                               (65 + 56 + 66) / 3.)
+        self.assertEqual(self.elevation.elevation(-0.05, 10.05), None)
+
+    def test_elevation_missing_tile(self):
+        self.assertEqual(self.elevation.elevation(10.0, 10.0), None)
+
+    def test_elevation_not_square(self):
+        np.zeros(10, dtype='>i2').tofile(join(self.dir, 'N10E010.hgt'))
+        with self.assertRaises(ValueError):
+            self.elevation.elevation(10.5, 10.5)
+
+
+if __name__ == '__main__':
+    main()
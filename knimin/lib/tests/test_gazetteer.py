@@ -0,0 +1,141 @@
+from unittest import TestCase, main
+from os import close, remove
+from tempfile import mkstemp
+
+import numpy as np
+
+from knimin.lib.geocoder import Location
+from knimin.lib.gazetteer import (Gazetteer, load_country_codes,
+                                  normalize_zipcode)
+
+
+POSTCODES = [
+    'US\t92037\tLa Jolla\tCalifornia\tCA\tSan Diego\t073\t\t\t'
+    '32.8455\t-117.2521\t4',
+    'US\t80302\tBoulder\tColorado\tCO\tBoulder\t013\t\t\t'
+    '40.0172\t-105.2851\t4',
+    'US\t92037\tDuplicate\tCalifornia\tCA\t\t\t\t\t1.0\t1.0\t4',
+    'GB\tSW1A\tLondon\tEngland\tENG\tGreater London\t11609024\t\t\t'
+    '51.5\t-0.1167\t4',
+    'DE\t80331\tM\xc3\xbcnchen\tBayern\tBY\t\t\t\t\t48.1372\t11.5755\t4',
+    'JP\t100-0001\tChiyoda\tTokyo To\t40\t\t\t\t\t35.6843\t139.7536\t4',
+    'XX\t00000\tNowhere\t\t\t\t\t\t\t\t\t',
+]
+
+COUNTRIES = [
+    '#ISO\tISO3\tISO-Numeric\tfips\tCountry\tCapital',
+    'US\tUSA\t840\tUS\tUnited States\tWashington',
+    'GB\tGBR\t826\tUK\tUnited Kingdom\tLondon',
+    'DE\tDEU\t276\tGM\tGermany\tBerlin',
+    'JP\tJPN\t392\tJA\tJapan\tTokyo',
+]
+
+
+def _write(lines):
+    fd, fp = mkstemp(suffix='.txt')
+    close(fd)
+    with open(fp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return fp
+
+
+class TestGazetteer(TestCase):
+    def setUp(self):
+        self.fp = _write(POSTCODES)
+        self.countries_fp = _write(COUNTRIES)
+        self.gazetteer = Gazetteer.load(self.fp, self.countries_fp)
+
+    def tearDown(self):
+        remove(self.fp)
+        remove(self.countries_fp)
+
+    def test_normalize_zipcode(self):
+        self.assertEqual(normalize_zipcode(' sw1a 1aa '), 'SW1A1AA')
+
+    def test_load_country_codes(self):
+        codes = load_country_codes(self.countries_fp)
+        self.assertEqual(codes['us'], 'US')
+        self.assertEqual(codes['usa'], 'US')
+        self.assertEqual(codes['united states'], 'US')
+        self.assertEqual(codes['deu'], 'DE')
+        self.assertNotIn('#iso', codes)
+
+    def test_load(self):
+        # the duplicate and the row without coordinates are left out
+        self.assertEqual(len(self.gazetteer), 5)
+
+    def test_lookup(self):
+        obs = self.gazetteer.lookup('92037', 'United States')
+        self.assertEqual(obs, Location('92037', 32.8455, -117.2521, None,
+                                       'La Jolla', 'CA', '92037',
+                                       'United States'))
+        self.assertEqual(self.gazetteer.lookup('92037', 'USA').city,
+                         'La Jolla')
+        self.assertEqual(self.gazetteer.lookup('92037', 'us').city,
+                         'La Jolla')
+        # not alphabetic state codes are replaced by the state name
+        self.assertEqual(self.gazetteer.lookup('100-0001', 'JP').state,
+                         'Tokyo To')
+
+        obs = self.gazetteer.lookup('80331', 'Germany')
+        self.assertEqual(obs.city, u'M\xfcnchen')
+        self.assertEqual(obs.state, 'BY')
+
+    def test_lookup_variants(self):
+        self.assertEqual(self.gazetteer.lookup('92037-1234', 'USA').city,
+                         'La Jolla')
+        self.assertEqual(self.gazetteer.lookup(' 80302 ', 'USA').city,
+                         'Boulder')
+        obs = self.gazetteer.lookup('sw1a 1aa', 'United Kingdom')
+        self.assertEqual(obs.input, 'sw1a 1aa')
+        self.assertEqual(obs.postcode, 'SW1A')
+
+    def test_lookup_missing(self):
+        self.assertEqual(self.gazetteer.lookup('00000', 'USA'), None)
+        self.assertEqual(self.gazetteer.lookup('92037', 'Germany'), None)
+        self.assertEqual(self.gazetteer.lookup('92037', 'Atlantis'), None)
+        self.assertEqual(self.gazetteer.lookup('', 'USA'), None)
+        self.assertEqual(self.gazetteer.lookup('92037', None), None)
+
+    def test_lookup_no_country_codes(self):
+        gazetteer = Gazetteer.load(self.fp)
+        self.assertEqual(gazetteer.lookup('92037', 'US').city, 'La Jolla')
+        self.assertEqual(gazetteer.lookup('92037', 'USA'), None)
+
+    def test_nearest(self):
+        obs = self.gazetteer.nearest(32.8, -117.2)
+        self.assertEqual(obs, Location('92037', 32.8455, -117.2521, None,
+                                       'La Jolla', 'CA', '92037', 'US'))
+        self.assertEqual(self.gazetteer.nearest(50.0, 5.0).city, 'London')
+
+    def test_nearest_brute_force(self):
+        rand = np.random.RandomState(0)
+        lats = rand.uniform(-90, 90, 2000)
+        longs = rand.uniform(-180, 180, 2000)
+        postcodes = [str(i) for i in range(2000)]
+        gazetteer = Gazetteer(['US'] * 2000, postcodes, postcodes,
+                              [None] * 2000, lats, longs, leaf_size=8)
+
+        lat, long = np.radians(lats), np.radians(longs)
+        for plat, plong in zip(rand.uniform(-90, 90, 50),
+                               rand.uniform(-180, 180, 50)):
+            # great circle distance, by the haversine formula
+            dist = np.sin((lat - np.radians(plat)) / 2) ** 2 + \
+                np.cos(lat) * np.cos(np.radians(plat)) * \
+                np.sin((long - np.radians(plong)) / 2) ** 2
+            exp = postcodes[dist.argmin()]
+            self.assertEqual(gazetteer.nearest(plat, plong).postcode, exp)
+
+    def test_empty(self):
+        fp = _write([])
+        try:
+            gazetteer = Gazetteer.load(fp)
+        finally:
+            remove(fp)
+        self.assertEqual(len(gazetteer), 0)
+        self.assertEqual(gazetteer.lookup('92037', 'US'), None)
+        self.assertEqual(gazetteer.nearest(0.0, 0.0), None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+from unittest import TestCase, main
+from os import close, remove
+from tempfile import mkstemp
+
+from mock import patch
+
+from knimin.lib.geocoder import Location
+from knimin.lib.geocode_cache import GeocodeCache, normalize_address
+
+
+def _location(address, lat=1.0):
+    if lat is None:
+        return Location(address, None, None, None, None, None, None, None)
+    return Location(address, lat, -lat, 10.0, 'City', 'ST', '92037', 'USA')
+
+
+class TestGeocodeCache(TestCase):
+    def setUp(self):
+        fd, self.fp = mkstemp(suffix='.db')
+        close(fd)
+        self.cache = GeocodeCache(self.fp, max_entries=3, negative_ttl=100)
+
+    def tearDown(self):
+        self.cache.close()
+        remove(self.fp)
+
+    def test_normalize_address(self):
+        self.assertEqual(normalize_address('La Jolla,  CA 92037  USA'),
+                         'la jolla ca 92037 usa')
+        self.assertEqual(normalize_address(u'M\xfcnchen'), u'm\xfcnchen')
+        self.assertEqual(normalize_address('M\xc3\xbcnchen'), u'm\xfcnchen')
+
+    def test_get_set(self):
+        self.assertEqual(self.cache.get('La Jolla CA'), None)
+        self.cache.set('La Jolla CA', _location('La Jolla CA'))
+        # looked up by normalized address, returned with the address asked
+        self.assertEqual(self.cache.get('la jolla, ca'),
+                         _location('la jolla, ca'))
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 1, 'misses': 1, 'evictions': 0,
+                          'entries': 1})
+
+    def test_persistent(self):
+        self.cache.set('La Jolla CA', _location('La Jolla CA'))
+        self.cache.close()
+        self.cache = GeocodeCache(self.fp)
+        self.assertEqual(self.cache.get('La Jolla CA'),
+                         _location('La Jolla CA'))
+
+    def test_get_many(self):
+        self.cache.set_many({'a': _location('a'), 'b': _location('b', 2.0),
+                             'error': None})
+        obs = self.cache.get_many(['a', 'A', 'b', 'c', 'error'])
+        self.assertEqual(obs, {'a': _location('a'), 'A': _location('A'),
+                               'b': _location('b', 2.0)})
+        self.assertEqual(self.cache.get_many([]), {})
+
+    def test_negative_ttl(self):
+        with patch('knimin.lib.geocode_cache.time', return_value=1000):
+            self.cache.set_many({'nowhere': _location('nowhere', None),
+                                 'a': _location('a')})
+        with patch('knimin.lib.geocode_cache.time', return_value=1050):
+            self.assertEqual(self.cache.get('nowhere'),
+                             _location('nowhere', None))
+        with patch('knimin.lib.geocode_cache.time', return_value=1200):
+            # not found expired, found kept
+            self.assertEqual(self.cache.get('nowhere'), None)
+            self.assertEqual(self.cache.get('a'), _location('a'))
+
+    def test_eviction(self):
+        for t, address in enumerate(['a', 'b', 'c']):
+            with patch('knimin.lib.geocode_cache.time', return_value=t):
+                self.cache.set(address, _location(address))
+        with patch('knimin.lib.geocode_cache.time', return_value=10):
+            self.cache.get('a')
+            self.cache.set('d', _location('d'))
+        # b was the least recently used
+        self.assertEqual(sorted(self.cache.get_many(['a', 'b', 'c', 'd'])),
+                         ['a', 'c', 'd'])
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.cache.stats()['entries'], 3)
+
+
+if __name__ == '__main__':
+    main()
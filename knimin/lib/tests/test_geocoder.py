@@ -1,9 +1,17 @@
 from unittest import TestCase, main
-from json import loads
+from json import loads, dumps
+from os import close, remove
+from tempfile import mkstemp
+from threading import Thread
+from time import time
 import requests_mock
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import urlparse, parse_qs
 from knimin.lib.geocoder import (
     GoogleAPIInvalidRequest, GoogleAPILimitExceeded, GoogleAPIRequestDenied,
-    Location, _call_wrapper, geocode)
+    Location, _call_wrapper, geocode, TokenBucket, BatchGeocoder)
+from knimin.lib.geocode_cache import GeocodeCache
 
 
 class TestCallWrapper(TestCase):
@@ -26,6 +34,17 @@ class TestCallWrapper(TestCase):
             with self.assertRaises(GoogleAPILimitExceeded):
                 _call_wrapper(full_url)
 
+    def test_call_wrapper_acquire(self):
+        full_url = self.url % 'exceeded'
+        tokens = []
+        with requests_mock.mock() as m:
+            m.get(full_url, text=over_query_limit)
+
+            with self.assertRaises(GoogleAPILimitExceeded):
+                _call_wrapper(full_url, acquire=lambda: tokens.append(1))
+        # a token for the request and each of its retries
+        self.assertEqual(len(tokens), 4)
+
     def test_call_wrapper_zero_results(self):
         full_url = self.url % 'zero'
         with requests_mock.mock() as m:
@@ -92,12 +111,195 @@ class TestGeocode(TestCase):
                        u'S\xf6dermanlands l\xe4n', '632 30', 'Sweden')
         self.assertEqual(obs, exp)
 
+    def test_geocode_cached(self):
+        fd, fp = mkstemp(suffix='.db')
+        close(fd)
+        cache = GeocodeCache(fp)
+        try:
+            exp = Location('La Jolla', 32.8, -117.2, 100.1, 'San Diego', 'CA',
+                           '92037', 'United States')
+            cache.set('La Jolla', exp)
+            # no request made, any would fail under the mock
+            with requests_mock.mock():
+                obs = geocode('La Jolla', cache)
+            self.assertEqual(obs, exp)
+        finally:
+            cache.close()
+            remove(fp)
+
+    def test_geocode_elevation(self):
+        with requests_mock.mock() as m:
+            m.get('https://maps.googleapis.com/maps/api/geocode/json',
+                  text=ok)
+            obs = geocode('9500 Gilman Dr', elevation=StubElevation())
+        # the elevation API is not called
+        self.assertEqual(m.call_count, 1)
+        exp = Location('9500 Gilman Dr', 32.8794081, -117.2368167,
+                       32.8794081 - 117.2368167, 'San Diego', 'CA', '92093',
+                       'United States')
+        self.assertEqual(obs, exp)
+
     def test_geocode_bad_address(self):
         obs = geocode('SomeRandomPlace')
         exp = Location('SomeRandomPlace', None, None, None, None, None, None,
                        None)
         self.assertEqual(obs, exp)
 
+
+class TestTokenBucket(TestCase):
+    def test_acquire(self):
+        bucket = TokenBucket(100)
+        start = time()
+        for _ in range(21):
+            bucket.acquire()
+        # first token right away, then one every 10 ms
+        self.assertGreaterEqual(time() - start, 0.19)
+
+
+class StubElevation(object):
+    """Elevation provider answering like the stub elevation API"""
+    def elevation(self, lat, long):
+        return lat + long
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers like the Google APIs, with lat/long made from the address"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        self.server.paths.append(url.path)
+        if url.path == '/maps/api/geocode/json':
+            body = self._geocode(params['address'][0])
+        else:
+            locations = [loc.split(',')
+                         for loc in params['locations'][0].split('|')]
+            if any(lat.startswith('66.') for lat, _ in locations):
+                body = invalid_request
+            else:
+                body = dumps({'status': 'OK', 'results': [
+                    {'elevation': float(lat) + float(lng)}
+                    for lat, lng in locations]})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _geocode(self, address):
+        if address in errors:
+            return errors[address]
+        lat = float(len(address))
+        return dumps({'status': 'OK', 'results': [{
+            'geometry': {'location': {'lat': lat, 'lng': -lat}},
+            'address_components': [
+                {'long_name': 'City', 'types': ['locality']},
+                {'long_name': 'State', 'short_name': 'ST',
+                 'types': ['administrative_area_level_1']},
+                {'long_name': 'Country', 'types': ['country']},
+                {'long_name': address, 'types': ['postal_code']}]}]})
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBatchGeocoder(TestCase):
+    def setUp(self):
+        self.server = StubServer(('localhost', 0), StubHandler)
+        self.server.paths = []
+        Thread(target=self.server.serve_forever).start()
+        self.url = 'http://localhost:%d/' % self.server.server_address[1]
+        self.geocoders = []
+
+    def tearDown(self):
+        for geocoder in self.geocoders:
+            geocoder.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def geocoder(self, **kwargs):
+        geocoder = BatchGeocoder(self.url, rate=1000, **kwargs)
+        self.geocoders.append(geocoder)
+        return geocoder
+
+    def geocoded(self, address, elev=None):
+        lat = float(len(address))
+        return Location(address, lat, -lat, 0.0 if elev is None else elev,
+                        'City', 'ST', address, 'Country')
+
+    def test_geocode(self):
+        geocoder = self.geocoder(workers=4, elevation_batch=2)
+        addresses = ['a', 'bb', 'ccc', 'a', 'dddd', 'bb', 'nowhere', 'bad']
+        obs = geocoder.geocode(addresses)
+        exp = {address: self.geocoded(address)
+               for address in ('a', 'bb', 'ccc', 'dddd')}
+        exp['nowhere'] = Location('nowhere', None, None, None, None, None,
+                                  None, None)
+        exp['bad'] = None
+        self.assertEqual(obs, exp)
+        # each distinct address once, elevations two at a time
+        paths = self.server.paths
+        self.assertEqual(paths.count('/maps/api/geocode/json'), 6)
+        self.assertEqual(paths.count('/maps/api/elevation/json'), 2)
+
+    def test_geocode_elevation_error(self):
+        geocoder = self.geocoder(elevation_batch=10)
+        # latitude 66 fails the elevation lookup
+        obs = geocoder.geocode(['a', 'x' * 66, 'bb'])
+        self.assertEqual(obs, {'a': self.geocoded('a'), 'x' * 66: None,
+                               'bb': self.geocoded('bb')})
+        # the failing batch is looked up again one location at a time
+        self.assertEqual(self.server.paths.count('/maps/api/elevation/json'),
+                         4)
+
+    def test_geocode_elevation_provider(self):
+        geocoder = self.geocoder(elevation=StubElevation())
+        obs = geocoder.geocode(['a', 'x' * 66, 'bb'])
+        self.assertEqual(obs, {address: self.geocoded(address)
+                               for address in ('a', 'x' * 66, 'bb')})
+        self.assertEqual(self.server.paths,
+                         ['/maps/api/geocode/json'] * 3)
+
+    def test_geocode_limit_exceeded(self):
+        geocoder = self.geocoder(workers=1)
+        obs = geocoder.geocode(['a', 'limit', 'zz'])
+        # nothing is geocoded after the limit is exceeded, but addresses
+        # geocoded before still get their elevation
+        self.assertEqual(obs, {'a': self.geocoded('a')})
+        # 'a' once and 'limit' as many times as _call_wrapper tries
+        self.assertEqual(self.server.paths.count('/maps/api/geocode/json'),
+                         5)
+
+    def test_geocode_cache(self):
+        fd, fp = mkstemp(suffix='.db')
+        close(fd)
+        cache = GeocodeCache(fp)
+        try:
+            geocoder = self.geocoder(cache=cache)
+            exp = geocoder.geocode(['a', 'bb', 'nowhere', 'bad'])
+            requests = len(self.server.paths)
+            obs = geocoder.geocode(['A', 'bb', 'nowhere', 'bad'])
+            # only the address failing with an error is asked for again
+            self.assertEqual(self.server.paths[requests:],
+                             ['/maps/api/geocode/json'])
+            self.assertEqual(obs['A'], self.geocoded('a')._replace(input='A'))
+            self.assertEqual(obs['bb'], exp['bb'])
+            self.assertEqual(obs['nowhere'], exp['nowhere'])
+            self.assertEqual(obs['bad'], None)
+        finally:
+            cache.close()
+            remove(fp)
+
+    def test_geocode_empty(self):
+        geocoder = self.geocoder()
+        self.assertEqual(geocoder.geocode([]), {})
+        self.assertEqual(self.server.paths, [])
+
 # Results copied from Google API responses on 2015-10-25
 ok = '''{
    "results" : [
@@ -278,5 +480,8 @@ invalid_request = '''{
    "status" : "INVALID_REQUEST"
 }'''
 
+errors = {'nowhere': zero_results, 'bad': invalid_request,
+          'limit': over_query_limit}
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,110 @@
+from unittest import TestCase, main
+from threading import Event
+from time import sleep, time
+
+from knimin.lib.jobs import JobTracker
+
+
+def _count(n, progress=None, fail=False):
+    for i in range(n):
+        progress(i + 1, n)
+    if fail:
+        raise ValueError('Failed at %d' % n)
+    return list(range(n))
+
+
+class JobTrackerTests(TestCase):
+    def setUp(self):
+        self.jobs = JobTracker(max_workers=1)
+
+    def tearDown(self):
+        self.jobs.shutdown()
+
+    def wait(self, job_id, owner='user'):
+        start = time()
+        while time() - start < 5:
+            status = self.jobs.status(job_id, owner)
+            if status['status'] in ('done', 'failed'):
+                return status
+            sleep(0.01)
+        self.fail('job %s not finished' % job_id)
+
+    def test_submit(self):
+        job_id = self.jobs.submit('user', _count, 3)
+        self.assertEqual(self.wait(job_id),
+                         {'status': 'done', 'done': 3, 'total': 3,
+                          'result': [0, 1, 2], 'error': None})
+
+    def test_submit_failed(self):
+        job_id = self.jobs.submit('user', _count, 2, fail=True)
+        self.assertEqual(self.wait(job_id),
+                         {'status': 'failed', 'done': 2, 'total': 2,
+                          'result': None, 'error': 'Failed at 2'})
+
+    def test_status_queued(self):
+        started = Event()
+        release = Event()
+
+        def block(progress=None):
+            started.set()
+            release.wait()
+
+        running = self.jobs.submit('user', block)
+        started.wait()
+        queued = self.jobs.submit('user', _count, 1)
+        try:
+            self.assertEqual(self.jobs.status(running, 'user')['status'],
+                             'running')
+            self.assertEqual(self.jobs.status(queued, 'user'),
+                             {'status': 'queued', 'done': 0, 'total': None,
+                              'result': None, 'error': None})
+        finally:
+            release.set()
+        self.assertEqual(self.wait(queued)['status'], 'done')
+
+    def test_status_other_owner(self):
+        job_id = self.jobs.submit('user', _count, 1)
+        self.wait(job_id)
+        self.assertEqual(self.jobs.status(job_id, 'someone else'), None)
+        self.assertEqual(self.jobs.status('no such job', 'user'), None)
+
+    def test_status_collect(self):
+        job_id = self.jobs.submit('user', _count, 1)
+        self.wait(job_id)
+        self.assertEqual(self.jobs.status(job_id, 'user', collect=True),
+                         {'status': 'done', 'done': 1, 'total': 1,
+                          'result': [0], 'error': None})
+        self.assertEqual(self.jobs.status(job_id, 'user'), None)
+
+    def test_status_collect_running(self):
+        started = Event()
+        release = Event()
+
+        def block(progress=None):
+            started.set()
+            release.wait()
+
+        job_id = self.jobs.submit('user', block)
+        started.wait()
+        try:
+            # only finished jobs are dropped
+            self.assertEqual(
+                self.jobs.status(job_id, 'user', collect=True)['status'],
+                'running')
+            self.assertEqual(self.jobs.status(job_id, 'user')['status'],
+                             'running')
+        finally:
+            release.set()
+
+    def test_expire(self):
+        self.jobs.ttl = 0
+        job_id = self.jobs.submit('user', _count, 1)
+        # the job is gone as soon as it finished
+        start = time()
+        while self.jobs.status(job_id, 'user') is not None:
+            self.assertLess(time() - start, 5)
+            sleep(0.01)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import unittest
-from knimin.lib.mem_zip import InMemoryZip
+from knimin.lib.mem_zip import InMemoryZip, StreamingZip
 import zipfile
 import os
 import io
@@ -50,5 +50,37 @@ class TestInMemoryZip(unittest.TestCase):
         res_contents = zhandle.read(self.test_fname)
         self.assertEqual(res_contents, exp_contents)
 
+
+class TestStreamingZip(unittest.TestCase):
+
+    def test_add(self):
+        zipper = StreamingZip()
+        data = b''.join(zipper.add('test.txt', [b'arg', b'', b'h']))
+        data += zipper.close()
+        zhandle = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(zhandle.testzip())
+        self.assertEqual(zhandle.namelist(), ['test.txt'])
+        self.assertEqual(zhandle.read('test.txt'), b'argh')
+
+    def test_add_multiple(self):
+        exp_contents = b'\t'.join([b'sample_name', b'AGE'] * 10000)
+        zipper = StreamingZip()
+        data = b''.join(zipper.add('big.txt', [exp_contents[:100],
+                                               exp_contents[100:]]))
+        data += b''.join(zipper.add('empty.txt', []))
+        data += zipper.close()
+        zhandle = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(zhandle.testzip())
+        self.assertEqual(zhandle.namelist(), ['big.txt', 'empty.txt'])
+        self.assertEqual(zhandle.read('big.txt'), exp_contents)
+        self.assertEqual(zhandle.read('empty.txt'), b'')
+        # compressed as it goes
+        self.assertLess(len(data), len(exp_contents))
+
+    def test_close_empty(self):
+        zhandle = zipfile.ZipFile(io.BytesIO(StreamingZip().close()))
+        self.assertEqual(zhandle.namelist(), [])
+
+
 if __name__ == '__main__':
     unittest.main()
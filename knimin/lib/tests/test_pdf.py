@@ -0,0 +1,69 @@
+from unittest import TestCase, main
+import re
+import zlib
+
+from knimin.lib.pdf import PDFDocument, pdf_string, text_width
+
+
+def parse_pdf(pdf):
+    """Objects of a PDF, checking the cross reference table points at them
+
+    Returns
+    -------
+    dict of str
+        {object number: object body, ...}, with content streams decompressed
+    """
+    xref = int(re.search(r'startxref\n(\d+)\n%%EOF\n$', pdf).group(1))
+    table = pdf[xref:].split('\n')
+    assert table[0] == 'xref'
+    count = int(table[1].split()[1])
+    objects = {}
+    for num in range(1, count):
+        offset = int(table[2 + num].split()[0])
+        match = re.compile(r'%d 0 obj\n(.*?)\nendobj\n' % num,
+                           re.DOTALL).match(pdf, offset)
+        assert match is not None, 'object %d not at offset %d' % (num, offset)
+        body = match.group(1)
+        stream = re.match(r'<< /Length (\d+) /Filter /FlateDecode >>\n'
+                          r'stream\n', body)
+        if stream is not None:
+            data = body[stream.end():stream.end() + int(stream.group(1))]
+            body = zlib.decompress(data)
+        objects[num] = body
+    return objects
+
+
+class PDFTests(TestCase):
+    def test_text_width(self):
+        self.assertAlmostEqual(text_width('000000011', 20), 100.08)
+        self.assertAlmostEqual(text_width('A b', 10), 6.67 + 2.78 + 5.56)
+
+    def test_pdf_string(self):
+        self.assertEqual(pdf_string('a(b)\\c'), '(a\\(b\\)\\\\c)')
+
+    def test_write(self):
+        doc = PDFDocument(612, 792)
+        doc.add_page('0 0 10 10 re f')
+        doc.add_page(u'BT /F1 12 Tf 10 10 Td (two) Tj ET')
+        self.assertEqual(len(doc), 2)
+        pdf = doc.tostring()
+
+        self.assertTrue(pdf.startswith('%PDF-1.4\n'))
+        objects = parse_pdf(pdf)
+        self.assertEqual(objects[1], '<< /Type /Catalog /Pages 2 0 R >>')
+        self.assertEqual(objects[2],
+                         '<< /Type /Pages /Kids [4 0 R 6 0 R] /Count 2 >>')
+        self.assertIn('/BaseFont /Helvetica', objects[3])
+        self.assertIn('/MediaBox [0 0 612 792]', objects[4])
+        self.assertIn('/Contents 5 0 R', objects[4])
+        self.assertEqual(objects[5], '0 0 10 10 re f')
+        self.assertEqual(objects[7], 'BT /F1 12 Tf 10 10 Td (two) Tj ET')
+
+    def test_write_empty(self):
+        objects = parse_pdf(PDFDocument(612, 792).tostring())
+        self.assertEqual(objects[2], '<< /Type /Pages /Kids [] /Count 0 >>')
+        self.assertEqual(len(objects), 3)
+
+
+if __name__ == '__main__':
+    main()
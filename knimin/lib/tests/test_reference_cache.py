@@ -0,0 +1,157 @@
+from unittest import TestCase, main
+from threading import Event, Thread
+from time import sleep
+
+from mock import Mock, patch
+
+from knimin.lib.reference_cache import ReferenceCache
+
+
+class TestReferenceCache(TestCase):
+    def setUp(self):
+        self.load = Mock(side_effect=lambda: {'USA': 'United States'})
+        self.version = Mock(return_value=1)
+        self.cache = ReferenceCache(ttl=100, check_after=10)
+        self.cache.register('countries', self.load, self.version)
+
+    def test_get(self):
+        obs = self.cache.get('countries')
+        self.assertEqual(obs, {'USA': 'United States'})
+        self.assertIs(self.cache.get('countries'), obs)
+        self.assertEqual(self.load.call_count, 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats['loads'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['cached'], ['countries'])
+
+    def test_get_unknown(self):
+        with self.assertRaises(KeyError):
+            self.cache.get('zipcodes')
+
+    @patch('knimin.lib.reference_cache.time')
+    def test_get_version_unchanged(self, time):
+        time.return_value = 0
+        obs = self.cache.get('countries')
+        self.assertEqual(self.version.call_count, 1)
+        # trusted without checking the version
+        time.return_value = 5
+        self.cache.get('countries')
+        self.assertEqual(self.version.call_count, 1)
+        # version checked, but the table did not change
+        time.return_value = 20
+        self.assertIs(self.cache.get('countries'), obs)
+        self.assertEqual(self.version.call_count, 2)
+        self.assertEqual(self.load.call_count, 1)
+        self.assertEqual(self.cache.stats()['version_checks'], 1)
+
+    @patch('knimin.lib.reference_cache.time')
+    def test_get_version_changed(self, time):
+        time.return_value = 0
+        obs = self.cache.get('countries')
+        time.return_value = 20
+        self.version.return_value = 2
+        self.assertIsNot(self.cache.get('countries'), obs)
+        self.assertEqual(self.load.call_count, 2)
+
+    @patch('knimin.lib.reference_cache.time')
+    def test_get_ttl_expired(self, time):
+        time.return_value = 0
+        self.cache.get('countries')
+        time.return_value = 5
+        self.cache.get('countries')
+        time.return_value = 100
+        self.cache.get('countries')
+        self.assertEqual(self.load.call_count, 2)
+
+    @patch('knimin.lib.reference_cache.time')
+    def test_get_no_version(self, time):
+        cache = ReferenceCache(ttl=100, check_after=10)
+        cache.register('countries', self.load)
+        time.return_value = 0
+        cache.get('countries')
+        time.return_value = 50
+        cache.get('countries')
+        self.assertEqual(self.load.call_count, 1)
+        time.return_value = 150
+        cache.get('countries')
+        self.assertEqual(self.load.call_count, 2)
+
+    def test_invalidate(self):
+        self.cache.get('countries')
+        self.cache.invalidate('countries')
+        self.assertEqual(self.cache.stats()['cached'], [])
+        self.cache.get('countries')
+        self.assertEqual(self.load.call_count, 2)
+
+    def test_invalidate_all(self):
+        self.cache.register('zipcodes', lambda: {})
+        self.cache.get('countries')
+        self.cache.get('zipcodes')
+        self.cache.invalidate()
+        obs = self.cache.stats()
+        self.assertEqual(obs['cached'], [])
+        self.assertEqual(obs['invalidations'], 1)
+
+    def test_get_threads_load_once(self):
+        threads = [Thread(target=self.cache.get, args=['countries'])
+                   for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.load.call_count, 1)
+
+    def wait_refreshes(self, cache, refreshes):
+        for _ in range(500):
+            if cache.stats()['refreshes'] == refreshes and \
+                    not cache._refreshing:
+                return
+            sleep(0.01)
+        self.fail('not refreshed')
+
+    @patch('knimin.lib.reference_cache.time')
+    def test_get_refresh(self, time):
+        cache = ReferenceCache(ttl=100, refresh_after=10)
+        load = Mock(side_effect=[1, 2])
+        cache.register('stats', load)
+        time.return_value = 0
+        self.assertEqual(cache.get('stats'), 1)
+        time.return_value = 5
+        self.assertEqual(cache.get('stats'), 1)
+        # the loaded value is returned while loading again in the background
+        time.return_value = 20
+        self.assertEqual(cache.get('stats'), 1)
+        self.wait_refreshes(cache, 1)
+        self.assertEqual(cache.get('stats'), 2)
+        self.assertEqual(load.call_count, 2)
+
+    @patch('knimin.lib.reference_cache.time')
+    def test_get_refresh_invalidated(self, time):
+        cache = ReferenceCache(ttl=100, refresh_after=10)
+        loading = Event()
+        release = Event()
+
+        def load():
+            load.calls += 1
+            if load.calls == 2:
+                # the background load
+                loading.set()
+                release.wait()
+                return 'stale'
+            return 'old' if load.calls == 1 else 'new'
+        load.calls = 0
+        cache.register('stats', load)
+        time.return_value = 0
+        cache.get('stats')
+        time.return_value = 20
+        self.assertEqual(cache.get('stats'), 'old')
+        loading.wait()
+        # invalidated while the background load runs, which is not stored
+        cache.invalidate('stats')
+        release.set()
+        self.wait_refreshes(cache, 0)
+        self.assertEqual(cache.get('stats'), 'new')
+
+
+if __name__ == '__main__':
+    main()
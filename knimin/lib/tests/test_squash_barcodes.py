@@ -1,7 +1,9 @@
 
 from unittest import TestCase, main
 
+from knimin.lib.code128 import code128_widths
 from knimin.lib.squash_barcodes import get_image, build_barcodes_pdf
+from knimin.lib.tests.test_pdf import parse_pdf
 
 
 class SquashBarcodesTests(TestCase):
@@ -18,47 +20,47 @@ class SquashBarcodesTests(TestCase):
 
     def test_build_barcodes_pdf_one_page(self):
         pdf = build_barcodes_pdf(['000000011'] * 36)
+        objects = parse_pdf(pdf)
 
-        self.assertTrue(ONE_PAGE_HEADER in pdf)
+        self.assertIn('/Count 1 ', objects[2])
+        # letter size
+        self.assertIn('/MediaBox [0 0 612 792]', objects[4])
+        self.assertEqual(objects[5].count('(000000011) Tj'), 36)
 
     def test_build_barcodes_pdf_two_pages(self):
-        pdf = build_barcodes_pdf(['000000011'] * 72)
-
-        self.assertTrue(TWO_PAGES_HEADER in pdf)
-
-
-ONE_PAGE_HEADER = """<</Type/Page/MediaBox [0 0 1275 1650]
-/Parent 3 0 R
-/Resources<</ProcSet[/PDF /ImageC]
-/ExtGState 9 0 R
-/XObject 10 0 R
->>
-/Contents 5 0 R
->>
-endobj
-3 0 obj
-"""
-
-TWO_PAGES_HEADER = """<</Type/Page/MediaBox [0 0 1275 1650]
-/Parent 3 0 R
-/Resources<</ProcSet[/PDF /ImageC]
-/ExtGState 9 0 R
-/XObject 10 0 R
->>
-/Contents 5 0 R
->>
-endobj
-11 0 obj
-<</Type/Page/MediaBox [0 0 1275 1650]
-/Parent 3 0 R
-/Resources<</ProcSet[/PDF /ImageC]
-/ExtGState 14 0 R
-/XObject 15 0 R
->>
-/Contents 12 0 R
->>
-endobj
-3 0 obj"""
+        pdf = build_barcodes_pdf(['000000011'] * 36 + ['000000012'] * 4)
+        objects = parse_pdf(pdf)
+
+        self.assertIn('/Count 2 ', objects[2])
+        self.assertEqual(objects[5].count('(000000011) Tj'), 36)
+        self.assertEqual(objects[7].count('(000000012) Tj'), 4)
+
+    def test_build_barcodes_pdf_bars(self):
+        objects = parse_pdf(build_barcodes_pdf([u'000001234']))
+        bars = [map(int, line.split()[:4])
+                for line in objects[5].split('\n') if line.endswith(' re')]
+
+        # every other width is a bar, drawn left to right and centered in
+        # the first label
+        widths = code128_widths('000001234', 2)
+        self.assertEqual([w for _, _, w, _ in bars], widths[::2])
+        left = 18 + 49 + (202 - sum(widths)) // 2
+        self.assertEqual(bars[0][:2], [left, 59 + 25])
+        self.assertEqual(bars[-1][0] + bars[-1][2], left + sum(widths))
+        self.assertEqual({h for _, _, _, h in bars}, {76})
+
+    def test_build_barcodes_pdf_workers(self):
+        barcodes = ['%09d' % i for i in range(200)]
+        # pages made in worker processes are assembled in order
+        self.assertEqual(build_barcodes_pdf(barcodes, workers=3),
+                         build_barcodes_pdf(barcodes))
+        # more workers than pages
+        self.assertEqual(build_barcodes_pdf(barcodes[:5], workers=3),
+                         build_barcodes_pdf(barcodes[:5]))
+
+    def test_build_barcodes_pdf_empty(self):
+        objects = parse_pdf(build_barcodes_pdf([]))
+        self.assertIn('/Count 0 ', objects[2])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,187 @@
+from unittest import TestCase, main
+from copy import deepcopy
+from datetime import datetime, date, time
+
+from knimin.lib.survey_format import format_human_barcode, format_human_frame
+
+
+ZIP_LOOKUP = {'92037': {'USA': (32.8, -117.2, 100.1, 'CA')},
+              '80301': {'USA': (40.0, -105.2, 1600.0, 'CO')},
+              'SW1A': {'United Kingdom': (51.5, -0.1, 5.0, 'London')}}
+COUNTRY_LOOKUP = {'USA': 'USA', 'United Kingdom': 'United Kingdom'}
+NOW = datetime(2016, 6, 15)
+
+
+def _geocode(row, zipcode, country):
+    geo = ZIP_LOOKUP[zipcode][country]
+    row['LATITUDE'], row['LONGITUDE'], row['ELEVATION'], row['STATE'] = geo
+    row['COUNTRY'] = COUNTRY_LOOKUP[country]
+    row['GEO_LOC_NAME'] = ':'.join([row['COUNTRY'], row['STATE']])
+    return row
+
+
+def _row(**kwargs):
+    row = {'HEIGHT_CM': '170', 'WEIGHT_KG': '70',
+           'HEIGHT_UNITS': 'centimeters', 'WEIGHT_UNITS': 'kilograms',
+           'BIRTH_MONTH': 'March', 'BIRTH_YEAR': '1980', 'GENDER': 'Male',
+           'ZIP_CODE': '92037', 'ALCOHOL_FREQUENCY': 'Never',
+           'DIABETES': 'I do not have this condition',
+           'IBD': 'I do not have this condition',
+           'ANTIBIOTIC_HISTORY':
+               'I have not taken antibiotics in the past year.',
+           'IBD_DIAGNOSIS': 'I do not have this condition',
+           'SMOKING_FREQUENCY': 'Never'}
+    row.update(kwargs)
+    return row
+
+
+def _info(**kwargs):
+    info = {'site_sampled': 'Stool', 'country': 'USA', 'survey_id': 'abc',
+            'sample_date': date(2015, 12, 1), 'sample_time': time(9, 30),
+            'participant_name': 'Participant', 'ag_login_id': 'login'}
+    info.update(kwargs)
+    return info
+
+
+class TestSurveyFormat(TestCase):
+    def setUp(self):
+        self.rows = {
+            '000000001': _row(),
+            '000000002': _row(HEIGHT_CM='5.5', HEIGHT_UNITS='inches',
+                              WEIGHT_KG='150 lbs', WEIGHT_UNITS='pounds',
+                              ALCOHOL_FREQUENCY='Daily'),
+            '000000003': _row(HEIGHT_CM='', WEIGHT_KG='Unspecified',
+                              BIRTH_MONTH='Unspecified', GENDER=None,
+                              IBD_DIAGNOSIS_REFINED='Ulcerative colitis'),
+            '000000003.a': _row(ZIP_CODE='80301', BIRTH_YEAR='2015',
+                                HEIGHT_CM='50', WEIGHT_KG='4',
+                                IBD_DIAGNOSIS_REFINED="Ileal Crohn's Disease"),
+            '000000004': _row(ZIP_CODE='sw1a', BIRTH_YEAR='1930',
+                              ALCOHOL_FREQUENCY='Unspecified')}
+        self.info = {'000000001': _info(),
+                     '000000002': _info(sample_time=None, survey_id='dup',
+                                        site_sampled='Mouth'),
+                     '000000003': _info(sample_date=datetime(2016, 3, 4)),
+                     '000000004': _info(country='United Kingdom',
+                                        site_sampled='Right hand')}
+        self.dupes = {'dup': 'Other Name'}
+
+    def format_barcodes(self, rows, info):
+        errors = {}
+        for barcode in list(rows):
+            try:
+                format_human_barcode(barcode, rows[barcode],
+                                     info[barcode[:9]], self.dupes, _geocode,
+                                     NOW)
+            except Exception as e:
+                errors[barcode] = str(e)
+                del rows[barcode]
+        return errors
+
+    def test_format_human_barcode(self):
+        row = _row(HEIGHT_CM='72', HEIGHT_UNITS='inches')
+        format_human_barcode('000000001', row, _info(), {}, _geocode, NOW)
+        self.assertEqual(row['HEIGHT_CM'], 182)
+        self.assertEqual(row['HEIGHT_UNITS'], 'centimeters')
+        self.assertEqual(row['WEIGHT_KG'], 70)
+        self.assertEqual(row['BMI'], '20.93')
+        self.assertEqual(row['BMI_CAT'], 'Normal')
+        self.assertEqual(row['AGE_YEARS'], 36)
+        self.assertEqual(row['AGE_CAT'], '30s')
+        self.assertEqual(row['SEX'], 'male')
+        self.assertEqual(row['GEO_LOC_NAME'], 'USA:CA')
+        self.assertEqual(row['CENSUS_REGION'], 'West')
+        self.assertEqual(row['COLLECTION_TIMESTAMP'], '12/01/2015 09:30')
+        self.assertEqual(row['COLLECTION_SEASON'], 'Winter')
+        self.assertEqual(row['BODY_SITE'], 'UBERON:feces')
+        self.assertTrue(row['SUBSET_HEALTHY'])
+
+    def test_format_human_barcode_error(self):
+        with self.assertRaises(ValueError):
+            format_human_barcode('000000001', _row(HEIGHT_CM='1.2.3'),
+                                 _info(), {}, _geocode, NOW)
+
+    def test_format_human_barcode_unspecified(self):
+        row = _row(HEIGHT_CM='', WEIGHT_KG='Unspecified',
+                   BIRTH_MONTH='Unspecified', GENDER=None,
+                   IBD_DIAGNOSIS_REFINED="Ileal Crohn's Disease")
+        info = _info(sample_time=None, survey_id='dup')
+        format_human_barcode('000000002', row, info, {'dup': 'Other Name'},
+                             _geocode, NOW)
+        self.assertEqual(row['HEIGHT_CM'], 'Unspecified')
+        self.assertEqual(row['WEIGHT_KG'], 'Unspecified')
+        self.assertEqual(row['BMI'], 'Unspecified')
+        self.assertEqual(row['AGE_YEARS'], 'Unspecified')
+        self.assertEqual(row['SEX'], 'Unspecified')
+        self.assertEqual(row['IBD_DIAGNOSIS'], "Crohn's disease")
+        self.assertEqual(row['COLLECTION_TIME'], 'Unspecified')
+        self.assertEqual(row['COLLECTION_TIMESTAMP'], '12/01/2015 00:00')
+        self.assertEqual(info['sample_time'], time(0, 0))
+        self.assertFalse(row['SUBSET_HEALTHY'])
+
+    def test_format_human_barcode_pounds(self):
+        row = _row(WEIGHT_KG='150 lbs', WEIGHT_UNITS='pounds', ZIP_CODE='sw1a',
+                   ALCOHOL_FREQUENCY='Daily')
+        format_human_barcode('000000004', row, _info(country='United Kingdom'),
+                             {}, _geocode, NOW)
+        self.assertEqual(row['WEIGHT_KG'], 68)
+        self.assertEqual(row['WEIGHT_UNITS'], 'kilograms')
+        self.assertEqual(row['ALCOHOL_CONSUMPTION'], 'Yes')
+        self.assertEqual(row['GEO_LOC_NAME'], 'United Kingdom:London')
+        self.assertEqual(row['CENSUS_REGION'], 'Unspecified')
+
+    def test_format_human_frame(self):
+        exp = deepcopy(self.rows)
+        exp_errors = self.format_barcodes(exp, deepcopy(self.info))
+
+        obs = deepcopy(self.rows)
+        remaining = format_human_frame(obs, deepcopy(self.info), ZIP_LOOKUP,
+                                       COUNTRY_LOOKUP, self.dupes, NOW)
+        self.assertEqual(remaining, [])
+        self.assertEqual(exp_errors, {})
+        self.assertEqual(obs, exp)
+
+    def test_format_human_frame_leaves_barcodes(self):
+        self.rows.update({
+            # fail formatting
+            '000000005': _row(HEIGHT_CM='.'),
+            '000000006': _row(BIRTH_MONTH='Smarch'),
+            '000000007': _row(GENDER=1),
+            '000000008': _row(BIRTH_YEAR='2020'),
+            # need geocoding
+            '000000009': _row(ZIP_CODE='00000')})
+        del self.rows['000000002']['IBD']
+        for barcode in ('000000005', '000000006', '000000007', '000000008',
+                        '000000009'):
+            self.info[barcode] = _info()
+        self.info['000000009']['country'] = 'Canada'
+        exp_remaining = ['000000002', '000000005', '000000006', '000000007',
+                         '000000008', '000000009']
+
+        exp = deepcopy(self.rows)
+        del exp['000000009']
+        exp_errors = self.format_barcodes(exp, deepcopy(self.info))
+        self.assertEqual(sorted(exp_errors), exp_remaining[:-1])
+
+        obs = deepcopy(self.rows)
+        info = deepcopy(self.info)
+        remaining = format_human_frame(obs, info, ZIP_LOOKUP, COUNTRY_LOOKUP,
+                                       self.dupes, NOW)
+        self.assertEqual(remaining, [b for b in obs if b in exp_remaining])
+        for barcode in remaining:
+            self.assertEqual(obs[barcode], self.rows[barcode])
+
+        del obs['000000009']
+        rest = {b: obs.pop(b) for b in remaining if b in obs}
+        obs_errors = self.format_barcodes(rest, info)
+        obs.update(rest)
+        self.assertEqual(obs_errors, exp_errors)
+        self.assertEqual(obs, exp)
+
+    def test_format_human_frame_empty(self):
+        self.assertEqual(format_human_frame({}, {}, ZIP_LOOKUP,
+                                            COUNTRY_LOOKUP, {}, NOW), [])
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,9 @@ from socket import gaierror
 
 from knimin.lib.util import (combine_barcodes, categorize_age, categorize_etoh,
                              categorize_bmi, correct_bmi, correct_age,
-                             make_valid_kit_ids, get_printout_data, fetch_url)
+                             make_valid_kit_ids, get_printout_data, fetch_url,
+                             group_barcodes_by_base, index_barcode_suffixes,
+                             shard_barcodes)
 
 
 __author__ = "Adam Robbins-Pianka"
@@ -47,6 +49,43 @@ class UtilTests(TestCase):
         obs = combine_barcodes()
         self.assertEqual(obs, exp)
 
+    def test_index_barcode_suffixes(self):
+        obs = index_barcode_suffixes(['000001234.b', '000001234',
+                                      '000001234.a', '000005678',
+                                      '000009999.a', '000009999.a'])
+        exp = {'000001234': ['000001234.a', '000001234.b'],
+               '000009999': ['000009999.a']}
+        self.assertEqual(obs, exp)
+
+    def test_index_barcode_suffixes_none(self):
+        self.assertEqual(index_barcode_suffixes(['000001234']), {})
+        self.assertEqual(index_barcode_suffixes([]), {})
+
+    def test_group_barcodes_by_base(self):
+        obs = group_barcodes_by_base(['000001234.b', '000001234',
+                                      '000001234.a', '000005678',
+                                      '000009999.a', '000009999.a'])
+        exp = {'000001234': ['000001234', '000001234.a', '000001234.b'],
+               '000005678': ['000005678'],
+               '000009999': ['000009999.a']}
+        self.assertEqual(obs, exp)
+        self.assertEqual(group_barcodes_by_base([]), {})
+
+    def test_shard_barcodes(self):
+        obs = shard_barcodes(['000000005', '000000001.a', '000000003',
+                              '000000001', '000000002', '000000004.b',
+                              '000000004.a', '000000003'], 3)
+        exp = [['000000001', '000000001.a', '000000002'],
+               ['000000003', '000000004.a', '000000004.b'],
+               ['000000005']]
+        self.assertEqual(obs, exp)
+
+    def test_shard_barcodes_few(self):
+        self.assertEqual(shard_barcodes(['000000002', '000000001.a'], 4),
+                         [['000000001.a'], ['000000002']])
+        self.assertEqual(shard_barcodes(['000000001'], 0), [['000000001']])
+        self.assertEqual(shard_barcodes([], 2), [])
+
     def test_categorize_age(self):
         self.assertEqual('Unspecified', categorize_age(-2))
         self.assertEqual('baby', categorize_age(0))
@@ -1,3 +1,4 @@
+from collections import defaultdict
 from random import choice
 from StringIO import StringIO
 import time
@@ -80,6 +81,98 @@ def combine_barcodes(cli_barcodes=None, input_file=None):
     return cli_barcodes | file_barcodes
 
 
+def index_barcode_suffixes(barcodes):
+    """Maps base barcodes to the barcodes with appended info made from them
+
+    Parameters
+    ----------
+    barcodes : iterable of str
+        Barcodes, some possibly with appended info, e.g. 000001234.a
+
+    Returns
+    -------
+    dict of list of str
+        {base barcode: sorted barcodes with appended info, ...}, only for the
+        base barcodes that have any
+
+    Notes
+    -----
+    The base barcode is the first 9 characters. Looking up a base barcode is
+    constant time, so expanding query results to the barcodes requested does
+    not scan every barcode with appended info for every row.
+    """
+    index = defaultdict(list)
+    for barcode in sorted(set(barcodes)):
+        if len(barcode) > 9:
+            index[barcode[:9]].append(barcode)
+    return dict(index)
+
+
+def group_barcodes_by_base(barcodes):
+    """Groups barcodes by the base barcode they are made from
+
+    Parameters
+    ----------
+    barcodes : iterable of str
+        Barcodes, some possibly with appended info, e.g. 000001234.a
+
+    Returns
+    -------
+    dict of list of str
+        {base barcode: sorted distinct barcodes made from it, ...}
+
+    Notes
+    -----
+    The base barcode is the first 9 characters. Barcodes with appended info
+    replace their base barcode in the survey results, so they are pulled down
+    together with it.
+    """
+    by_base = defaultdict(list)
+    for barcode in set(barcodes):
+        by_base[barcode[:9]].append(barcode)
+    for group in by_base.values():
+        group.sort()
+    return dict(by_base)
+
+
+def shard_barcodes(barcodes, num_shards):
+    """Splits barcodes into contiguous shards of whole base barcodes
+
+    Parameters
+    ----------
+    barcodes : iterable of str
+        Barcodes, some possibly with appended info, e.g. 000001234.a
+    num_shards : int
+        Number of shards wanted
+
+    Returns
+    -------
+    list of list of str
+        The sorted barcodes split in up to `num_shards` shards, empty shards
+        left out. Shard sizes differ by at most one base barcode
+
+    Notes
+    -----
+    A base barcode and the barcodes with appended info made from it always
+    end up in the same shard, since they are pulled down together. Joining
+    the shards in order gives the barcodes sorted.
+    """
+    by_base = group_barcodes_by_base(barcodes)
+    bases = sorted(by_base)
+    if not bases:
+        return []
+    num_shards = max(1, min(num_shards, len(bases)))
+    size, extra = divmod(len(bases), num_shards)
+    shards = []
+    start = 0
+    for i in range(num_shards):
+        end = start + size + (1 if i < extra else 0)
+        shards.append([b for base in bases[start:end]
+                       for b in by_base[base]])
+        start = end
+    return shards
+
+
 def get_printout_data(kitinfo):
     """Produce the text for paper slips with kit credentials & mapping table
     """
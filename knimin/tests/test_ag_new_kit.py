@@ -2,6 +2,7 @@ from unittest import main
 
 from tornado.escape import url_escape
 from json import loads, dumps
+from time import sleep, time
 
 from knimin.tests.tornado_test_base import TestHandlerBase
 from knimin import db
@@ -49,6 +50,19 @@ class TestAGNewKitHandler(TestHandlerBase):
         self.assertIn("%i</span> unassigned barcodes" %
                       len(db.get_unassigned_barcodes()), response.body)
 
+    def wait_job(self, response):
+        """Polls the status of the job a post started until it finished"""
+        self.assertEqual(response.code, 200)
+        job = loads(response.body)['job']
+        start = time()
+        while time() - start < 30:
+            response = self.get('/ag_new_kit/status/?job=%s' % job)
+            if response.code != 200 or \
+                    loads(response.body)['status'] == 'done':
+                return response
+            sleep(0.1)
+        self.fail('job %s not finished' % job)
+
     def test_post(self):
         self.mock_login_admin()
         kits = [1, 2]
@@ -56,13 +70,16 @@ class TestAGNewKitHandler(TestHandlerBase):
         tag = 'abc'
 
         # check for correct results
-        response = self.post('/ag_new_kit/',
-                             {'tag': tag,
-                              'projects': ['PROJECT2', 'PROJECT5'],
-                              'swabs': swabs,
-                              'kits': kits,
-                              })
+        response = self.wait_job(self.post('/ag_new_kit/',
+                                           {'tag': tag,
+                                            'projects': ['PROJECT2',
+                                                         'PROJECT5'],
+                                            'swabs': swabs,
+                                            'kits': kits,
+                                            }))
         kitinfo = loads(response.body)
+        self.assertEqual(kitinfo['done'], sum(kits))
+        self.assertEqual(kitinfo['total'], sum(kits))
         self.assertEqual(len(kitinfo['kitinfo']), sum(kits))
         for k in kitinfo['kitinfo']:
             self.assertIn(tag, k[0])
@@ -70,6 +87,9 @@ class TestAGNewKitHandler(TestHandlerBase):
         self.assertEqual(len(kitinfo['kitinfo'][1][-1]), swabs[1])
         self.assertEqual(kitinfo['fields'],
                          "kit_id,password,verification_code,barcodes")
+        # the passwords are only handed out once
+        response = self.get(response.request.url[len(self.get_url('')):])
+        self.assertEqual(response.code, 404)
 
         # missing argument
         response = self.post('/ag_new_kit/',
@@ -80,61 +100,81 @@ class TestAGNewKitHandler(TestHandlerBase):
         self.assertEqual(response.code, 400)
 
         # too long tag
-        response = self.post('/ag_new_kit/',
-                             {'tag': 'toolongtag',
-                              'projects': ['PROJECT2', 'PROJECT5'],
-                              'swabs': swabs,
-                              'kits': kits,
-                              })
+        response = self.wait_job(self.post('/ag_new_kit/',
+                                           {'tag': 'toolongtag',
+                                            'projects': ['PROJECT2',
+                                                         'PROJECT5'],
+                                            'swabs': swabs,
+                                            'kits': kits,
+                                            }))
         # TODO: we should find more speaking ways to report an error to the
         # user, see issue: #113
         self.assertEqual(response.code, 500)
         self.assertIn("Tag must be 4 or less characters", response.body)
 
         # test that non existing projects are recognized.
-        response = self.post('/ag_new_kit/',
-                             {'tag': 'abc',
-                              'projects': ['doesNotExist', 'PROJECT5'],
-                              'swabs': swabs,
-                              'kits': kits,
-                              })
+        response = self.wait_job(self.post('/ag_new_kit/',
+                                           {'tag': 'abc',
+                                            'projects': ['doesNotExist',
+                                                         'PROJECT5'],
+                                            'swabs': swabs,
+                                            'kits': kits,
+                                            }))
         self.assertEqual(response.code, 500)
         self.assertIn("Project(s) given don\'t exist in database:",
                       response.body)
 
         # check for empty swabs list
-        response = self.post('/ag_new_kit/',
-                             {'tag': tag,
-                              'projects': ['PROJECT2', 'PROJECT5'],
-                              'swabs': [],
-                              'kits': kits,
-                              })
+        response = self.wait_job(self.post('/ag_new_kit/',
+                                           {'tag': tag,
+                                            'projects': ['PROJECT2',
+                                                         'PROJECT5'],
+                                            'swabs': [],
+                                            'kits': kits,
+                                            }))
         self.assertEqual(response.code, 500)
-        self.assertIn("SET assigned_on = NOW() WHERE barcode IN ()",
+        self.assertIn("Number of barcodes must be positive, 0 given",
                       response.body)
 
         # no kits given
-        response = self.post('/ag_new_kit/',
-                             {'tag': tag,
-                              'projects': ['PROJECT2', 'PROJECT5'],
-                              'swabs': swabs,
-                              'kits': [],
-                              })
+        response = self.wait_job(self.post('/ag_new_kit/',
+                                           {'tag': tag,
+                                            'projects': ['PROJECT2',
+                                                         'PROJECT5'],
+                                            'swabs': swabs,
+                                            'kits': [],
+                                            }))
         self.assertEqual(response.code, 500)
-        self.assertIn("SET assigned_on = NOW() WHERE barcode IN ()",
+        self.assertIn("Number of barcodes must be positive, 0 given",
                       response.body)
 
         # what if tag is None
-        response = self.post('/ag_new_kit/',
-                             {'tag': '',
-                              'projects': ['PROJECT2', 'PROJECT5'],
-                              'swabs': swabs,
-                              'kits': kits,
-                              })
+        response = self.wait_job(self.post('/ag_new_kit/',
+                                           {'tag': '',
+                                            'projects': ['PROJECT2',
+                                                         'PROJECT5'],
+                                            'swabs': swabs,
+                                            'kits': kits,
+                                            }))
         self.assertEqual(response.code, 200)
         kitinfo = loads(response.body)
         self.assertNotIn('_', kitinfo['kitinfo'][0][0])
 
 
+class TestAGNewKitStatusHandler(TestHandlerBase):
+    def test_get_not_authed(self):
+        response = self.get('/ag_new_kit/status/?job=abc')
+        self.assertEqual(response.code, 200)
+        port = self.get_http_port()
+        self.assertEqual(response.effective_url,
+                         'http://localhost:%d/login/?next=%s' %
+                         (port, url_escape('/ag_new_kit/status/?job=abc')))
+
+    def test_get_unknown_job(self):
+        self.mock_login_admin()
+        response = self.get('/ag_new_kit/status/?job=abc')
+        self.assertEqual(response.code, 404)
+
+
 if __name__ == "__main__":
     main()
@@ -3,6 +3,7 @@ from unittest import main
 from tornado.escape import url_escape
 
 from knimin.tests.tornado_test_base import TestHandlerBase
+from knimin.handlers.ag_search import AGSearchHandler
 from knimin import db
 
 
@@ -66,5 +67,39 @@ class testAGSearchHandler(TestHandlerBase):
                         else:
                             self.assertIn(sample[field], response.body)
 
+    def test_post_pages(self):
+        self.mock_login_admin()
+
+        search_term = 'tst_'
+        logins = sorted(set(db.search_participant_info(search_term)) |
+                        set(db.search_kits(search_term)) |
+                        set(db.search_barcodes(search_term)))
+        page_size = AGSearchHandler.page_size
+        AGSearchHandler.page_size = 1
+        try:
+            response = self.post('/ag_search/', {'search_term': search_term,
+                                                 'page': 2})
+        finally:
+            AGSearchHandler.page_size = page_size
+        self.assertEqual(response.code, 200)
+        self.assertIn('Page 2 of %d (%d logins found)'
+                      % (len(logins), len(logins)), response.body)
+        self.assertIn('value="1">Previous', response.body)
+        # only the login of the second page is shown
+        for login, shown in zip(logins, [False, True, False]):
+            email = db.get_login_info(login)[0]['email']
+            self.assertEqual(email in response.body, shown)
+
+        # pages that are not numbers show the first one
+        page_size = AGSearchHandler.page_size
+        AGSearchHandler.page_size = 1
+        try:
+            response = self.post('/ag_search/', {'search_term': search_term,
+                                                 'page': 'abc'})
+        finally:
+            AGSearchHandler.page_size = page_size
+        self.assertEqual(response.code, 200)
+        self.assertIn('Page 1 of %d' % len(logins), response.body)
+
 if __name__ == '__main__':
     main()
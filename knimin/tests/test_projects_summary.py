@@ -19,8 +19,8 @@ class TestProjectsSummaryHandler(TestHandlerBase):
         # check that correct information is printed on HTML page.
         for project_name in db.getProjectNames():
             num_barcodes = len(db.get_barcodes_for_projects([project_name]))
-            self.assertIn('<tr><td>%s</td>' % project_name, response.body)
-            self.assertIn('<td>%s</td></tr>' % num_barcodes, response.body)
+            self.assertIn('<tr><td>%s</td><td>%s</td>'
+                          % (project_name, num_barcodes), response.body)
 
 
 if __name__ == '__main__':
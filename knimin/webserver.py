@@ -15,7 +15,8 @@ from knimin.handlers.logged_in_index import LoggedInIndexHandler
 from knimin.handlers.barcode_util import BarcodeUtilHandler
 from knimin.handlers.ag_stats import AGStatsHandler
 from knimin.handlers.ag_edit_participant import AGEditParticipantHandler
-from knimin.handlers.ag_new_kit import AGNewKitHandler, AGNewKitDLHandler
+from knimin.handlers.ag_new_kit import (AGNewKitHandler, AGNewKitDLHandler,
+                                        AGNewKitStatusHandler)
 from knimin.handlers.ag_new_barcode import (AGNewBarcodeHandler,
                                             AGBarcodePrintoutHandler,
                                             AGBarcodeAssignedHandler)
@@ -58,6 +59,7 @@ class WebApplication(Application):
             (r"/ag_edit_participant/", AGEditParticipantHandler),
             (r"/ag_new_kit/", AGNewKitHandler),
             (r"/ag_new_kit/download/", AGNewKitDLHandler),
+            (r"/ag_new_kit/status/", AGNewKitStatusHandler),
             (r"/ag_new_barcode/", AGNewBarcodeHandler),
             (r"/ag_update_geocode/", AGUpdateGeocodeHandler),
             (r"/update_ebi/", UpdateEBIStatusHandler),